@@ -1,23 +1,20 @@
 import os
 import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import matplotlib.pyplot as plt
 from datetime import datetime
+from garmin_loader import list_data_files, load_records, parse_json_file
+from garmin_intraday import body_battery_day_stats
+from garmin_feature_store import feature_store_available, ingest, read_metric
+from garmin_cache import AnalysisCache, cached_preprocess
+from garmin_bootstrap import DEFAULT_RESAMPLES, combined_score_table
+from garmin_constants import DAYS_OF_WEEK
 
-# Function to load data from JSON files
-def load_data(data_type):
-    data = []
-    data_dir = os.path.join('garmin_data', data_type)
-    for filename in os.listdir(data_dir):
-        if filename.endswith('.json'):
-            with open(os.path.join(data_dir, filename), 'r') as f:
-                data.append(json.load(f))
-    return data
-
-# Load data
-stress_data = load_data('stress')
-sleep_data = load_data('sleep')
-body_battery_data = load_data('body_battery')
+# Function to load data from JSON files, parsed in parallel and yielded in date order
+def load_data(data_type, data_dir='garmin_data'):
+    return load_records(data_type, data_dir)
 
 # Preprocess data
 def preprocess_stress(data):
@@ -78,164 +75,271 @@ def preprocess_sleep(data):
     return df
 
 def preprocess_body_battery(data):
-    print("Debug: Body Battery Data")
-    print(json.dumps(data[:2], indent=2))  # Print first two days of data
-    
     if not data or not isinstance(data, list):
         return pd.DataFrame()
-    
-    body_battery_records = []
-    for day_data in data:
-        if 'bodyBatteryValuesArray' in day_data:
-            values = [entry[1] for entry in day_data['bodyBatteryValuesArray'] if len(entry) > 1 and entry[1] is not None]
-            if values:
-                max_body_battery = max(values)
-                min_body_battery = min(values)
-                avg_body_battery = sum(values) / len(values)
-                body_battery_records.append({
-                    'date': day_data['date'],
-                    'max_body_battery': max_body_battery,
-                    'min_body_battery': min_body_battery,
-                    'avg_body_battery': avg_body_battery
-                })
-    
-    df = pd.DataFrame(body_battery_records)
+
+    # One vectorized pass over every day in the payload
+    df = pd.DataFrame(body_battery_day_stats(data))
     if not df.empty:
         df['date'] = pd.to_datetime(df['date'])
     return df
 
-# Create DataFrames
-stress_df = pd.concat([preprocess_stress(d) for d in stress_data if d], ignore_index=True)
-sleep_df = pd.concat([preprocess_sleep(d) for d in sleep_data if d], ignore_index=True)
-body_battery_df = pd.concat([preprocess_body_battery(d) for d in body_battery_data if d], ignore_index=True)
-
-# After creating the stress_df
-print("Debug: Stress DataFrame Info")
-print(stress_df.info())
-print("\nFirst few rows of Stress DataFrame:")
-print(stress_df.head())
-
-# Print data info and first few rows
-for name, df in [("Stress", stress_df), ("Sleep", sleep_df), ("Body Battery", body_battery_df)]:
-    print(f"\n{name} DataFrame Info:")
-    print(df.info())
-    print(f"\nFirst few rows of {name} DataFrame:")
-    print(df.head())
-
-# Calculate daily averages
-stress_avg = pd.Series(dtype='float64')
-sleep_avg = pd.Series(dtype='float64')
-body_battery_avg = pd.Series(dtype='float64')
-
-if 'date' in stress_df.columns and 'averageStressLevel' in stress_df.columns:
-    stress_df['day_of_week'] = stress_df['date'].dt.day_name()
-    stress_avg = stress_df.groupby('day_of_week')['averageStressLevel'].mean().reindex(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
-else:
-    print("Warning: Required columns for stress analysis not found.")
-    print("Available columns in stress_df:", stress_df.columns)
-
-if 'date' in sleep_df.columns and 'deepSleepSeconds' in sleep_df.columns:
-    sleep_df['day_of_week'] = sleep_df['date'].dt.day_name()
-    sleep_avg = sleep_df.groupby('day_of_week')['deepSleepSeconds'].mean().reindex(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
-else:
-    print("Warning: Required columns for sleep analysis not found.")
-
-if 'date' in body_battery_df.columns and 'avg_body_battery' in body_battery_df.columns:
-    body_battery_df['day_of_week'] = body_battery_df['date'].dt.day_name()
-    body_battery_avg = body_battery_df.groupby('day_of_week')['avg_body_battery'].mean().reindex(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
-else:
-    print("Warning: Required columns for body battery analysis not found.")
-
-# Before calculating stress_avg
-print("\nDebug: Stress DataFrame columns:")
-print(stress_df.columns)
-print("\nUnique values in 'averageStressLevel' column:")
-print(stress_df['averageStressLevel'].unique())
-
-# Print the calculated averages
-print("\nStress Average by Day of Week:")
-print(stress_avg)
-print("\nSleep Average by Day of Week:")
-print(sleep_avg)
-print("\nBody Battery Average by Day of Week:")
-print(body_battery_avg)
-
-# Calculate sleep change
-if not sleep_df.empty and 'deepSleepSeconds' in sleep_df.columns:
-    sleep_df['next_day_sleep'] = sleep_df['deepSleepSeconds'].shift(-1)
-    sleep_df['sleep_change'] = sleep_df['next_day_sleep'] - sleep_df['deepSleepSeconds']
-    sleep_change_avg = sleep_df.groupby('day_of_week')['sleep_change'].mean().reindex(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
-
-    print("\nSleep Change Average by Day of Week:")
-    print(sleep_change_avg)
-else:
-    print("Not enough sleep data to calculate sleep change.")
-    sleep_change_avg = pd.Series()
-
-# Normalize the data and calculate combined score
-combined_score = None  # Initialize combined_score as None
-if not stress_avg.empty and not sleep_change_avg.empty:
+# Create DataFrames. With pyarrow installed, new raw files are ingested into the
+# Parquet feature store and only the needed columns are read back; otherwise the
+# raw JSON files are preprocessed, reusing the per-file results in the analysis
+# cache. workers is the number of parsing processes (default: one per CPU).
+def load_frames(data_dir='garmin_data', feature_dir='garmin_features', cache_dir='garmin_cache', rebuild=False,
+                cache_size_mb=256, workers=None):
+    if feature_store_available():
+        ingest(data_dir, feature_dir, metrics=['stress', 'sleep', 'body_battery'], rebuild=rebuild, workers=workers)
+        stress_df = read_metric('stress', columns=['averageStressLevel'], feature_dir=feature_dir)
+        sleep_df = read_metric('sleep', columns=['deepSleepSeconds'], feature_dir=feature_dir)
+        body_battery_df = read_metric('body_battery', columns=['max_body_battery', 'min_body_battery', 'avg_body_battery'], feature_dir=feature_dir)
+    else:
+        cache = AnalysisCache(cache_dir, max_bytes=cache_size_mb * 1024 * 1024)
+        try:
+            if rebuild:
+                print("Rebuilding analysis cache from raw data")
+                cache.clear()
+            stress_df = concat_frames(cached_preprocess(cache, 'stress', preprocess_stress, data_dir, workers))
+            sleep_df = concat_frames(cached_preprocess(cache, 'sleep', preprocess_sleep, data_dir, workers))
+            body_battery_df = concat_frames(cached_preprocess(cache, 'body_battery', preprocess_body_battery, data_dir, workers))
+        finally:
+            cache.close()
+    return stress_df, sleep_df, body_battery_df
+
+def concat_frames(frames):
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+# Day-of-week mean of a column
+def day_of_week_mean(df, column):
+    return df.groupby('day_of_week')[column].mean().reindex(DAYS_OF_WEEK)
+
+def print_frame_info(stress_df, sleep_df, body_battery_df):
+    for name, df in [("Stress", stress_df), ("Sleep", sleep_df), ("Body Battery", body_battery_df)]:
+        print(f"\n{name} DataFrame Info:")
+        print(df.info())
+        print(f"\nFirst few rows of {name} DataFrame:")
+        print(df.head())
+
+# Normalize the day-of-week averages and calculate the combined score (lower is better).
+# Returns (combined_score, best_day), both None without stress and sleep change data.
+def combine_scores(stress_avg, sleep_change_avg):
+    if stress_avg.empty or sleep_change_avg.empty:
+        return None, None
     stress_norm = (stress_avg - stress_avg.min()) / (stress_avg.max() - stress_avg.min())
     sleep_change_norm = (sleep_change_avg - sleep_change_avg.min()) / (sleep_change_avg.max() - sleep_change_avg.min())
-
-    # Calculate a combined score (lower is better)
     combined_score = stress_norm + sleep_change_norm
+    return combined_score, combined_score.idxmin()
+
+# Run the day-of-week analysis and return its results. Nothing is plotted here.
+def analyze(data_dir='garmin_data', feature_dir='garmin_features', cache_dir='garmin_cache',
+            rebuild_cache=False, cache_size_mb=256, debug=False, bootstrap_resamples=DEFAULT_RESAMPLES, workers=None):
+    stress_df, sleep_df, body_battery_df = load_frames(data_dir, feature_dir, cache_dir, rebuild_cache, cache_size_mb, workers)
+    if debug:
+        print_frame_info(stress_df, sleep_df, body_battery_df)
+
+    # Calculate daily averages
+    stress_avg = pd.Series(dtype='float64')
+    sleep_avg = pd.Series(dtype='float64')
+    body_battery_avg = pd.Series(dtype='float64')
+
+    if 'date' in stress_df.columns and 'averageStressLevel' in stress_df.columns:
+        stress_df['day_of_week'] = stress_df['date'].dt.day_name()
+        stress_avg = day_of_week_mean(stress_df, 'averageStressLevel')
+    else:
+        print("Warning: Required columns for stress analysis not found.")
+        print("Available columns in stress_df:", stress_df.columns)
 
-    print("\nCombined Score by Day of Week:")
-    print(combined_score)
-
-    # Print the best day
-    best_day = combined_score.idxmin()
-    print(f"\nThe best day for heavy exercise is: {best_day}")
-
-# Calculate the date range for the analysis
-start_date = min(stress_df['date'].min(), sleep_df['date'].min(), body_battery_df['date'].min())
-end_date = max(stress_df['date'].max(), sleep_df['date'].max(), body_battery_df['date'].max())
-date_range = f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"
+    if 'date' in sleep_df.columns and 'deepSleepSeconds' in sleep_df.columns:
+        sleep_df['day_of_week'] = sleep_df['date'].dt.day_name()
+        sleep_avg = day_of_week_mean(sleep_df, 'deepSleepSeconds')
+    else:
+        print("Warning: Required columns for sleep analysis not found.")
 
-def safe_save_fig(filename):
+    if 'date' in body_battery_df.columns and 'avg_body_battery' in body_battery_df.columns:
+        body_battery_df['day_of_week'] = body_battery_df['date'].dt.day_name()
+        body_battery_avg = day_of_week_mean(body_battery_df, 'avg_body_battery')
+    else:
+        print("Warning: Required columns for body battery analysis not found.")
+
+    # Calculate sleep change
+    sleep_change_avg = pd.Series(dtype='float64')
+    if not sleep_df.empty and 'deepSleepSeconds' in sleep_df.columns:
+        # Pair each night with the next calendar night, not the next row: a missing
+        # day must give a missing change rather than compare nights further apart
+        deep_sleep_by_date = sleep_df.drop_duplicates('date', keep='last').set_index('date')['deepSleepSeconds']
+        sleep_df['next_day_sleep'] = (sleep_df['date'] + pd.Timedelta(days=1)).map(deep_sleep_by_date)
+        sleep_df['sleep_change'] = sleep_df['next_day_sleep'] - sleep_df['deepSleepSeconds']
+        sleep_change_avg = day_of_week_mean(sleep_df, 'sleep_change')
+    else:
+        print("Not enough sleep data to calculate sleep change.")
+
+    combined_score, best_day = combine_scores(stress_avg, sleep_change_avg)
+
+    # Bootstrap confidence intervals and probability of being the best day; seeded
+    # so that a rerun on the same data reports the same intervals
+    combined_score_ci = None
+    if combined_score is not None and bootstrap_resamples:
+        combined_score_ci = combined_score_table(stress_df, sleep_df, bootstrap_resamples, seed=0)
+        combined_score_ci.insert(0, 'score', combined_score)
+
+    # Calculate the date range for the analysis
+    frames = [df for df in (stress_df, sleep_df, body_battery_df) if 'date' in df.columns and not df.empty]
+    date_range = None
+    if frames:
+        start_date = min(df['date'].min() for df in frames)
+        end_date = max(df['date'].max() for df in frames)
+        date_range = f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"
+
+    return {
+        'stress_df': stress_df,
+        'sleep_df': sleep_df,
+        'body_battery_df': body_battery_df,
+        'stress_avg': stress_avg,
+        'sleep_avg': sleep_avg,
+        'body_battery_avg': body_battery_avg,
+        'sleep_change_avg': sleep_change_avg,
+        'combined_score': combined_score,
+        'best_day': best_day,
+        'combined_score_ci': combined_score_ci,
+        'date_range': date_range,
+    }
+
+def print_results(results):
+    print("\nStress Average by Day of Week:")
+    print(results['stress_avg'])
+    print("\nSleep Average by Day of Week:")
+    print(results['sleep_avg'])
+    print("\nBody Battery Average by Day of Week:")
+    print(results['body_battery_avg'])
+    print("\nSleep Change Average by Day of Week:")
+    print(results['sleep_change_avg'])
+    if results['combined_score'] is not None:
+        print("\nCombined Score by Day of Week:")
+        print(results['combined_score'])
+        print(f"\nThe best day for heavy exercise is: {results['best_day']}")
+    if results['combined_score_ci'] is not None:
+        ci = results['combined_score_ci']
+        print("\nCombined Score with 95% bootstrap confidence intervals:")
+        print(ci.round(3))
+        print(f"Probability that {results['best_day']} is the best day: {ci.loc[results['best_day'], 'prob_best']:.0%}"
+              f" (most often best in resamples: {ci['prob_best'].idxmax()})")
+
+# Version of the figure layouts; bump it to re-render every cached figure
+PLOT_VERSION = 1
+PLOT_HASHES_FILE = '.plot_hashes.json'
+
+# Save a figure atomically, so a failed save never leaves a truncated PNG behind
+def safe_save_fig(fig, filename):
+    tmp_filename = f"{filename}.tmp.png"
     try:
-        # Try to save the figure
-        plt.savefig(filename, bbox_inches='tight')
+        fig.savefig(tmp_filename, bbox_inches='tight')
+        os.replace(tmp_filename, filename)
+        return True
     except Exception as e:
         print(f"Error saving {filename}: {e}")
-        # If there's an error, try to save with a new filename
-        base, ext = os.path.splitext(filename)
-        counter = 1
-        while True:
-            new_filename = f"{base}_{counter}{ext}"
-            if not os.path.exists(new_filename):
-                print(f"Attempting to save as {new_filename}")
-                plt.savefig(new_filename, bbox_inches='tight')
-                break
-            counter += 1
-
-# Only visualize if combined_score exists and has valid data
-if combined_score is not None and not combined_score.empty:
-    plt.figure(figsize=(12, 8))
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        return False
+
+# Figure renderers. Each runs on its own (possibly in a worker process), so each
+# selects the non-interactive Agg backend and imports pyplot itself.
+def render_combined_score(filename, combined_score, date_range):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(12, 8))
     combined_score.plot(kind='bar')
     plt.title(f'Best Day for Heavy Exercise (Lower Score is Better)\nDate Range Analysed: {date_range}')
     plt.xlabel('Day of Week')
     plt.ylabel('Combined Score')
     plt.tight_layout()
-    safe_save_fig('combined_score.png')
-    plt.close()
+    saved = safe_save_fig(fig, filename)
+    plt.close(fig)
+    return saved
 
-    # Additional visualizations
-    fig, axs = plt.subplots(2, 2, figsize=(15, 15))
+def render_additional_plots(filename, stress_avg, sleep_avg, sleep_change_avg, date_range):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
 
+    fig, axs = plt.subplots(2, 2, figsize=(15, 15))
     stress_avg.plot(kind='bar', ax=axs[0, 0], title=f'Average Stress Level\nDate Range: {date_range}')
     axs[0, 1].axis('off')  # Turn off the empty plot for body battery
     sleep_avg.plot(kind='bar', ax=axs[1, 0], title=f'Average Deep Sleep (seconds)\nDate Range: {date_range}')
     sleep_change_avg.plot(kind='bar', ax=axs[1, 1], title=f'Average Sleep Change (Next Day)\nDate Range: {date_range}')
-
     plt.tight_layout()
-    safe_save_fig('additional_plots.png')
-    plt.close()
+    saved = safe_save_fig(fig, filename)
+    plt.close(fig)
+    return saved
+
+# Output file -> (renderer, keys of the results it draws)
+FIGURES = {
+    'combined_score.png': (render_combined_score, ('combined_score', 'date_range')),
+    'additional_plots.png': (render_additional_plots, ('stress_avg', 'sleep_avg', 'sleep_change_avg', 'date_range')),
+}
+
+# Hash of everything a figure is drawn from: the series values, their index and names
+def figure_input_hash(name, inputs):
+    digest = hashlib.sha1(f"{PLOT_VERSION}:{name}".encode())
+    for value in inputs:
+        if isinstance(value, pd.Series):
+            digest.update(repr((value.name, list(value.index), str(value.dtype))).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=False).values.tobytes())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+# Render combined_score.png and additional_plots.png. A figure whose inputs hash the
+# same as at its last render (recorded in <output_dir>/.plot_hashes.json) is skipped
+# unless force is set; the others are rendered in parallel worker processes.
+def plot_results(results, output_dir='.', force=False, workers=None):
+    combined_score = results['combined_score']
+    # Only visualize if combined_score exists and has valid data
+    if combined_score is None or combined_score.empty:
+        print("Not enough data to calculate combined score and create visualizations.")
+        return False
+
+    os.makedirs(output_dir, exist_ok=True)
+    hashes_path = os.path.join(output_dir, PLOT_HASHES_FILE)
+    hashes = {}
+    if os.path.exists(hashes_path):
+        with open(hashes_path, 'r') as f:
+            hashes = json.load(f)
+
+    pending = {}
+    for name, (render, keys) in FIGURES.items():
+        inputs = [results[key] for key in keys]
+        input_hash = figure_input_hash(name, inputs)
+        filename = os.path.join(output_dir, name)
+        if not force and hashes.get(name) == input_hash and os.path.exists(filename):
+            continue
+        pending[name] = (render, filename, inputs, input_hash)
+    if not pending:
+        print("Plots are up to date; nothing to render.")
+        return True
+
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(render, filename, *inputs) for name, (render, filename, inputs, _) in pending.items()}
+            saved = {name: future.result() for name, future in futures.items()}
+    else:
+        saved = {name: render(filename, *inputs) for name, (render, filename, inputs, _) in pending.items()}
+
+    for name, (_, _, _, input_hash) in pending.items():
+        if saved[name]:
+            hashes[name] = input_hash
+        else:
+            hashes.pop(name, None)
+    with open(f"{hashes_path}.tmp", 'w') as f:
+        json.dump(hashes, f)
+    os.replace(f"{hashes_path}.tmp", hashes_path)
 
-    print("Plots have been saved. Please check the current directory for the output files.")
-else:
-    print("Not enough data to calculate combined score and create visualizations.")
+    print(f"Rendered {sum(saved.values())} of {len(FIGURES)} plots. Please check the output directory for the output files.")
+    return all(saved.values())
 
 def is_sleep_file_non_empty(data):
     daily_sleep = data.get('dailySleepDTO', {})
@@ -263,12 +367,10 @@ def is_body_battery_file_non_empty(data):
     return False
 
 def find_earliest_non_empty_file(directory, data_type):
-    files = sorted([f for f in os.listdir(directory) if f.endswith('.json')])
-    for file in files:
-        file_path = os.path.join(directory, file)
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-        
+    # Loose files and archived payloads, in date order
+    for file_path in list_data_files(data_type, os.path.dirname(directory)):
+        data = parse_json_file(file_path)
+
         if data_type == 'sleep' and is_sleep_file_non_empty(data):
             return file_path
         elif data_type == 'stress':
@@ -293,38 +395,34 @@ def get_stress_level(data):
             return stress_level
     return None
 
-# Define data types and their directories
-data_types = ['sleep', 'stress', 'body_battery']
-data_dirs = {dt: os.path.join('garmin_data', dt) for dt in data_types}
-
 # Find earliest non-empty file for each data type and determine the overall start date
-earliest_dates = []
-for data_type, directory in data_dirs.items():
-    result = find_earliest_non_empty_file(directory, data_type)
-    if result:
-        if data_type == 'stress':
-            earliest_file, stress_level = result
-            filename = os.path.basename(earliest_file)
-            print(f"{data_type.capitalize()} - Earliest file: {filename} (Avg Stress Level: {stress_level})")
+def report_analysis_start_date(data_dir='garmin_data'):
+    earliest_dates = []
+    for data_type in ['sleep', 'stress', 'body_battery']:
+        directory = os.path.join(data_dir, data_type)
+        result = find_earliest_non_empty_file(directory, data_type) if os.path.isdir(directory) else None
+        if result:
+            if data_type == 'stress':
+                earliest_file, stress_level = result
+                filename = os.path.basename(earliest_file)
+                print(f"{data_type.capitalize()} - Earliest file: {filename} (Avg Stress Level: {stress_level})")
+            else:
+                filename = os.path.basename(result)
+                print(f"{data_type.capitalize()} - Earliest file: {filename}")
+            date = datetime.strptime(filename.split('.')[0].split('_')[0], '%Y-%m-%d')
+            earliest_dates.append(date)
         else:
-            filename = os.path.basename(result)
-            print(f"{data_type.capitalize()} - Earliest file: {filename}")
-        date = datetime.strptime(filename.split('.')[0].split('_')[0], '%Y-%m-%d')
-        earliest_dates.append(date)
-    else:
-        print(f"No non-empty files found for {data_type}")
+            print(f"No non-empty files found for {data_type}")
 
-if earliest_dates:
-    analysis_start_date = max(earliest_dates)
-    print(f"\nAnalysis start date: {analysis_start_date.strftime('%Y-%m-%d')}")
-else:
+    if earliest_dates:
+        analysis_start_date = max(earliest_dates)
+        print(f"\nAnalysis start date: {analysis_start_date.strftime('%Y-%m-%d')}")
+        return analysis_start_date
     print("No valid dates found to determine analysis start date.")
-
-# Use this analysis_start_date for further data processing
+    return None
 
 def print_file_content(file_path):
-    with open(file_path, 'r') as f:
-        data = json.load(f)
+    data = parse_json_file(file_path)
     print(f"Content of {os.path.basename(file_path)}:")
     print(json.dumps(data, indent=2))
     print("\n")
@@ -352,3 +450,36 @@ def process_stress_files(stress_files):
     print(f"  Non-empty stress files: {len(non_empty_files)}")
     print(f"  Earliest file: {earliest_date.strftime('%Y-%m-%d')} (Avg Stress Level: {earliest_stress_level})")
     print(f"  Latest file: {latest_date.strftime('%Y-%m-%d')}")
+
+
+# Run analyze(), or the memory-bounded streaming analysis with --stream or --max-memory
+def analyze_from_args(args):
+    if args.stream or args.max_memory:
+        from garmin_streaming import analyze_streaming, parse_memory_size
+
+        try:
+            max_memory = parse_memory_size(args.max_memory) if args.max_memory else None
+            return analyze_streaming(args.data_dir, args.chunk_files, max_memory, args.debug, args.bootstrap_resamples)
+        except (ValueError, MemoryError) as e:
+            raise SystemExit(f"Streaming analysis stopped: {e}")
+    return analyze(args.data_dir, args.feature_dir, args.cache_dir, args.rebuild_cache, args.cache_size_mb, args.debug,
+                   args.bootstrap_resamples)
+
+def run_analysis(args, plot=True):
+    results = analyze_from_args(args)
+    print_results(results)
+    if plot:
+        plot_results(results, args.output_dir, force=args.force_plot)
+    return results
+
+def main(argv=None):
+    from garmin_cli import add_analysis_arguments
+
+    parser = argparse.ArgumentParser(description="Analyse Garmin data to find the best day for heavy exercise")
+    add_analysis_arguments(parser)
+    args = parser.parse_args(argv)
+    run_analysis(args)
+    report_analysis_start_date(args.data_dir)
+
+if __name__ == '__main__':
+    main()
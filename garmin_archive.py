@@ -0,0 +1,233 @@
+import os
+import sys
+import mmap
+import zlib
+import argparse
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed, append-only archive for raw Garmin payloads.
+#
+# Instead of one small JSON file per day, the payloads of a data type are kept
+# in one pack per month, garmin_data/<type>/<YYYY-MM>.pack, next to an index
+# <YYYY-MM>.idx with one "key offset length codec" line per payload. Every
+# payload is compressed on its own (zstd when the zstandard package is
+# installed, zlib otherwise), so a single day is read by slicing the
+# memory-mapped pack at its offset and decompressing just those bytes.
+#
+# Both files are only ever appended to: a refetched day is appended again and
+# the last index line for a key wins. A crash between the two writes leaves
+# unindexed bytes at the end of the pack, which are ignored.
+#
+# The loader sees archived payloads as paths inside the pack
+# (garmin_data/stress/2024-03.pack/2024-03-05.json), so everything built on
+# list_data_files reads loose files and archives alike.
+
+PACK_SUFFIX = '.pack'
+INDEX_SUFFIX = '.idx'
+CODEC_ZSTD = 'zstd'
+CODEC_ZLIB = 'zlib'
+DEFAULT_CODEC = CODEC_ZSTD if zstandard is not None else CODEC_ZLIB
+
+
+def compress(raw, codec=DEFAULT_CODEC):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=10).compress(raw)
+    return zlib.compress(raw, 6)
+
+
+def decompress(blob, codec):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("This archive was written with zstd; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
+
+
+# Payloads are packed by the month of their (first) date: 2024-03-05 -> 2024-03
+def pack_month(key):
+    return key[:7]
+
+
+def is_member_path(path):
+    return os.path.dirname(path).endswith(PACK_SUFFIX)
+
+
+def read_index(index_path):
+    entries = {}
+    if not os.path.exists(index_path):
+        return entries
+    with open(index_path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            # A torn last line from an interrupted write has fewer fields
+            if len(parts) == 4:
+                key, offset, length, codec = parts
+                entries[key] = (int(offset), int(length), codec)
+    return entries
+
+
+# All archived payloads of one type directory
+class Archive:
+    def __init__(self, type_dir):
+        self.type_dir = type_dir
+        self.lock = threading.Lock()
+        self.indexes = {}
+
+    def _paths(self, month):
+        base = os.path.join(self.type_dir, month)
+        return base + PACK_SUFFIX, base + INDEX_SUFFIX
+
+    def months(self):
+        if not os.path.isdir(self.type_dir):
+            return []
+        return sorted(name[:-len(INDEX_SUFFIX)] for name in os.listdir(self.type_dir) if name.endswith(INDEX_SUFFIX))
+
+    # Cached per month and re-read when another process has appended to the index
+    def index(self, month):
+        index_path = self._paths(month)[1]
+        size = os.path.getsize(index_path) if os.path.exists(index_path) else 0
+        cached = self.indexes.get(month)
+        if cached is None or cached[0] != size:
+            cached = (size, read_index(index_path))
+            self.indexes[month] = cached
+        return cached[1]
+
+    # (key, pack path, offset, length, codec) for every payload, in key order
+    def entries(self):
+        result = []
+        for month in self.months():
+            pack_path = self._paths(month)[0]
+            for key, (offset, length, codec) in self.index(month).items():
+                result.append((key, pack_path, offset, length, codec))
+        return sorted(result)
+
+    def append(self, key, raw, codec=DEFAULT_CODEC):
+        month = pack_month(key)
+        pack_path, index_path = self._paths(month)
+        blob = compress(raw, codec)
+        with self.lock:
+            os.makedirs(self.type_dir, exist_ok=True)
+            with open(pack_path, 'ab') as pack:
+                offset = pack.tell()
+                pack.write(blob)
+                pack.flush()
+                os.fsync(pack.fileno())
+            with open(index_path, 'a') as index:
+                index.write(f"{key} {offset} {len(blob)} {codec}\n")
+
+    def read(self, key):
+        month = pack_month(key)
+        offset, length, codec = self.index(month)[key]
+        return read_blob(self._paths(month)[0], offset, length, codec)
+
+
+# Archives are shared by the threads of a process, one per type directory
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_archive(type_dir):
+    type_dir = os.path.normpath(type_dir)
+    with _archives_lock:
+        if type_dir not in _archives:
+            _archives[type_dir] = Archive(type_dir)
+        return _archives[type_dir]
+
+
+# Open packs stay mapped for the life of the process and are remapped when they grow
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+def read_blob(pack_path, offset, length, codec):
+    with _maps_lock:
+        size = os.path.getsize(pack_path)
+        mapped = _maps.get(pack_path)
+        if mapped is None or len(mapped) < offset + length:
+            if mapped is not None:
+                mapped.close()
+            with open(pack_path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            _maps[pack_path] = mapped
+        blob = mapped[offset:offset + length]
+    return decompress(blob, codec)
+
+
+# Raw JSON bytes of a member path as listed by list_members()
+def read_member(path):
+    type_dir = os.path.dirname(os.path.dirname(path))
+    key = os.path.basename(path)[:-len('.json')]
+    return get_archive(type_dir).read(key)
+
+
+# Member paths and their signatures (offset, length). An appended payload never
+# moves, so the offset and length identify its content like mtime and size do for a file.
+def list_members(type_dir):
+    return [
+        (os.path.join(pack_path, f"{key}.json"), (offset, length))
+        for key, pack_path, offset, length, _ in get_archive(type_dir).entries()
+    ]
+
+
+# Move the loose JSON files of a garmin_data tree into archives. Each payload is
+# read back and compared before its file is removed. Returns (files, bytes before, bytes after).
+def migrate(data_dir, keep_json=False, codec=DEFAULT_CODEC):
+    migrated, size_before = 0, 0
+    for data_type in sorted(os.listdir(data_dir)):
+        type_dir = os.path.join(data_dir, data_type)
+        if not os.path.isdir(type_dir):
+            continue
+        archive = get_archive(type_dir)
+        names = sorted(name for name in os.listdir(type_dir) if name.endswith('.json'))
+        for name in names:
+            path = os.path.join(type_dir, name)
+            with open(path, 'rb') as f:
+                raw = f.read()
+            key = name[:-len('.json')]
+            # Already archived by an earlier --keep-json run
+            archived = key in archive.index(pack_month(key)) and archive.read(key) == raw
+            if not archived:
+                archive.append(key, raw, codec)
+            if archive.read(key) != raw:
+                raise RuntimeError(f"Archived copy of {path} does not match the original; leaving it in place")
+            if not keep_json:
+                os.remove(path)
+            migrated += 1
+            size_before += len(raw)
+        if names:
+            print(f"Archived {len(names)} {data_type} files into {len(archive.months())} monthly packs")
+    size_after = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(data_dir) for name in files if name.endswith((PACK_SUFFIX, INDEX_SUFFIX))
+    )
+    return migrated, size_before, size_after
+
+
+def run_from_args(args):
+    if not os.path.isdir(args.data_dir):
+        raise SystemExit(f"{args.data_dir} does not exist")
+    codec = args.codec or DEFAULT_CODEC
+    if codec == CODEC_ZSTD and zstandard is None:
+        raise SystemExit("zstd needs the zstandard package (pip install zstandard)")
+    migrated, size_before, size_after = migrate(args.data_dir, args.keep_json, codec)
+    if not migrated:
+        print(f"No loose JSON files in {args.data_dir}; nothing to archive")
+        return
+    print(f"Archived {migrated} files: {size_before / 1e6:.1f} MB of JSON now take {size_after / 1e6:.1f} MB of packs")
+
+
+def main(argv=None):
+    from garmin_cli import add_archive_arguments
+
+    parser = argparse.ArgumentParser(description="Move raw JSON files into compressed monthly archives")
+    add_archive_arguments(parser)
+    run_from_args(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
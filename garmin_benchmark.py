@@ -0,0 +1,273 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import datetime
+import tempfile
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+
+from garmin_bootstrap import combined_score_table
+from garmin_correlation import correlation_table, load_daily_metrics
+from garmin_streaming import analyze_streaming
+from garmin_synthetic import MockGarminClient, write_synthetic_tree
+
+# Benchmark suite for the fetch and analysis pipeline.
+#
+# Every stage runs against a synthetic garmin_data tree (and, for the fetch,
+# a MockGarminClient with simulated latency and 429s), so runs are
+# reproducible and need no Garmin account. Each run is appended to a JSONL
+# history file and compared with the last run that used the same parameters.
+
+RESULTS_FILE = 'benchmark_results.jsonl'
+# A stage is reported as a regression when it is this much slower than last time
+REGRESSION_THRESHOLD = 0.20
+# ...and at least this many seconds slower, so millisecond stages don't flag on noise
+REGRESSION_MIN_SECONDS = 0.01
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Time func over repeat runs. setup (if given) runs untimed before each run.
+# Output from the stage is swallowed unless verbose is set.
+def time_stage(func, repeat=3, setup=None, verbose=False):
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        out = sys.stdout if verbose else io.StringIO()
+        with redirect_stdout(out):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+    return {'min': min(timings), 'median': statistics.median(timings), 'runs': len(timings)}
+
+
+# The load_data of the original script, kept as the baseline for the load_data stages:
+# one json.load per file, in directory order, in a single process
+def baseline_load_data(data_type, data_dir):
+    data = []
+    type_dir = os.path.join(data_dir, data_type)
+    for filename in os.listdir(type_dir):
+        if filename.endswith('.json'):
+            with open(os.path.join(type_dir, filename), 'r') as f:
+                data.append(json.load(f))
+    return data
+
+
+def bench_fetch(work_dir, days, workers, latency, throttle_rate, verbose=False):
+    import garmin_data_fetch
+    from garmin_rate_governor import RateGovernor
+
+    data_dir = os.path.join(work_dir, 'fetch', 'garmin_data')
+    shutil.rmtree(os.path.dirname(data_dir), ignore_errors=True)
+    mock = MockGarminClient(latency=latency, throttle_rate=throttle_rate)
+    garmin_data_fetch.setup(data_dir, garmin_client=mock)
+    # Measure the pipeline, not the production request ceiling or backoff
+    garmin_data_fetch.governor = RateGovernor(None, max_requests_per_minute=600000, burst=workers,
+                                              backoff_base=0.05, backoff_cap=1.0, metrics=garmin_data_fetch.metrics)
+    end_date = datetime.date.today() - datetime.timedelta(days=1)
+    start_date = end_date - datetime.timedelta(days=days - 1)
+    try:
+        with redirect_stdout(sys.stdout if verbose else io.StringIO()):
+            started = time.perf_counter()
+            jobs = garmin_data_fetch.build_fetch_jobs(start_date, end_date)
+            garmin_data_fetch.run_jobs(jobs, workers)
+            elapsed = time.perf_counter() - started
+        failed = sum(count for _, _, count in garmin_data_fetch.manifest.failure_counts())
+        snapshot = garmin_data_fetch.metrics.snapshot()
+    finally:
+        garmin_data_fetch.manifest.close()
+        garmin_data_fetch.metrics.close()
+    return {
+        'seconds': elapsed,
+        'jobs': len(jobs),
+        'requests': mock.calls,
+        'throttled': mock.throttled,
+        'failed_cells': failed,
+        'days_per_minute': days / (elapsed / 60),
+        'requests_per_second': mock.calls / elapsed,
+        'retries': sum(snapshot['retries'].values()),
+        'sleep_seconds': snapshot['sleep_seconds'],
+    }
+
+
+def run_benchmarks(args):
+    import garmin_analysis
+    from garmin_feature_store import feature_store_available, ingest
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='garmin_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    results = {}
+    try:
+        started = time.perf_counter()
+        data_dir = write_synthetic_tree(os.path.join(work_dir, 'synthetic'), days=args.days, seed=args.seed,
+                                        data_types=['sleep', 'stress', 'body_battery'])[0]
+        print(f"Generated {args.days} synthetic days in {time.perf_counter() - started:.1f} seconds")
+
+        if not args.skip_fetch:
+            fetch = bench_fetch(work_dir, args.fetch_days, args.workers, args.latency, args.throttle_rate, args.verbose)
+            results['fetch'] = {'min': fetch['seconds'], 'median': fetch['seconds'], 'runs': 1, **fetch}
+
+        loaded = {}
+        preprocessors = {
+            'stress': garmin_analysis.preprocess_stress,
+            'sleep': garmin_analysis.preprocess_sleep,
+            'body_battery': garmin_analysis.preprocess_body_battery,
+        }
+        for data_type, preprocess in preprocessors.items():
+            results[f'load_data_baseline_{data_type}'] = time_stage(
+                lambda: baseline_load_data(data_type, data_dir), args.repeat, verbose=args.verbose)
+            results[f'load_data_{data_type}'] = time_stage(
+                lambda: loaded.__setitem__(data_type, list(garmin_analysis.load_data(data_type, data_dir))),
+                args.repeat, verbose=args.verbose)
+            results[f'preprocess_{data_type}'] = time_stage(
+                lambda: [preprocess(data) for data in loaded[data_type]], args.repeat, verbose=args.verbose)
+
+        stress_df = garmin_analysis.concat_frames([garmin_analysis.preprocess_stress(data) for data in loaded['stress']])
+        stress_df['day_of_week'] = stress_df['date'].dt.day_name()
+        results['aggregate_day_of_week'] = time_stage(
+            lambda: stress_df.groupby('day_of_week')['averageStressLevel'].mean().reindex(garmin_analysis.DAYS_OF_WEEK),
+            args.repeat, verbose=args.verbose)
+
+        if feature_store_available():
+            feature_dir = os.path.join(work_dir, 'features')
+            results['ingest_cold'] = time_stage(
+                lambda: ingest(data_dir, feature_dir), args.repeat, verbose=args.verbose,
+                setup=lambda: shutil.rmtree(feature_dir, ignore_errors=True))
+
+        feature_dir = os.path.join(work_dir, 'analysis_features')
+        cache_dir = os.path.join(work_dir, 'analysis_cache')
+
+        def reset_analysis():
+            shutil.rmtree(feature_dir, ignore_errors=True)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+        analysis = {}
+        results['analyze_cold'] = time_stage(
+            lambda: analysis.update(garmin_analysis.analyze(data_dir, feature_dir, cache_dir)),
+            args.repeat, setup=reset_analysis, verbose=args.verbose)
+        results['analyze_warm'] = time_stage(
+            lambda: garmin_analysis.analyze(data_dir, feature_dir, cache_dir), args.repeat, verbose=args.verbose)
+
+        results['analyze_stream'] = time_stage(
+            lambda: analyze_streaming(data_dir, bootstrap_resamples=0), args.repeat, verbose=args.verbose)
+
+        results['bootstrap_ci'] = time_stage(
+            lambda: combined_score_table(analysis['stress_df'], analysis['sleep_df'], seed=0), args.repeat, verbose=args.verbose)
+
+        daily = load_daily_metrics(data_dir, feature_dir)
+        results['lagged_correlations'] = time_stage(lambda: correlation_table(daily, max_lag=14), args.repeat, verbose=args.verbose)
+
+        if not args.skip_plot:
+            plot_dir = os.path.join(work_dir, 'plots')
+            results['plot'] = time_stage(lambda: garmin_analysis.plot_results(analysis, plot_dir, force=True),
+                                         args.repeat, verbose=args.verbose)
+            results['plot_unchanged'] = time_stage(lambda: garmin_analysis.plot_results(analysis, plot_dir),
+                                                   args.repeat, verbose=args.verbose)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def load_history(results_file):
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Compare with the most recent run that used the same parameters.
+# Returns the names of the stages that regressed.
+def compare_with_previous(record, history, threshold=REGRESSION_THRESHOLD):
+    previous = next((run for run in reversed(history) if run['params'] == record['params']), None)
+    if previous is None:
+        print("\nNo earlier run with the same parameters to compare against.")
+        return []
+    print(f"\nCompared with {previous['timestamp']} ({previous.get('commit') or 'unknown commit'}):")
+    regressions = []
+    for stage, timing in record['results'].items():
+        before = previous['results'].get(stage)
+        if not before or not before['min']:
+            continue
+        change = timing['min'] / before['min'] - 1
+        flag = ''
+        if change > threshold and timing['min'] - before['min'] > REGRESSION_MIN_SECONDS:
+            flag = '  <-- REGRESSION'
+            regressions.append(stage)
+        print(f"  {stage:<32} {before['min']:9.3f}s -> {timing['min']:9.3f}s ({change:+.0%}){flag}")
+    return regressions
+
+
+def print_results(results):
+    print(f"\n{'Stage':<32} {'min (s)':>10} {'median (s)':>11}")
+    for stage, timing in results.items():
+        print(f"{stage:<32} {timing['min']:10.3f} {timing['median']:11.3f}")
+    speedups = [
+        f"{stage[len('load_data_baseline_'):]} {timing['min'] / results[stage.replace('_baseline', '')]['min']:.1f}x"
+        for stage, timing in results.items()
+        if stage.startswith('load_data_baseline_') and results.get(stage.replace('_baseline', ''), {}).get('min')
+    ]
+    if speedups:
+        print(f"\nload_data speed-up over the json.load baseline: {', '.join(speedups)}")
+    if 'fetch' in results:
+        fetch = results['fetch']
+        print(f"\nFetch: {fetch['jobs']} jobs, {fetch['requests']} requests ({fetch['throttled']} throttled), "
+              f"{fetch['days_per_minute']:.0f} days/minute, {fetch['requests_per_second']:.1f} requests/second")
+        if fetch.get('sleep_seconds'):
+            print(f"Fetch waits: {fetch['retries']} retries; "
+                  + ", ".join(f"{cause} {seconds:.2f}s" for cause, seconds in fetch['sleep_seconds'].items()))
+
+
+def run_from_args(args):
+    params = {
+        'days': args.days,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'fetch_days': None if args.skip_fetch else args.fetch_days,
+        'workers': args.workers,
+        'latency': args.latency,
+        'throttle_rate': args.throttle_rate,
+    }
+    results = run_benchmarks(args)
+    record = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPUs)",
+        'params': params,
+        'results': results,
+    }
+    print_results(results)
+    regressions = compare_with_previous(record, load_history(args.results))
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    print(f"\nResults appended to {args.results}")
+    if regressions and args.fail_on_regression:
+        print(f"{len(regressions)} stage(s) regressed by more than {REGRESSION_THRESHOLD:.0%}")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    from garmin_cli import add_benchmark_arguments
+
+    parser = argparse.ArgumentParser(description="Benchmark the fetch and analysis pipeline on synthetic data")
+    add_benchmark_arguments(parser)
+    return run_from_args(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
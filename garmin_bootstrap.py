@@ -0,0 +1,108 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+from garmin_constants import DAYS_OF_WEEK
+
+# Bootstrap uncertainty for the day-of-week combined score.
+#
+# The per-weekday observations of a metric are packed into a NaN-padded
+# (groups, 7, n) array, where a group is an athlete, a date window or just
+# the one analysis. Resampling with replacement is then a single gather with
+# random indices of shape (resamples, groups, 7, n), done in chunks to bound
+# memory, so thousands of resamples for many groups cost a few array
+# operations rather than a Python loop per resample.
+
+DEFAULT_RESAMPLES = 2000
+# Upper bound on the elements of one chunk of resampled values
+CHUNK_ELEMENTS = 4_000_000
+
+
+# Pack one column of each frame by weekday. frames is a DataFrame or a list of them,
+# each with 'day_of_week' and column. Returns (values (groups, 7, n), counts (groups, 7)).
+def pack_by_weekday(frames, column):
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    groups = []
+    for df in frames:
+        df = df[['day_of_week', column]].dropna()
+        groups.append([df.loc[df['day_of_week'] == day, column].to_numpy(dtype=np.float64) for day in DAYS_OF_WEEK])
+    width = max([1] + [len(day_values) for group in groups for day_values in group])
+    values = np.full((len(groups), 7, width), np.nan)
+    counts = np.zeros((len(groups), 7), dtype=np.int64)
+    for g, group in enumerate(groups):
+        for d, day_values in enumerate(group):
+            values[g, d, :len(day_values)] = day_values
+            counts[g, d] = len(day_values)
+    return values, counts
+
+
+# Means of n_resamples bootstrap resamples of every (group, weekday) cell.
+# Returns an array of shape (n_resamples, groups, 7); cells without data are NaN.
+def bootstrap_means(values, counts, n_resamples=DEFAULT_RESAMPLES, rng=None):
+    rng = rng if rng is not None else np.random.default_rng()
+    groups, days, width = values.shape
+    chunk = max(1, CHUNK_ELEMENTS // (groups * days * width))
+    valid = np.arange(width) < counts[..., None]
+    safe_counts = np.maximum(counts, 1)
+    flat_values = values.reshape(groups * days, width)
+    rows = np.arange(groups * days).reshape(1, groups, days, 1)
+
+    means = np.empty((n_resamples, groups, days))
+    for start in range(0, n_resamples, chunk):
+        size = min(chunk, n_resamples - start)
+        # Uniform indices into each cell's own observations
+        picks = (rng.random((size, groups, days, width)) * safe_counts[None, :, :, None]).astype(np.int64)
+        sample = flat_values[rows, picks]
+        means[start:start + size] = np.where(valid, sample, 0.0).sum(axis=-1) / safe_counts
+    means[:, counts == 0] = np.nan
+    return means
+
+
+# Min-max normalise along the weekday axis, as the point estimate does
+def normalize(day_means):
+    low = np.nanmin(day_means, axis=-1, keepdims=True)
+    high = np.nanmax(day_means, axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (day_means - low) / (high - low)
+
+
+# Bootstrap the combined score (normalised stress + normalised sleep change, lower is
+# better) for every group. Returns arrays of shape (groups, 7): the mean score, the
+# confidence interval bounds, and the probability that each weekday is the best day.
+def combined_score_bootstrap(stress, sleep_change, n_resamples=DEFAULT_RESAMPLES, confidence=0.95, seed=None):
+    rng = np.random.default_rng(seed)
+    stress_means = bootstrap_means(*stress, n_resamples=n_resamples, rng=rng)
+    sleep_change_means = bootstrap_means(*sleep_change, n_resamples=n_resamples, rng=rng)
+    scores = normalize(stress_means) + normalize(sleep_change_means)
+
+    tail = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        # Weekdays without data have only NaN scores
+        warnings.simplefilter('ignore', RuntimeWarning)
+        low, high = np.nanpercentile(scores, [tail, 100 - tail], axis=0)
+        mean = np.nanmean(scores, axis=0)
+    # Resamples where no weekday has a score (e.g. constant inputs) pick no best day
+    scored = ~np.isnan(scores).all(axis=-1)
+    best = np.argmin(np.where(np.isnan(scores), np.inf, scores), axis=-1)
+    prob_best = np.zeros(scores.shape[1:])
+    for day in range(scores.shape[-1]):
+        prob_best[:, day] = ((best == day) & scored).sum(axis=0)
+    prob_best /= np.maximum(scored.sum(axis=0), 1)[:, None]
+    return {'mean': mean, 'low': low, 'high': high, 'prob_best': prob_best}
+
+
+# Bootstrap table for one analysis: score, confidence interval and probability of best
+# per weekday, from the stress and sleep DataFrames built by analyze()
+def combined_score_table(stress_df, sleep_df, n_resamples=DEFAULT_RESAMPLES, confidence=0.95, seed=None):
+    result = combined_score_bootstrap(
+        pack_by_weekday(stress_df, 'averageStressLevel'),
+        pack_by_weekday(sleep_df, 'sleep_change'),
+        n_resamples, confidence, seed,
+    )
+    return pd.DataFrame({
+        'bootstrap_mean': result['mean'][0],
+        'ci_low': result['low'][0],
+        'ci_high': result['high'][0],
+        'prob_best': result['prob_best'][0],
+    }, index=pd.Index(DAYS_OF_WEEK, name='day_of_week'))
@@ -0,0 +1,139 @@
+import os
+import time
+import pickle
+import sqlite3
+
+from garmin_loader import list_data_files_with_signatures, parse_files
+
+# Disk-backed memoization for the analysis when pyarrow is not installed (with
+# pyarrow, the Parquet feature store plays this role and the cache is unused).
+#
+# Preprocessed rows are stored per raw file, keyed on the file's name, mtime
+# and size, so a re-run only parses and preprocesses files that are new or
+# changed. Entries are evicted least-recently-used once the cache grows past
+# its size limit.
+
+CACHE_DIR = 'garmin_cache'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Bump when preprocess_* output changes shape, so stale entries are not reused
+CACHE_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS cache_entries_last_used ON cache_entries (last_used);
+"""
+
+
+class AnalysisCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'analysis.sqlite'))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.conn.close()
+
+    def get_many(self, namespace, keys):
+        found = {}
+        keys = list(keys)
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows = self.conn.execute(
+                f"SELECT key, value FROM cache_entries WHERE namespace = ? AND key IN ({placeholders})",
+                [namespace, *chunk],
+            ).fetchall()
+            found.update((key, pickle.loads(value)) for key, value in rows)
+        if found:
+            now = time.time()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE cache_entries SET last_used = ? WHERE namespace = ? AND key = ?",
+                    [(now, namespace, key) for key in found],
+                )
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, namespace, key):
+        return self.get_many(namespace, [key]).get(key)
+
+    def put_many(self, namespace, items):
+        now = time.time()
+        rows = []
+        for key, value in items:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            rows.append((namespace, key, blob, len(blob), now))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        self.evict()
+
+    def put(self, namespace, key, value):
+        self.put_many(namespace, [(key, value)])
+
+    # Drop least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        evicted = 0
+        with self.conn:
+            for namespace, key, size in self.conn.execute(
+                "SELECT namespace, key, size FROM cache_entries ORDER BY last_used"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+                total -= size
+                evicted += 1
+        return evicted
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM cache_entries")
+        self.conn.execute("VACUUM")
+
+
+def file_cache_key(path, signature):
+    return f"{os.path.basename(path)}:{signature[0]}:{signature[1]}"
+
+
+# Run preprocess over every raw file of a data type, reusing cached per-file results.
+# Returns the per-file DataFrames in date order.
+def cached_preprocess(cache, data_type, preprocess, data_dir='garmin_data', workers=None):
+    namespace = f"v{CACHE_VERSION}:{preprocess.__name__}"
+    files = list_data_files_with_signatures(data_type, data_dir)
+    paths = [path for path, _ in files]
+    keys = [file_cache_key(path, signature) for path, signature in files]
+    cached = cache.get_many(namespace, keys)
+
+    missing = [(path, key) for path, key in zip(paths, keys) if key not in cached]
+    fresh = {}
+    for (_, key), (_, data) in zip(missing, parse_files([path for path, _ in missing], data_type, workers)):
+        fresh[key] = preprocess(data) if data else None
+    if fresh:
+        cache.put_many(namespace, fresh.items())
+
+    results = []
+    for key in keys:
+        df = cached[key] if key in cached else fresh[key]
+        if df is not None:
+            results.append(df)
+    return results
+
@@ -0,0 +1,275 @@
+import os
+import sys
+import argparse
+
+# Command line entry point: python garmin_cli.py <fetch|sync|archive|ingest|analyze|plot|intraday|correlate|rollups|squad|bench|synthetic> [options]
+#
+# Only argparse is imported at startup. Each subcommand imports the stage it
+# runs, so `--help` or the fetch stage never load pandas or matplotlib, and
+# the analysis never loads the Garmin client.
+
+
+def add_fetch_arguments(parser):
+    parser.add_argument("--date", help="Start date in YYYY-MM-DD format")
+    parser.add_argument("--workers", type=int, default=4, help="Number of concurrent fetch workers (default: 4)")
+    parser.add_argument("--repair-gaps", action="store_true", help="Refetch every missing or failed day since the first fetched date")
+    parser.add_argument("--data-dir", default='garmin_data', help="Directory to store the raw data in (default: garmin_data)")
+    parser.add_argument("--archive", action="store_true", help="Append new payloads to the compressed monthly archives instead of writing JSON files")
+    parser.add_argument("--tokenstore", default=os.getenv('GARMINTOKENS'), help="Directory to load and save the Garmin session tokens, so later runs skip the password login (default: $GARMINTOKENS)")
+    add_metrics_arguments(parser)
+
+
+# Fetch metrics outputs, shared by fetch and sync
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics-log", help="JSON-lines log of every request, retry and wait, appended to and rotated at 10 MB (default: <data-dir>/fetch_metrics.jsonl)")
+    parser.add_argument("--metrics-textfile", help="Prometheus textfile with the fetch metrics totals; point it into node_exporter's textfile collector directory (default: <data-dir>/garmin_fetch.prom)")
+    parser.add_argument("--no-metrics", action="store_true", help="Do not write the fetch metrics log or textfile")
+
+
+def add_sync_arguments(parser):
+    parser.add_argument("--data-dir", default='garmin_data', help="Raw data directory (default: garmin_data)")
+    parser.add_argument("--feature-dir", default='garmin_features', help="Feature store directory (default: garmin_features)")
+    parser.add_argument("--cache-dir", default='garmin_cache', help="Analysis cache directory (default: garmin_cache)")
+    parser.add_argument("--intraday-dir", default='garmin_intraday', help="Intraday store directory (default: garmin_intraday)")
+    parser.add_argument("--rollup-db", default='garmin_rollups.sqlite', help="Rollup database (default: garmin_rollups.sqlite)")
+    parser.add_argument("--output-dir", default='.', help="Directory for the plots and correlations.csv (default: current directory)")
+    parser.add_argument("--tokenstore", default=os.getenv('GARMINTOKENS', '~/.garminconnect'), help="Directory to load and save the Garmin session tokens (default: $GARMINTOKENS or ~/.garminconnect)")
+    parser.add_argument("--interval", type=float, default=30, help="Minutes between sync cycles (default: 30)")
+    parser.add_argument("--refresh-days", type=int, default=2, help="Most recent days refetched every cycle to pick up late data; 2 is today and yesterday (default: 2)")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent fetch workers (default: 2)")
+    parser.add_argument("--archive", action="store_true", help="Append new payloads to the compressed monthly archives instead of writing JSON files")
+    parser.add_argument("--stages", help="Comma-separated downstream stages to run on changes: ingest, analysis, intraday, rollups, correlations (default: all)")
+    parser.add_argument("--no-plot", action="store_true", help="Do not render the plots after the analysis")
+    parser.add_argument("--once", action="store_true", help="Run a single sync cycle and exit (e.g. from cron)")
+    add_metrics_arguments(parser)
+
+
+def add_archive_arguments(parser):
+    parser.add_argument("--data-dir", default='garmin_data', help="Raw data directory to migrate (default: garmin_data)")
+    parser.add_argument("--keep-json", action="store_true", help="Keep the JSON files after archiving them")
+    parser.add_argument("--codec", choices=['zstd', 'zlib'], help="Compression for new payloads (default: zstd if the zstandard package is installed, else zlib)")
+
+
+def add_ingest_arguments(parser):
+    parser.add_argument("--data-dir", default='garmin_data', help="Raw data directory (default: garmin_data)")
+    parser.add_argument("--feature-dir", default='garmin_features', help="Feature store directory (default: garmin_features)")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the existing tables and ingest every raw file again")
+
+
+def add_analysis_arguments(parser):
+    parser.add_argument("--data-dir", default='garmin_data', help="Raw data directory (default: garmin_data)")
+    parser.add_argument("--feature-dir", default='garmin_features', help="Feature store directory (default: garmin_features)")
+    parser.add_argument("--cache-dir", default='garmin_cache', help="Analysis cache directory (default: garmin_cache)")
+    parser.add_argument("--output-dir", default='.', help="Directory for the rendered plots (default: current directory)")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Rebuild the feature store (or, without pyarrow, the analysis cache) from the raw data")
+    parser.add_argument("--cache-size-mb", type=int, default=256, help="Maximum size of the analysis cache, used without pyarrow, in MB (default: 256)")
+    parser.add_argument("--bootstrap-resamples", type=int, default=2000, help="Bootstrap resamples for the combined score confidence intervals; 0 disables them (default: 2000)")
+    parser.add_argument("--force-plot", action="store_true", help="Render the plots even if their inputs have not changed since the last render")
+    parser.add_argument("--stream", action="store_true", help="Read the raw files in date-ordered chunks with bounded memory instead of using the feature store and cache")
+    parser.add_argument("--chunk-files", type=int, default=64, help="Raw files read per chunk in streaming mode (default: 64)")
+    parser.add_argument("--max-memory", help="Resident memory limit for streaming mode, e.g. 512M or 2G; chunks shrink to stay under it and the run stops if it cannot (implies --stream)")
+    parser.add_argument("--debug", action="store_true", help="Print DataFrame info and the first rows of each input")
+
+
+def add_intraday_arguments(parser):
+    parser.add_argument("--data-dir", default='garmin_data', help="Raw data directory (default: garmin_data)")
+    parser.add_argument("--store-dir", default='garmin_intraday', help="Intraday store directory (default: garmin_intraday)")
+    parser.add_argument("--heavy-minutes", type=float, default=30, help="Minutes at or above 120 bpm that make a heavy exercise day (default: 30)")
+
+
+def add_correlation_arguments(parser):
+    parser.add_argument("--data-dir", default='garmin_data', help="Raw data directory (default: garmin_data)")
+    parser.add_argument("--feature-dir", default='garmin_features', help="Feature store directory (default: garmin_features)")
+    parser.add_argument("--max-lag", type=int, default=7, help="Largest lag in days between the two metrics (default: 7)")
+    parser.add_argument("--min-periods", type=int, default=30, help="Fewest overlapping days needed to report a correlation (default: 30)")
+    parser.add_argument("--output", default='correlations.csv', help="CSV file for the full correlation table (default: correlations.csv)")
+    parser.add_argument("--top", type=int, default=20, help="Number of strongest relations to print (default: 20)")
+
+
+def add_rollup_arguments(parser):
+    parser.add_argument("--data-dir", default='garmin_data', help="Raw data directory (default: garmin_data)")
+    parser.add_argument("--db", default='garmin_rollups.sqlite', help="Rollup database (default: garmin_rollups.sqlite)")
+    parser.add_argument("--metrics", help="Comma-separated metrics (e.g. sleep,hrv) or series (e.g. sleep.deepSleepSeconds) to report (default: all)")
+    parser.add_argument("--start", help="First day of the range, YYYY-MM-DD (default: first day with data)")
+    parser.add_argument("--end", help="Last day of the range, YYYY-MM-DD (default: last day with data)")
+    parser.add_argument("--by", choices=['total', 'weekday', 'day', 'week', 'month'], default='total', help="Break the range down by weekday or period (default: total)")
+    parser.add_argument("--output", help="Also write the table to this CSV file")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the rollups from every raw file")
+    parser.add_argument("--no-update", action="store_true", help="Query the rollups as they are, without folding in new raw files first")
+
+
+def add_squad_arguments(parser):
+    parser.add_argument("roster", help="JSON roster file, or a directory with one <name>/garmin_data per athlete")
+    parser.add_argument("--squad-dir", default='squad', help="Where athletes without a data_dir keep their data (default: squad)")
+    parser.add_argument("--output-dir", default='squad_output', help="Directory for per-athlete outputs and the squad summary (default: squad_output)")
+    parser.add_argument("--processes", type=int, help="Athletes processed in parallel (default: number of CPUs)")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent fetch workers per athlete (default: 2)")
+    parser.add_argument("--max-requests-per-minute", type=int, default=30, help="Request budget shared by the whole squad (default: 30)")
+    parser.add_argument("--skip-fetch", action="store_true", help="Only analyse the data already on disk")
+    parser.add_argument("--rebuild-cache", action="store_true", help="Rebuild each athlete's analysis cache and feature store")
+    parser.add_argument("--no-plot", action="store_true", help="Do not render the per-athlete plots")
+
+
+def add_benchmark_arguments(parser):
+    parser.add_argument("--days", type=int, default=365, help="Days of synthetic history to analyse (default: 365)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage; the minimum is compared (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data (default: 0)")
+    parser.add_argument("--fetch-days", type=int, default=28, help="Days fetched from the mock client (default: 28)")
+    parser.add_argument("--workers", type=int, default=4, help="Fetch workers (default: 4)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mean mock request latency in seconds (default: 0.02)")
+    parser.add_argument("--throttle-rate", type=float, default=0.02, help="Fraction of mock requests answered with a 429 (default: 0.02)")
+    parser.add_argument("--skip-fetch", action="store_true", help="Skip the mock fetch benchmark")
+    parser.add_argument("--skip-plot", action="store_true", help="Skip the plotting benchmark")
+    parser.add_argument("--results", default='benchmark_results.jsonl', help="History file the results are appended to (default: benchmark_results.jsonl)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any stage is over 20%% slower than the last comparable run")
+    parser.add_argument("--work-dir", help="Keep the synthetic data and outputs in this directory instead of a temporary one")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the benchmarked stages")
+
+
+def add_synthetic_arguments(parser):
+    parser.add_argument("root", help="Directory to write the tree into")
+    parser.add_argument("--years", type=float, default=1, help="Years of history per user (default: 1)")
+    parser.add_argument("--users", type=int, default=1, help="Number of athletes (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+
+
+def cmd_fetch(args):
+    import garmin_data_fetch
+
+    garmin_data_fetch.run_from_args(args)
+
+
+def cmd_sync(args):
+    import garmin_sync
+
+    garmin_sync.run_from_args(args)
+
+
+def cmd_archive(args):
+    import garmin_archive
+
+    garmin_archive.run_from_args(args)
+
+
+def cmd_ingest(args):
+    import garmin_feature_store
+
+    garmin_feature_store.run_from_args(args)
+
+
+def cmd_analyze(args):
+    import garmin_analysis
+
+    garmin_analysis.run_analysis(args, plot=args.plot)
+    garmin_analysis.report_analysis_start_date(args.data_dir)
+
+
+def cmd_plot(args):
+    import garmin_analysis
+
+    results = garmin_analysis.analyze_from_args(args)
+    garmin_analysis.plot_results(results, args.output_dir, force=args.force_plot)
+
+
+def cmd_intraday(args):
+    import garmin_intraday
+
+    garmin_intraday.run_from_args(args)
+
+
+def cmd_correlate(args):
+    import garmin_correlation
+
+    garmin_correlation.run_from_args(args)
+
+
+def cmd_rollups(args):
+    import garmin_rollups
+
+    garmin_rollups.run_from_args(args)
+
+
+def cmd_squad(args):
+    import garmin_squad
+
+    return garmin_squad.run_from_args(args)
+
+
+def cmd_bench(args):
+    import garmin_benchmark
+
+    return garmin_benchmark.run_from_args(args)
+
+
+def cmd_synthetic(args):
+    import garmin_synthetic
+
+    garmin_synthetic.run_from_args(args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='garmin_cli.py', description="Fetch, ingest and analyse Garmin Connect data")
+    subparsers = parser.add_subparsers(dest='command', metavar='<command>')
+
+    fetch_parser = subparsers.add_parser('fetch', help="Download missing data from Garmin Connect")
+    add_fetch_arguments(fetch_parser)
+    fetch_parser.set_defaults(func=cmd_fetch)
+
+    sync_parser = subparsers.add_parser('sync', help="Keep the data and reports up to date, refreshing recent days on a schedule")
+    add_sync_arguments(sync_parser)
+    sync_parser.set_defaults(func=cmd_sync)
+
+    archive_parser = subparsers.add_parser('archive', help="Move raw JSON files into compressed monthly archives")
+    add_archive_arguments(archive_parser)
+    archive_parser.set_defaults(func=cmd_archive)
+
+    ingest_parser = subparsers.add_parser('ingest', help="Ingest new raw files into the Parquet feature store")
+    add_ingest_arguments(ingest_parser)
+    ingest_parser.set_defaults(func=cmd_ingest)
+
+    analyze_parser = subparsers.add_parser('analyze', help="Compute and print the day-of-week analysis")
+    add_analysis_arguments(analyze_parser)
+    analyze_parser.add_argument("--plot", action="store_true", help="Also render the plots")
+    analyze_parser.set_defaults(func=cmd_analyze)
+
+    plot_parser = subparsers.add_parser('plot', help="Render combined_score.png and additional_plots.png")
+    add_analysis_arguments(plot_parser)
+    plot_parser.set_defaults(func=cmd_plot)
+
+    intraday_parser = subparsers.add_parser('intraday', help="Update the intraday heart rate and stress store and report overnight HR dips")
+    add_intraday_arguments(intraday_parser)
+    intraday_parser.set_defaults(func=cmd_intraday)
+
+    correlate_parser = subparsers.add_parser('correlate', help="Lagged correlations between all daily metrics")
+    add_correlation_arguments(correlate_parser)
+    correlate_parser.set_defaults(func=cmd_correlate)
+
+    rollups_parser = subparsers.add_parser('rollups', help="Statistics of any metric over any date range from precomputed rollups")
+    add_rollup_arguments(rollups_parser)
+    rollups_parser.set_defaults(func=cmd_rollups)
+
+    squad_parser = subparsers.add_parser('squad', help="Fetch and analyse every athlete on a roster in parallel")
+    add_squad_arguments(squad_parser)
+    squad_parser.set_defaults(func=cmd_squad)
+
+    bench_parser = subparsers.add_parser('bench', help="Benchmark the pipeline on synthetic data and a mock client")
+    add_benchmark_arguments(bench_parser)
+    bench_parser.set_defaults(func=cmd_bench)
+
+    synthetic_parser = subparsers.add_parser('synthetic', help="Write a synthetic garmin_data tree for offline runs")
+    add_synthetic_arguments(synthetic_parser)
+    synthetic_parser.set_defaults(func=cmd_synthetic)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 0
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,4 @@
+# Constants shared by the analysis modules. This module imports nothing from
+# the project, so any module can import from it at load time without cycles.
+
+DAYS_OF_WEEK = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
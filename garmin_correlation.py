@@ -0,0 +1,142 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from garmin_feature_store import METRICS, feature_store_available, ingest, read_metric
+from garmin_loader import list_data_files, parse_files
+
+# Lagged cross-correlations between every pair of daily metrics.
+#
+# All daily metrics are aligned on one calendar index (missing days are NaN,
+# never skipped), and corr(a[t], b[t + lag]) is computed for every pair and
+# every lag 0..max_lag with pairwise-complete observations. The sums that
+# Pearson's r needs (count, sum, sum of squares and cross products over the
+# overlapping valid days) are cross-correlations of the zero-filled values
+# and the validity masks, so all of them are computed for the whole
+# metric x metric x lag cube with a handful of FFTs.
+
+CORRELATION_FILE = 'correlations.csv'
+DEFAULT_MAX_LAG = 7
+DEFAULT_MIN_PERIODS = 30
+
+
+# One column per metric field ("metric.field") on a continuous daily index.
+# Uses the feature store when pyarrow is installed, else extracts from the raw files.
+def load_daily_metrics(data_dir='garmin_data', feature_dir='garmin_features', metrics=None):
+    metrics = metrics or list(METRICS)
+    use_store = feature_store_available()
+    if use_store:
+        ingest(data_dir, feature_dir, metrics=metrics)
+
+    frames = []
+    for metric in metrics:
+        data_type, extractor, columns = METRICS[metric]
+        if use_store:
+            df = read_metric(metric, feature_dir=feature_dir)
+        else:
+            rows = extractor([data for _, data in parse_files(list_data_files(data_type, data_dir), data_type)])
+            df = pd.DataFrame(rows, columns=['date', *columns])
+            df['date'] = pd.to_datetime(df['date'])
+        if df.empty:
+            continue
+        df = df.drop_duplicates('date', keep='last').set_index('date')
+        df = df[list(columns)].apply(pd.to_numeric, errors='coerce').astype('float64')
+        frames.append(df.add_prefix(f"{metric}."))
+    if not frames:
+        return pd.DataFrame()
+
+    daily = pd.concat(frames, axis=1).sort_index()
+    # Drop fields that never have a value (e.g. not supported by the device)
+    daily = daily.loc[:, daily.notna().any()]
+    return daily.reindex(pd.date_range(daily.index.min(), daily.index.max(), freq='D'))
+
+
+# c[lag, i, j] = sum over t of a[t, i] * b[t + lag, j], for lag 0..max_lag, via FFT
+def _cross_sums(a_fft, b_fft, size, max_lag):
+    product = np.conj(a_fft)[:, :, None] * b_fft[:, None, :]
+    return np.fft.irfft(product, n=size, axis=0)[:max_lag + 1]
+
+
+# Pearson correlation of a[t] with b[t + lag] for every column pair and lag, over
+# the days where both are present. values is a (days, metrics) array with NaN for
+# missing days. Returns (r, n), both of shape (max_lag + 1, metrics, metrics);
+# r is NaN where fewer than min_periods days overlap.
+def lagged_correlations(values, max_lag=DEFAULT_MAX_LAG, min_periods=DEFAULT_MIN_PERIODS):
+    values = np.asarray(values, dtype=np.float64)
+    days = values.shape[0]
+    max_lag = min(max_lag, days - 1)
+    mask = ~np.isnan(values)
+    # Centre each column first so the sums stay well conditioned
+    centred = np.where(mask, values - np.nanmean(values, axis=0), 0.0)
+    size = 2 * days
+    mask_fft = np.fft.rfft(mask.astype(np.float64), n=size, axis=0)
+    value_fft = np.fft.rfft(centred, n=size, axis=0)
+    square_fft = np.fft.rfft(centred ** 2, n=size, axis=0)
+
+    n = np.rint(_cross_sums(mask_fft, mask_fft, size, max_lag))
+    sum_a = _cross_sums(value_fft, mask_fft, size, max_lag)
+    sum_b = _cross_sums(mask_fft, value_fft, size, max_lag)
+    sum_aa = _cross_sums(square_fft, mask_fft, size, max_lag)
+    sum_bb = _cross_sums(mask_fft, square_fft, size, max_lag)
+    sum_ab = _cross_sums(value_fft, value_fft, size, max_lag)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance = n * sum_ab - sum_a * sum_b
+        variance_a = n * sum_aa - sum_a ** 2
+        variance_b = n * sum_bb - sum_b ** 2
+        r = covariance / np.sqrt(variance_a * variance_b)
+    # Constant series and near-zero variances from FFT round-off have no correlation
+    tolerance = 1e-9 * np.maximum(n, 1) ** 2
+    r[(n < min_periods) | (variance_a <= tolerance) | (variance_b <= tolerance)] = np.nan
+    return np.clip(r, -1.0, 1.0), n.astype(np.int64)
+
+
+# Long table with one row per (metric_a, metric_b, lag): r is the correlation of
+# metric_a on a day with metric_b lag days later
+def correlation_table(daily, max_lag=DEFAULT_MAX_LAG, min_periods=DEFAULT_MIN_PERIODS):
+    r, n = lagged_correlations(daily.to_numpy(), max_lag, min_periods)
+    lags, first, second = np.meshgrid(np.arange(r.shape[0]), np.arange(r.shape[1]), np.arange(r.shape[2]), indexing='ij')
+    names = np.asarray(daily.columns)
+    table = pd.DataFrame({
+        'metric_a': names[first.ravel()],
+        'metric_b': names[second.ravel()],
+        'lag_days': lags.ravel(),
+        'n': n.ravel(),
+        'r': r.ravel(),
+    })
+    return table.dropna(subset=['r']).reset_index(drop=True)
+
+
+# The strongest relations between different metrics (lag 0 pairs are listed once)
+def strongest_correlations(table, top=20):
+    table = table[table['metric_a'].str.split('.').str[0] != table['metric_b'].str.split('.').str[0]]
+    table = table[(table['lag_days'] > 0) | (table['metric_a'] < table['metric_b'])]
+    return table.reindex(table['r'].abs().sort_values(ascending=False).index).head(top)
+
+
+def run_from_args(args):
+    started = time.time()
+    daily = load_daily_metrics(args.data_dir, args.feature_dir)
+    if daily.empty:
+        raise SystemExit(f"No daily metrics found in {args.data_dir}")
+    table = correlation_table(daily, args.max_lag, args.min_periods)
+    table.to_csv(args.output, index=False)
+    print(f"{daily.shape[1]} daily series over {len(daily)} days; "
+          f"{len(table)} correlations (lags 0-{args.max_lag}) written to {args.output} in {time.time() - started:.1f} seconds")
+    print("\nStrongest relations between metrics (r of metric_a with metric_b lag_days later):")
+    print(strongest_correlations(table, args.top).round(3).to_string(index=False))
+
+
+def main(argv=None):
+    from garmin_cli import add_correlation_arguments
+
+    parser = argparse.ArgumentParser(description="Lagged correlations between all daily Garmin metrics")
+    add_correlation_arguments(parser)
+    run_from_args(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
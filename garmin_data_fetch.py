@@ -3,6 +3,10 @@ import json
 import datetime
 import time
 import argparse
+import heapq
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from garminconnect import (
     Garmin,
     GarminConnectConnectionError,
@@ -11,185 +15,673 @@ from garminconnect import (
 )
 import requests
 from dotenv import load_dotenv
+from garmin_rate_governor import RateGovernor, get_retry_after, is_rate_limit_error, is_transient_error
+from garmin_fetch_metrics import FetchMetrics, OUTCOME_ERROR, OUTCOME_OK, OUTCOME_THROTTLED, SLEEP_RETRY_BACKOFF
+from garmin_manifest import FetchManifest, is_empty_payload
+from garmin_archive import get_archive, pack_month
+from garmin_loader import list_data_files
 
-# Load environment variables
-load_dotenv()
+# Rate limiting parameters
+MAX_REQUESTS_PER_MINUTE = 30
+MAX_FETCH_ATTEMPTS = 6
 
-# Initialize the client
-client = Garmin(os.getenv('GARMIN_EMAIL'), os.getenv('GARMIN_PASSWORD'))
+# Module state, set up by setup() so that importing this module does no network or file work
+data_dir = 'garmin_data'
+client = None
+manifest = None
+governor = None
+# FetchMetrics of this process: latencies, retries, errors, bytes and waits
+metrics = None
+# Append payloads to the compressed monthly archives instead of writing JSON files
+use_archive = False
 
-# Login to Garmin Connect
-client.login()
+# Create a logged-in client from the credentials in the environment / .env file.
+# With a tokenstore directory, saved session tokens are loaded (and refreshed when
+# they are about to expire) instead of logging in with the password, and the
+# session is saved back there for the next run.
+def create_client(email=None, password=None, tokenstore=None):
+    # Load environment variables
+    load_dotenv()
+    garmin_client = Garmin(email or os.getenv('GARMIN_EMAIL'), password or os.getenv('GARMIN_PASSWORD'))
+    # Login to Garmin Connect, reusing the saved session when there is one
+    if tokenstore and os.path.exists(os.path.expanduser(tokenstore)):
+        garmin_client.login(os.path.expanduser(tokenstore))
+    else:
+        garmin_client.login()
+    if tokenstore:
+        save_session(garmin_client, tokenstore)
+    return garmin_client
 
-# Base directory for storing data
-data_dir = 'garmin_data'
-os.makedirs(data_dir, exist_ok=True)
+# Save the client's session tokens to a tokenstore directory. Returns False for
+# clients without a saveable session (older or mock clients).
+def save_session(garmin_client, tokenstore):
+    # garminconnect keeps the session in .client; releases built on garth in .garth
+    session = getattr(garmin_client, 'garth', None) or getattr(garmin_client, 'client', None)
+    if session is None or not hasattr(session, 'dump'):
+        return False
+    path = os.path.expanduser(tokenstore)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    session.dump(path)
+    return True
 
-# Rate limiting parameters
-MAX_REQUESTS_PER_MINUTE = 30
-request_times = []
-
-def rate_limit():
-    now = time.time()
-    request_times.append(now)
-    if len(request_times) > MAX_REQUESTS_PER_MINUTE:
-        oldest = request_times.pop(0)
-        if now - oldest < 60:
-            sleep_time = 60 - (now - oldest)
-            print(f"[SCRIPT RATE LIMIT] Maximum requests per minute ({MAX_REQUESTS_PER_MINUTE}) reached. Pausing for {sleep_time:.2f} seconds.")
-            time.sleep(sleep_time)
-
-# Function to get and store data for a specific date and data type
-def get_and_store_data(date_str, data_type, get_data_func):
+# Point the fetcher at a data directory and client; logs in if no client is given.
+# rate_budget is an optional SharedRateBudget when several processes fetch at once.
+# metrics_log and metrics_textfile are where the fetch metrics are written as JSON
+# lines and in the Prometheus text format (neither is written when not given).
+def setup(data_directory='garmin_data', garmin_client=None, rate_budget=None, archive=False, tokenstore=None,
+          metrics_log=None, metrics_textfile=None, metrics_labels=None):
+    global data_dir, client, manifest, governor, use_archive, metrics
+    data_dir = data_directory
+    use_archive = archive
+    os.makedirs(data_dir, exist_ok=True)
+    client = garmin_client or create_client(tokenstore=tokenstore)
+    # Index of fetched (data_type, date) cells; built from the existing files on first use
+    manifest = FetchManifest(os.path.join(data_dir, 'manifest.sqlite'), data_dir)
+    if metrics is not None:
+        metrics.close()
+    metrics = FetchMetrics(metrics_log, metrics_textfile, metrics_labels)
+    governor = RateGovernor(os.path.join(data_dir, '.rate_governor.json'), max_requests_per_minute=MAX_REQUESTS_PER_MINUTE,
+                            shared_budget=rate_budget, metrics=metrics)
+
+# (JSON-lines log, Prometheus textfile) paths from the command line; by default
+# both go into the data directory, and --no-metrics turns them off
+def metrics_paths(args):
+    if args.no_metrics:
+        return None, None
+    return (args.metrics_log or os.path.join(args.data_dir, 'fetch_metrics.jsonl'),
+            args.metrics_textfile or os.path.join(args.data_dir, 'garmin_fetch.prom'))
+
+# Outcomes reported by the fetch jobs
+FETCH_STORED = 'stored'
+FETCH_THROTTLED = 'throttled'
+FETCH_FAILED = 'failed'
+# A transient error (connection error, timeout, 5xx); the job is retried later
+FETCH_RETRY = 'retry'
+
+# Request errors that may be transient; is_transient_error() decides from the response
+TRANSIENT_ERRORS = (GarminConnectConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError)
+
+# Requests issued in this run by data type, for the calls-per-day report
+api_calls = Counter()
+api_calls_lock = threading.Lock()
+# New or changed payloads written in this run by data type, for the sync daemon
+payloads_written = Counter()
+
+# Shared by all fetch workers, so the budget is global rather than per thread
+def rate_limit(data_type='first_date_probe'):
+    with api_calls_lock:
+        api_calls[data_type] += 1
+    waited = governor.acquire()
+    if waited >= 1:
+        print(f"[SCRIPT RATE LIMIT] Paced for {waited:.2f} seconds (current rate {governor.requests_per_minute:.1f} requests/minute).")
+
+# Tell the governor about a throttle; the job itself is retried later from the deferred
+# queue, and its cells are only marked failed once its last attempt is throttled
+def handle_rate_limit(data_type, date_strs, description, error, attempt=MAX_FETCH_ATTEMPTS):
+    if attempt >= MAX_FETCH_ATTEMPTS:
+        manifest.record_failure(data_type, date_strs, error)
+    hold = governor.record_throttle(get_retry_after(error))
+    print(f"[GARMIN API RATE LIMIT] Rate limit exceeded for {description}. Error: {error}")
+    print(f"Pausing requests for {hold:.0f} seconds; rate lowered to {governor.requests_per_minute:.1f} requests/minute.")
+    return FETCH_THROTTLED
+
+# Handle a failed request that was not a throttle. Transient errors are retried from the
+# deferred queue until the job runs out of attempts; only then are its cells marked failed.
+# Returns the fetch outcome, or None once the failure is recorded (the caller reports it).
+def handle_error(data_type, date_strs, description, error, attempt):
+    governor.record_error()
+    if is_transient_error(error) and attempt < MAX_FETCH_ATTEMPTS:
+        print(f"[TRANSIENT ERROR] Fetching {description} failed (attempt {attempt} of {MAX_FETCH_ATTEMPTS}): {error}. Retrying later.")
+        return FETCH_RETRY
+    manifest.record_failure(data_type, date_strs, error)
+    return None
+
+# Call a Garmin endpoint, recording its latency and outcome in the fetch metrics.
+# Exceptions are recorded by class and re-raised for the caller to handle.
+def timed_request(endpoint, func, *args, **fields):
+    started = time.perf_counter()
+    try:
+        data = func(*args)
+    except Exception as e:
+        throttled = isinstance(e, GarminConnectTooManyRequestsError) or is_rate_limit_error(e)
+        metrics.observe_request(endpoint, time.perf_counter() - started, OUTCOME_THROTTLED if throttled else OUTCOME_ERROR, e, **fields)
+        raise
+    metrics.observe_request(endpoint, time.perf_counter() - started, OUTCOME_OK, **fields)
+    return data
+
+# Raw bytes of the payload stored for a file path, loose or archived, or None
+def read_stored_payload(file_path):
+    if os.path.exists(file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+    key = os.path.basename(file_path)[:-len('.json')]
+    archive = get_archive(os.path.dirname(file_path))
+    if key in archive.index(pack_month(key)):
+        return archive.read(key)
+    return None
+
+# Write a payload to disk and record it in the manifest. With only_if_changed, a
+# payload identical to the stored one is not written again. Returns whether it was written.
+def store_payload(file_path, data_type, date_strs, data, only_if_changed=False):
+    payload = json.dumps(data)
+    if only_if_changed and read_stored_payload(file_path) == payload.encode():
+        manifest.record_success(data_type, date_strs, len(payload), is_empty_payload(data))
+        return False
+    if use_archive:
+        get_archive(os.path.dirname(file_path)).append(os.path.basename(file_path)[:-len('.json')], payload.encode())
+        # A loose file of the same name would shadow the archived payload
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    else:
+        with open(file_path, 'w') as f:
+            f.write(payload)
+    manifest.record_success(data_type, date_strs, len(payload), is_empty_payload(data))
+    metrics.add_bytes(data_type, len(payload))
+    with api_calls_lock:
+        payloads_written[data_type] += 1
+    return True
+
+# Function to get and store data for a specific date and data type. With refresh,
+# an already stored day is fetched again and only rewritten if its payload changed.
+# attempt is the job's attempt number (see run_jobs).
+def get_and_store_data(date_str, data_type, get_data_func, refresh=False, attempt=MAX_FETCH_ATTEMPTS):
     type_dir = os.path.join(data_dir, data_type)
     os.makedirs(type_dir, exist_ok=True)
     file_path = os.path.join(type_dir, f"{date_str}.json")
-    
-    if not os.path.exists(file_path):
+
+    rate_limit(data_type)
+    try:
+        data = timed_request(data_type, get_data_func, date_str, date=date_str)
+        written = store_payload(file_path, data_type, date_str, data, only_if_changed=refresh)
+        governor.record_success()
+        print(f"Stored {data_type} data for {date_str}" if written else f"No change in {data_type} data for {date_str}")
+        return FETCH_STORED
+    except (GarminConnectTooManyRequestsError, requests.exceptions.HTTPError) as e:
+        if isinstance(e, GarminConnectTooManyRequestsError) or is_rate_limit_error(e):
+            return handle_rate_limit(data_type, date_str, f"{data_type} data on {date_str}", e, attempt)
+        outcome = handle_error(data_type, date_str, f"{data_type} data on {date_str}", e, attempt)
+        if outcome:
+            return outcome
+        print(f"[HTTP ERROR] Error fetching {data_type} data for {date_str}: {e}")
+    except (GarminConnectConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        if is_rate_limit_error(e):
+            return handle_rate_limit(data_type, date_str, f"{data_type} data on {date_str}", e, attempt)
+        outcome = handle_error(data_type, date_str, f"{data_type} data on {date_str}", e, attempt)
+        if outcome:
+            return outcome
+        print(f"[CONNECTION ERROR] Failed to connect to Garmin API for {data_type} data on {date_str}: {e}")
+    except GarminConnectAuthenticationError as e:
+        manifest.record_failure(data_type, date_str, e)
+        print(f"[AUTHENTICATION ERROR] Failed to authenticate with Garmin API for {data_type} data on {date_str}: {e}")
+    except Exception as e:
+        manifest.record_failure(data_type, date_str, e)
+        print(f"[UNEXPECTED ERROR] An unexpected error occurred while fetching {data_type} data for {date_str}: {e}")
+    return FETCH_FAILED
+
+# Start of the account's history as far as the manifest knows: the result of an
+# earlier first-date search, or the first recorded cell (e.g. of a tree fetched
+# before the search existed). None if neither is known yet.
+def known_history_start():
+    dates = [manifest.first_date()]
+    searched = manifest.get_state('history_start')
+    if searched:
+        dates.append(datetime.date.fromisoformat(searched))
+    dates = [date for date in dates if date is not None]
+    return min(dates) if dates else None
+
+# Earlier than any Garmin Connect history; the first-date search never probes before it
+PROBE_FLOOR_DATE = datetime.date(2000, 1, 1)
+# The most recent days may not be synced from the watch yet, so the search starts before them
+RECENT_DAYS_SKIPPED = 3
+# A day without data only ends the history if this many consecutive galloping probes
+# (spaced further and further apart) are empty too, so a missing day or a short break
+# in wearing the watch is not taken for the start of the history
+CONFIRM_EMPTY_PROBES = 3
+# ...and the days right before a candidate first date must all be empty
+CONFIRM_EMPTY_DAYS = 7
+
+# A heart rate payload for a day without data still has its date and profile fields
+def heart_rate_has_data(data):
+    return isinstance(data, dict) and bool(data.get('heartRateValues') or data.get('restingHeartRate'))
+
+# Check whether there is heart rate data for a date. Results are cached in the manifest
+# as probes only; the payload is not stored, so probing never looks like fetch progress.
+# Throttles and transient errors are retried rather than read as "no data", and raised
+# once the attempts run out; a permanent client error (e.g. a 404) means no data that day.
+def check_data_exists(date):
+    date_str = date.strftime("%Y-%m-%d")
+    cached = manifest.get_probes([date_str]).get(date_str)
+    if cached is not None:
+        return cached
+
+    last_error = None
+    for attempt in range(MAX_FETCH_ATTEMPTS):
         rate_limit()
         try:
-            data = get_data_func(date_str)
-            with open(file_path, 'w') as f:
-                json.dump(data, f)
-            print(f"Stored {data_type} data for {date_str}")
-        except (GarminConnectTooManyRequestsError, requests.exceptions.HTTPError) as e:
-            error_message = str(e).lower()
-            if "too many request" in error_message or "rate limit" in error_message:
-                print(f"[GARMIN API RATE LIMIT] Rate limit exceeded for {data_type} data on {date_str}. Error: {e}")
-                print("Waiting for 60 seconds before retrying...")
-                time.sleep(60)  # Wait for 60 seconds before retrying
-                return get_and_store_data(date_str, data_type, get_data_func)  # Retry the request
-            else:
-                print(f"[HTTP ERROR] Error fetching {data_type} data for {date_str}: {e}")
-        except GarminConnectConnectionError as e:
-            print(f"[CONNECTION ERROR] Failed to connect to Garmin API for {data_type} data on {date_str}: {e}")
-        except GarminConnectAuthenticationError as e:
-            print(f"[AUTHENTICATION ERROR] Failed to authenticate with Garmin API for {data_type} data on {date_str}: {e}")
+            data = timed_request('first_date_probe', client.get_heart_rates, date_str, date=date_str)
+        except GarminConnectAuthenticationError:
+            raise
         except Exception as e:
-            print(f"[UNEXPECTED ERROR] An unexpected error occurred while fetching {data_type} data for {date_str}: {e}")
+            last_error = e
+            if isinstance(e, GarminConnectTooManyRequestsError) or is_rate_limit_error(e):
+                hold = governor.record_throttle(get_retry_after(e))
+                print(f"[GARMIN API RATE LIMIT] Probe for {date_str} throttled; pausing requests for {hold:.0f} seconds.")
+                retry_delay = 0.0
+            elif not is_transient_error(e):
+                print(f"[PROBE ERROR] Probe for {date_str} failed: {e}. Counting the day as without data.")
+                data = None
+                break
+            else:
+                governor.record_error()
+                retry_delay = governor.backoff_delay(attempt)
+                print(f"[PROBE ERROR] Probe for {date_str} failed: {e}. Retrying in {retry_delay:.0f} seconds.")
+                time.sleep(retry_delay)
+                metrics.add_sleep(SLEEP_RETRY_BACKOFF, retry_delay)
+            if attempt + 1 < MAX_FETCH_ATTEMPTS:
+                metrics.add_retry('first_date_probe', retry_delay, date=date_str, attempt=attempt + 2)
+            continue
+        governor.record_success()
+        break
     else:
-        print(f"{data_type} data for {date_str} already exists")
-
-# Function to find the last scanned date
-def find_last_scanned_date():
-    heart_rate_dir = os.path.join(data_dir, 'heart_rate')
-    if not os.path.exists(heart_rate_dir):
-        return None
-    
-    files = os.listdir(heart_rate_dir)
-    if not files:
-        return None
-    
-    latest_file = max(files)
-    return datetime.datetime.strptime(latest_file.split('.')[0], "%Y-%m-%d").date()
-
-# New function to check if data exists for a given date
-def check_data_exists(date):
-    rate_limit()
+        raise last_error
+
+    has_data = heart_rate_has_data(data)
+    # Recent days may simply not be synced yet, so only cache their positive results
+    if has_data or date < datetime.date.today() - datetime.timedelta(days=1):
+        manifest.record_probe(date_str, has_data)
+    return has_data
+
+# Find the first date with data. From anchor (a day with data, or the newest day
+# considered), gallop back over anchor - 1, 3, 7, 15, ... days until CONFIRM_EMPTY_PROBES
+# probes in a row are empty, then narrow the gap between the first of those empty days
+# and the oldest day with data. The candidate is only accepted if the CONFIRM_EMPTY_DAYS
+# days before it are empty; otherwise the search gallops on from the older day with data.
+# Each round probes up to `workers` dates concurrently. When no day with data is found
+# at all, the whole range back to PROBE_FLOOR_DATE is returned, so nothing is skipped.
+def find_first_data_date(workers=4):
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def probe(dates):
+            new_dates = [date for date in dict.fromkeys(dates) if date not in results]
+            results.update(zip(new_dates, executor.map(check_data_exists, new_dates)))
+
+        # (oldest day with data, first empty day past it) for the gallop from anchor
+        def gallop(anchor):
+            oldest_with_data, first_empty, empty_run = None, None, 0
+            offset = 0
+            while True:
+                dates = []
+                while len(dates) < workers:
+                    date = max(PROBE_FLOOR_DATE, anchor - datetime.timedelta(days=offset))
+                    if not dates or date != dates[-1]:
+                        dates.append(date)
+                    offset = offset * 2 + 1
+                    if date == PROBE_FLOOR_DATE:
+                        break
+                probe(dates)
+                for date in dates:
+                    if results[date]:
+                        oldest_with_data, first_empty, empty_run = date, None, 0
+                    else:
+                        first_empty = first_empty or date
+                        empty_run += 1
+                    if oldest_with_data is not None and empty_run >= CONFIRM_EMPTY_PROBES:
+                        return oldest_with_data, first_empty
+                if dates[-1] == PROBE_FLOOR_DATE:
+                    return oldest_with_data, first_empty
+
+        anchor = datetime.date.today() - datetime.timedelta(days=RECENT_DAYS_SKIPPED)
+        while True:
+            high, low = gallop(anchor)
+            if high is None:
+                # A brand-new account may only have the days the search skipped
+                recent = [datetime.date.today() - datetime.timedelta(days=i) for i in range(RECENT_DAYS_SKIPPED - 1, 0, -1)]
+                probe(recent)
+                recent_with_data = [date for date in recent if results[date]]
+                if recent_with_data:
+                    return recent_with_data[0]
+                print(f"No heart rate data found back to {PROBE_FLOOR_DATE}; planning the whole range instead.")
+                return PROBE_FLOOR_DATE
+            if low is None:
+                return high
+
+            # Narrowing phase: split (no data, data) into workers + 1 parts per round
+            while (high - low).days > 1:
+                span = (high - low).days
+                count = min(workers, span - 1)
+                candidates = sorted({low + datetime.timedelta(days=span * (i + 1) // (count + 1)) for i in range(count)})
+                probe(candidates)
+                with_data = [date for date in candidates if results[date]]
+                if with_data:
+                    high = min(with_data)
+                without_data = [date for date in candidates if not results[date] and date < high]
+                if without_data:
+                    low = max(without_data)
+
+            # Confirm the boundary: the days right before it must not have data either
+            window = [high - datetime.timedelta(days=i) for i in range(1, CONFIRM_EMPTY_DAYS + 1)]
+            window = [date for date in window if date >= PROBE_FLOOR_DATE]
+            probe(window)
+            earlier = [date for date in window if results[date]]
+            if not earlier:
+                return high
+            anchor = min(earlier)
+
+# Range endpoints: one request covers a span of days. Only body battery and resting
+# heart rate have one among the types fetched here; the others are per day only.
+RESTING_HEART_RATE_URL = '/userstats-service/wellness/daily'
+
+def fetch_body_battery_range(start_str, end_str):
+    return client.get_body_battery(start_str, end_str)
+
+# The endpoint behind get_rhr_day, asked for a whole range instead of a single day
+def fetch_resting_heart_rate_range(start_str, end_str):
+    url = f"{RESTING_HEART_RATE_URL}/{client.display_name}"
+    return client.connectapi(url, params={'fromDate': start_str, 'untilDate': end_str, 'metricId': 60})
+
+# Split a range response into the payload get_rhr_day would have returned for each day
+def split_resting_heart_rate(data, date_strs):
+    if not isinstance(data, dict):
+        return {date_str: data for date_str in date_strs}
+    metrics_map = (data.get('allMetrics') or {}).get('metricsMap') or {}
+    values_by_date = {}
+    for value in metrics_map.get('WELLNESS_RESTING_HEART_RATE') or []:
+        values_by_date.setdefault(value.get('calendarDate'), []).append(value)
+    return {
+        date_str: {
+            **data,
+            'statisticsStartDate': date_str,
+            'statisticsEndDate': date_str,
+            'allMetrics': {'metricsMap': {'WELLNESS_RESTING_HEART_RATE': values_by_date.get(date_str, [])}},
+        }
+        for date_str in date_strs
+    }
+
+# data_type -> (maximum days per request, fetch function, splitter). Without a splitter
+# the response is stored as one <start>_<end>.json file, as the analysis expects for body battery.
+# get_body_battery takes any start and end date, so body battery is asked for a month
+# at a time like resting heart rate: about 10 KB per day, so a month is still a modest
+# response, and a quarter of the requests of a week-long span.
+RANGE_DATA_TYPES = {
+    'body_battery': (31, fetch_body_battery_range, None),
+    'resting_heart_rate': (31, fetch_resting_heart_rate_range, split_resting_heart_rate),
+}
+
+# Function to get and store the data for a date range in one request
+# (with refresh, only payloads that changed are rewritten)
+def get_and_store_range(data_type, start_date, end_date, refresh=False, attempt=MAX_FETCH_ATTEMPTS):
+    _, fetch_range, split = RANGE_DATA_TYPES[data_type]
+    type_dir = os.path.join(data_dir, data_type)
+    os.makedirs(type_dir, exist_ok=True)
+    start_str, end_str = start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+    date_strs = [(start_date + datetime.timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end_date - start_date).days + 1)]
+    description = f"{data_type.replace('_', ' ')} data from {start_date} to {end_date}"
+
+    rate_limit(data_type)
     try:
-        data = client.get_heart_rates(date.strftime("%Y-%m-%d"))
-        return len(data) > 0
-    except Exception:
-        return False
+        data = timed_request(f"{data_type}_range", fetch_range, start_str, end_str, start=start_str, end=end_str)
+        if split is None:
+            written = store_payload(os.path.join(type_dir, f"{start_str}_{end_str}.json"), data_type, date_strs, data, refresh)
+        else:
+            written = False
+            for date_str, day_data in split(data, date_strs).items():
+                written |= store_payload(os.path.join(type_dir, f"{date_str}.json"), data_type, date_str, day_data, refresh)
+        governor.record_success()
+        print(f"Stored {description}" if written else f"No change in {description}")
+        return FETCH_STORED
+    except GarminConnectTooManyRequestsError as e:
+        return handle_rate_limit(data_type, date_strs, description, e, attempt)
+    except GarminConnectAuthenticationError as e:
+        manifest.record_failure(data_type, date_strs, e)
+        print(f"Error fetching {description}: {e}")
+    except TRANSIENT_ERRORS as e:
+        if is_rate_limit_error(e):
+            return handle_rate_limit(data_type, date_strs, description, e, attempt)
+        outcome = handle_error(data_type, date_strs, description, e, attempt)
+        if outcome:
+            return outcome
+        print(f"Error fetching {description}: {e}")
+    return FETCH_FAILED
+
+# Per-day data types and the client method used to fetch each of them
+DAILY_DATA_TYPES = [
+    ('sleep', 'get_sleep_data'),
+    ('stress', 'get_stress_data'),
+    ('heart_rate', 'get_heart_rates'),
+    ('hrv', 'get_hrv_data'),
+    ('training_readiness', 'get_training_readiness'),
+]
+
+FETCH_DATA_TYPES = [data_type for data_type, _ in DAILY_DATA_TYPES] + list(RANGE_DATA_TYPES)
+
+# The most recent days are not final yet (sleep and body battery keep arriving after
+# midnight). A range stored as one file ends before them, so the sync daemon refreshes
+# them by refetching a file of a day or two rather than a month-long range.
+UNSETTLED_DAYS = 2
 
-# New function to perform binary search for the first date with data
-def find_first_data_date():
-    end_date = datetime.date.today()
-    start_date = end_date - datetime.timedelta(days=365)
-    
-    while start_date <= end_date:
-        mid_date = start_date + (end_date - start_date) // 2
-        if check_data_exists(mid_date):
-            end_date = mid_date - datetime.timedelta(days=1)
+# First day in [start_date, end_date] with a cell that was never attempted, or None
+def first_planned_date(start_date, end_date):
+    cells = manifest.plan(FETCH_DATA_TYPES, start_date, end_date)
+    return datetime.date.fromisoformat(cells[0][1]) if cells else None
+
+# Build the job list for a range from the manifest: one job per missing (with
+# retry_failed, also failed) (date, data_type) cell for the per-day types, and for
+# the range types one job per run of consecutive such days, up to the endpoint's maximum
+# span. Runs of types stored as one file per range are split before the UNSETTLED_DAYS.
+def build_fetch_jobs(start_date, end_date, retry_failed=False):
+    unsettled_start = datetime.date.today() - datetime.timedelta(days=UNSETTLED_DAYS - 1)
+    get_data_funcs = {data_type: getattr(client, method) for data_type, method in DAILY_DATA_TYPES}
+    jobs = []
+    range_days = {data_type: [] for data_type in RANGE_DATA_TYPES}
+    for data_type, date_str in manifest.plan(list(get_data_funcs) + list(RANGE_DATA_TYPES), start_date, end_date, retry_failed):
+        if data_type in RANGE_DATA_TYPES:
+            range_days[data_type].append(datetime.date.fromisoformat(date_str))
         else:
-            start_date = mid_date + datetime.timedelta(days=1)
-    
-    return start_date
-
-# Parse command line arguments
-parser = argparse.ArgumentParser(description="Fetch Garmin Connect data")
-parser.add_argument("--date", help="Start date in YYYY-MM-DD format")
-args = parser.parse_args()
-
-# Set the start date and determine the run mode
-today = datetime.date.today()
-if args.date:
-    start_date = datetime.datetime.strptime(args.date, "%Y-%m-%d").date()
-    single_week_mode = True
-else:
-    last_scanned_date = find_last_scanned_date()
-    if last_scanned_date:
-        start_date = last_scanned_date + datetime.timedelta(days=1)
-    else:
-        print("No existing data found. Performing binary search to find the first date with data...")
-        start_date = find_first_data_date()
-        print(f"First date with data found: {start_date}")
-    single_week_mode = False
-
-# Check if start_date is in the future or today
-if start_date > today:
-    print(f"Start date {start_date} is in the future. No data to fetch. Exiting.")
-    exit(0)
-elif start_date == today:
-    print(f"Start date {start_date} is today. All available data has been fetched. Exiting.")
-    exit(0)
-
-# Main loop to process data
-while True:
-    end_date = start_date + datetime.timedelta(days=6)
-    if end_date > today:
-        end_date = today
-
-    if end_date < start_date:
-        print(f"End date {end_date} is before start date {start_date}. No data to fetch. Exiting.")
-        exit(0)
-
-    print(f"Fetching data from {start_date} to {end_date}")
-
-    # Get data for the specified date range
-    current_date = start_date
-    while current_date <= end_date:
-        date_str = current_date.strftime("%Y-%m-%d")
-        
-        get_and_store_data(date_str, 'sleep', client.get_sleep_data)
-        get_and_store_data(date_str, 'stress', client.get_stress_data)
-        get_and_store_data(date_str, 'heart_rate', client.get_heart_rates)
-        get_and_store_data(date_str, 'hrv', client.get_hrv_data)
-        get_and_store_data(date_str, 'training_readiness', client.get_training_readiness)
-        get_and_store_data(date_str, 'resting_heart_rate', client.get_rhr_day)
-        
-        current_date += datetime.timedelta(days=1)
-
-    # Get and store body battery data for the entire date range
-    body_battery_dir = os.path.join(data_dir, 'body_battery')
-    os.makedirs(body_battery_dir, exist_ok=True)
-    body_battery_file = os.path.join(body_battery_dir, f"{start_date.strftime('%Y-%m-%d')}_{end_date.strftime('%Y-%m-%d')}.json")
-
-    if not os.path.exists(body_battery_file):
-        rate_limit()
-        try:
-            body_battery_data = client.get_body_battery(start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
-            with open(body_battery_file, 'w') as f:
-                json.dump(body_battery_data, f)
-            print(f"Stored body battery data from {start_date} to {end_date}")
-        except GarminConnectTooManyRequestsError:
-            print(f"Too many requests for body battery data. Skipping for now.")
-        except (GarminConnectConnectionError, GarminConnectAuthenticationError) as e:
-            print(f"Error fetching body battery data: {e}")
-    else:
-        print(f"Body battery data from {start_date} to {end_date} already exists")
+            jobs.append((get_and_store_data, (date_str, data_type, get_data_funcs[data_type])))
 
+    for data_type, days in range_days.items():
+        max_days, _, split = RANGE_DATA_TYPES[data_type]
+        run_start = None
+        for i, day in enumerate(days):
+            if run_start is None:
+                run_start = day
+            next_day = days[i + 1] if i + 1 < len(days) else None
+            run_ends = next_day != day + datetime.timedelta(days=1) or (day - run_start).days >= max_days - 1
+            if run_ends or (split is None and next_day == unsettled_start):
+                jobs.append((get_and_store_range, (data_type, run_start, day)))
+                run_start = None
+    return jobs
+
+# Spans to refetch so that the given days of a range type are refreshed. For types
+# stored as one file per range, each day's stored file is refetched over its own
+# span, so the refreshed payload replaces it rather than overlapping it; as ranges
+# end before the UNSETTLED_DAYS (see build_fetch_jobs), those files are short.
+# Types split into daily files are refetched over the given days only.
+def refresh_spans(data_type, days):
+    max_days, _, split = RANGE_DATA_TYPES[data_type]
+    stored = []
+    if split is None:
+        for path in list_data_files(data_type, data_dir):
+            parts = os.path.basename(path)[:-len('.json')].split('_')
+            if len(parts) == 2:
+                stored.append((datetime.date.fromisoformat(parts[0]), datetime.date.fromisoformat(parts[1])))
+    spans = set()
+    uncovered = []
+    for day in days:
+        # The last file in name order is the one readers use
+        covering = [span for span in stored if span[0] <= day <= span[1]]
+        if covering:
+            spans.add(covering[-1])
+        else:
+            uncovered.append(day)
+    # Days without a stored file are fetched in runs of consecutive days
+    run = []
+    for day in uncovered + [None]:
+        if run and (day is None or day != run[-1] + datetime.timedelta(days=1) or len(run) == max_days):
+            spans.add((run[0], run[-1]))
+            run = []
+        if day is not None:
+            run.append(day)
+    return sorted(spans)
+
+# Jobs that refetch every data type for the given (consecutive) days, rewriting
+# only the payloads that changed. Used to pick up late-arriving data such as sleep.
+def build_refresh_jobs(days):
+    jobs = [
+        (get_and_store_data, (day.strftime("%Y-%m-%d"), data_type, getattr(client, method), True))
+        for day in days for data_type, method in DAILY_DATA_TYPES
+    ]
+    for data_type in RANGE_DATA_TYPES:
+        jobs.extend((get_and_store_range, (data_type, start, end, True)) for start, end in refresh_spans(data_type, days))
+    return jobs
+
+# Metrics endpoint (as named by timed_request) and dates of a fetch job
+def job_endpoint(func, func_args):
+    if func is get_and_store_range:
+        return f"{func_args[0]}_range", [str(func_args[1]), str(func_args[2])]
+    return func_args[1], [func_args[0]]
+
+# Log the metrics totals and rewrite the Prometheus textfile
+def write_metrics(run_seconds=None, jobs=None):
+    metrics.log('summary', run_seconds=None if run_seconds is None else round(run_seconds, 3), jobs=jobs, **metrics.snapshot())
+    gauges = {
+        'garmin_fetch_rate_requests_per_minute': ("Current request rate of the adaptive rate governor.", governor.requests_per_minute),
+        'garmin_fetch_last_run_timestamp_seconds': ("Unix time the last fetch run finished.", time.time()),
+    }
+    if run_seconds is not None:
+        gauges['garmin_fetch_last_run_duration_seconds'] = ("Wall time of the last fetch run.", run_seconds)
+        gauges['garmin_fetch_last_run_jobs'] = ("Fetch jobs planned in the last run.", jobs)
+    metrics.write_textfile(gauges)
+
+# Run every planned job through a bounded worker pool. The shared rate governor
+# paces the requests, so there is no fixed pause between weeks. Throttled jobs and
+# jobs that hit a transient error go to a deferred queue with their own backoff
+# instead of stalling a worker, for up to MAX_FETCH_ATTEMPTS attempts in all.
+def run_jobs(jobs, workers):
+    started = time.time()
+    deferred_jobs = []
+    deferred_sequence = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(func, *func_args, attempt=1): (func, func_args, 1) for func, func_args in jobs}
+        while pending or deferred_jobs:
+            now = time.time()
+            while deferred_jobs and deferred_jobs[0][0] <= now:
+                _, _, func, func_args, attempt = heapq.heappop(deferred_jobs)
+                pending[executor.submit(func, *func_args, attempt=attempt)] = (func, func_args, attempt)
+            if not pending:
+                # Every remaining job is waiting out its backoff
+                idle = max(0, deferred_jobs[0][0] - now)
+                time.sleep(idle)
+                metrics.add_sleep(SLEEP_RETRY_BACKOFF, idle)
+                continue
+
+            timeout = max(0, deferred_jobs[0][0] - now) if deferred_jobs else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                func, func_args, attempt = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"[UNEXPECTED ERROR] Fetch job failed: {e}")
+                    continue
+                if result not in (FETCH_THROTTLED, FETCH_RETRY):
+                    continue
+                if attempt >= MAX_FETCH_ATTEMPTS:
+                    print(f"[GARMIN API RATE LIMIT] Giving up on {func.__name__}{func_args[:2]} after {attempt} attempts.")
+                    continue
+                retry_delay = governor.backoff_delay(attempt)
+                endpoint, dates = job_endpoint(func, func_args)
+                metrics.add_retry(endpoint, retry_delay, dates=dates, attempt=attempt + 1)
+                deferred_sequence += 1
+                heapq.heappush(deferred_jobs, (time.time() + retry_delay, deferred_sequence, func, func_args, attempt + 1))
+    governor.save_state()
+    write_metrics(time.time() - started, len(jobs))
+
+# Fetch everything that was never attempted. With start_date, only the week starting
+# there is fetched; with repair_gaps, every missing or failed day since the first fetched date.
+# Returns the number of days covered, or 0 if there was nothing to do.
+def run_fetch(start_date=None, workers=4, repair_gaps=False):
+    # Set the start date and determine the run mode
+    with api_calls_lock:
+        api_calls.clear()
+    today = datetime.date.today()
+    single_week_mode = start_date is not None
+    if repair_gaps and not single_week_mode:
+        start_date = manifest.first_date()
+        if start_date is None:
+            print("Manifest is empty; there are no gaps to repair. Exiting.")
+            return 0
+        print(f"Repairing gaps from {start_date} to {today}")
+    elif not single_week_mode:
+        # Plan from the earliest cell never attempted since the start of the history, so
+        # days skipped by an interrupted run are picked up again. Failed cells are left
+        # to --repair-gaps, so one that fails every time is not refetched on every run.
+        history_start = known_history_start()
+        if history_start is None:
+            print("No existing data found. Searching for the first date with data...")
+            history_start = find_first_data_date(workers)
+            manifest.set_state('history_start', history_start.isoformat())
+            print(f"First date with data found: {history_start} ({api_calls['first_date_probe']} probe requests)")
+        start_date = first_planned_date(history_start, today)
+        if start_date is None:
+            print("All available data has been fetched. Exiting.")
+            return 0
+
+    # Check if start_date is in the future or today
+    if start_date > today:
+        print(f"Start date {start_date} is in the future. No data to fetch. Exiting.")
+        return 0
+    elif start_date == today and not repair_gaps:
+        print(f"Start date {start_date} is today. All available data has been fetched. Exiting.")
+        return 0
+
+    end_date = today
+    if single_week_mode:
+        end_date = min(start_date + datetime.timedelta(days=6), today)
+
+    print(f"Fetching data from {start_date} to {end_date} with {workers} workers")
+    jobs = build_fetch_jobs(start_date, end_date, retry_failed=repair_gaps)
+    print(f"{len(jobs)} fetch jobs planned for {'missing or failed' if repair_gaps else 'missing'} cells")
+    fetch_started = time.time()
+    run_jobs(jobs, workers)
+    fetch_elapsed = time.time() - fetch_started
+
+    days_fetched = (end_date - start_date).days + 1
+    days_per_minute = days_fetched / (fetch_elapsed / 60) if fetch_elapsed > 0 else float('inf')
     print(f"Data retrieval and storage complete for {start_date} to {end_date}")
-    
-    if single_week_mode or end_date >= today:
-        print("Reached end of specified range or current date. Exiting.")
-        break
-    
-    # Move to the next week
-    start_date = end_date + datetime.timedelta(days=1)
-    
-    # Wait for 60 seconds before starting the next week
-    print("Waiting 60 seconds before processing the next week...")
-    time.sleep(60)
-
-print("Script execution complete.")
\ No newline at end of file
+    print(f"Fetched {days_fetched} days ({len(jobs)} jobs) in {fetch_elapsed:.1f} seconds ({days_per_minute:.1f} days/minute)")
+    total_calls = sum(api_calls.values())
+    print(f"{total_calls} API calls for {days_fetched} covered days ({total_calls / days_fetched:.2f} calls per covered day): "
+          + ", ".join(f"{data_type} {count}" for data_type, count in sorted(api_calls.items())))
+    for line in metrics.summary_lines():
+        print(f"[METRICS] {line}")
+
+    for data_type, error_class, count in manifest.failure_counts():
+        print(f"[MANIFEST] {count} {data_type} days still failed ({error_class}); rerun with --repair-gaps to retry them")
+    return days_fetched
+
+def run_from_args(args):
+    if args.workers < 1:
+        raise SystemExit("--workers must be at least 1")
+    start_date = datetime.datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else None
+    metrics_log, metrics_textfile = metrics_paths(args)
+    setup(args.data_dir, archive=args.archive, tokenstore=args.tokenstore, metrics_log=metrics_log, metrics_textfile=metrics_textfile)
+    try:
+        run_fetch(start_date, args.workers, args.repair_gaps)
+    finally:
+        manifest.close()
+        metrics.close()
+    if metrics_textfile:
+        print(f"Fetch metrics written to {metrics_log} and {metrics_textfile}")
+    print("Script execution complete.")
+
+def main(argv=None):
+    from garmin_cli import add_fetch_arguments
+
+    parser = argparse.ArgumentParser(description="Fetch Garmin Connect data")
+    add_fetch_arguments(parser)
+    run_from_args(parser.parse_args(argv))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+import os
+import json
+import datetime
+import shutil
+import argparse
+import pandas as pd
+from garmin_loader import list_data_files_with_signatures, parse_files
+from garmin_intraday import body_battery_day_stats
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Columnar feature store built from the raw garmin_data/<type>/*.json files.
+#
+# Each metric is stored as a typed Parquet table partitioned by month
+# (garmin_features/<metric>/<YYYY-MM>.parquet), holding one row per day.
+# Ingest only parses raw files that are new or changed since the last run
+# (tracked by mtime and size) and rewrites just the months they touch, so
+# the analysis can read a few columns from a handful of files instead of
+# opening and parsing every raw payload.
+
+RAW_DATA_DIR = 'garmin_data'
+FEATURE_DIR = 'garmin_features'
+STATE_FILE = '_ingest_state.json'
+
+# Bump when a table's columns change; a store written by another version is rebuilt
+STORE_VERSION = 2
+
+
+def feature_store_available():
+    return pa is not None
+
+
+# Stress payloads are a dict (or list of dicts) with calendarDate and avgStressLevel
+def extract_stress(payloads):
+    items = []
+    for data in payloads:
+        if isinstance(data, dict):
+            data = [data]
+        elif not isinstance(data, list):
+            continue
+        for item in data:
+            if isinstance(item, dict):
+                items.append(item)
+            elif isinstance(item, list):
+                items.extend(i for i in item if isinstance(i, dict))
+    return [
+        {
+            'date': item['calendarDate'],
+            'averageStressLevel': item.get('avgStressLevel'),
+            'maxStressLevel': item.get('maxStressLevel'),
+        }
+        for item in items if item.get('calendarDate')
+    ]
+
+
+# Sleep payloads carry the daily totals in dailySleepDTO
+def extract_sleep(payloads):
+    rows = []
+    for data in payloads:
+        daily_sleep = (data.get('dailySleepDTO') or {}) if isinstance(data, dict) else {}
+        if not daily_sleep.get('calendarDate'):
+            continue
+        rows.append({
+            'date': daily_sleep['calendarDate'],
+            'sleepTimeSeconds': daily_sleep.get('sleepTimeSeconds'),
+            'deepSleepSeconds': daily_sleep.get('deepSleepSeconds'),
+            'lightSleepSeconds': daily_sleep.get('lightSleepSeconds'),
+            'remSleepSeconds': daily_sleep.get('remSleepSeconds'),
+            'awakeSleepSeconds': daily_sleep.get('awakeSleepSeconds'),
+        })
+    return rows
+
+
+# Body battery payloads are lists of days; all days are reduced in one vectorized pass
+def extract_body_battery(payloads):
+    days = [day_data for data in payloads if isinstance(data, list) for day_data in data]
+    return pd.DataFrame(body_battery_day_stats(days)).to_dict('records')
+
+
+# Daily heart rate payloads carry the resting, maximum and minimum rate next to the samples
+def extract_heart_rate(payloads):
+    return [
+        {
+            'date': data['calendarDate'],
+            'restingHeartRate': data.get('restingHeartRate'),
+            'maxHeartRate': data.get('maxHeartRate'),
+            'minHeartRate': data.get('minHeartRate'),
+        }
+        for data in payloads if isinstance(data, dict) and data.get('calendarDate')
+    ]
+
+
+# HRV payloads carry the nightly summary in hrvSummary
+def extract_hrv(payloads):
+    rows = []
+    for data in payloads:
+        summary = (data.get('hrvSummary') or {}) if isinstance(data, dict) else {}
+        if not summary.get('calendarDate'):
+            continue
+        rows.append({
+            'date': summary['calendarDate'],
+            'hrvLastNightAvg': summary.get('lastNightAvg'),
+            'hrvWeeklyAvg': summary.get('weeklyAvg'),
+            'hrvLastNight5MinHigh': summary.get('lastNight5MinHigh'),
+        })
+    return rows
+
+
+# Resting heart rate payloads hold a list of {value, calendarDate} under allMetrics.metricsMap
+def extract_resting_heart_rate(payloads):
+    rows = []
+    for data in payloads:
+        metrics_map = ((data.get('allMetrics') or {}).get('metricsMap') or {}) if isinstance(data, dict) else {}
+        for value in metrics_map.get('WELLNESS_RESTING_HEART_RATE') or []:
+            if isinstance(value, dict) and value.get('calendarDate'):
+                rows.append({'date': value['calendarDate'], 'restingHeartRate': value.get('value')})
+    return rows
+
+
+# Training readiness payloads are lists of the assessments made during the day; the last one is kept
+def extract_training_readiness(payloads):
+    rows = []
+    for data in payloads:
+        items = [item for item in data if isinstance(item, dict) and item.get('calendarDate')] if isinstance(data, list) else []
+        for item in sorted(items, key=lambda item: str(item.get('timestamp') or '')):
+            rows.append({
+                'date': item['calendarDate'],
+                'trainingReadinessScore': item.get('score'),
+                'trainingReadinessSleepScore': item.get('sleepScore'),
+                'recoveryTimeMinutes': item.get('recoveryTime'),
+            })
+    return rows
+
+
+# Metric name -> (raw data type, extractor over a list of payloads, column types)
+METRICS = {
+    'stress': ('stress', extract_stress, {
+        'averageStressLevel': 'float32',
+        'maxStressLevel': 'float32',
+    }),
+    'sleep': ('sleep', extract_sleep, {
+        'sleepTimeSeconds': 'float32',
+        'deepSleepSeconds': 'float32',
+        'lightSleepSeconds': 'float32',
+        'remSleepSeconds': 'float32',
+        'awakeSleepSeconds': 'float32',
+    }),
+    'body_battery': ('body_battery', extract_body_battery, {
+        'max_body_battery': 'float32',
+        'min_body_battery': 'float32',
+        'avg_body_battery': 'float32',
+        'p10_body_battery': 'float32',
+        'p50_body_battery': 'float32',
+        'p90_body_battery': 'float32',
+        'minutes_below_25': 'float32',
+        'charged': 'float32',
+        'drained': 'float32',
+        'charge_rate_per_hour': 'float32',
+        'drain_rate_per_hour': 'float32',
+    }),
+    'heart_rate': ('heart_rate', extract_heart_rate, {
+        'restingHeartRate': 'float32',
+        'maxHeartRate': 'float32',
+        'minHeartRate': 'float32',
+    }),
+    'hrv': ('hrv', extract_hrv, {
+        'hrvLastNightAvg': 'float32',
+        'hrvWeeklyAvg': 'float32',
+        'hrvLastNight5MinHigh': 'float32',
+    }),
+    'resting_heart_rate': ('resting_heart_rate', extract_resting_heart_rate, {
+        'restingHeartRate': 'float32',
+    }),
+    'training_readiness': ('training_readiness', extract_training_readiness, {
+        'trainingReadinessScore': 'float32',
+        'trainingReadinessSleepScore': 'float32',
+        'recoveryTimeMinutes': 'float32',
+    }),
+}
+
+
+def _schema(metric):
+    _, _, columns = METRICS[metric]
+    return pa.schema([('date', pa.date32())] + [(name, pa.from_numpy_dtype(dtype)) for name, dtype in columns.items()])
+
+
+def _load_state(feature_dir):
+    state_path = os.path.join(feature_dir, STATE_FILE)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+
+def _save_state(feature_dir, state):
+    state_path = os.path.join(feature_dir, STATE_FILE)
+    with open(f"{state_path}.tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(f"{state_path}.tmp", state_path)
+
+
+# Merge new day rows into the month partitions they fall in; later rows win per date
+def _write_partitions(metric_dir, metric, rows):
+    schema = _schema(metric)
+    new_df = pd.DataFrame(rows, columns=schema.names)
+    new_df['date'] = pd.to_datetime(new_df['date']).dt.date
+    for name in schema.names[1:]:
+        new_df[name] = pd.to_numeric(new_df[name], errors='coerce')
+    new_df['month'] = [d.strftime('%Y-%m') for d in new_df['date']]
+
+    for month, month_df in new_df.groupby('month'):
+        partition_path = os.path.join(metric_dir, f"{month}.parquet")
+        month_df = month_df.drop(columns='month')
+        if os.path.exists(partition_path):
+            existing = pq.read_table(partition_path).to_pandas()
+            month_df = pd.concat([existing, month_df], ignore_index=True)
+        month_df = month_df.drop_duplicates('date', keep='last').sort_values('date')
+        table = pa.Table.from_pandas(month_df, schema=schema, preserve_index=False)
+        pq.write_table(table, f"{partition_path}.tmp")
+        os.replace(f"{partition_path}.tmp", partition_path)
+
+
+# Parse new or changed raw files into the feature store. Returns files ingested per metric.
+# With rebuild=True the existing tables are dropped and every raw file is ingested again.
+# workers is the number of parsing processes (default: one per CPU).
+def ingest(raw_data_dir=RAW_DATA_DIR, feature_dir=FEATURE_DIR, metrics=None, rebuild=False, workers=None):
+    if not feature_store_available():
+        raise RuntimeError("pyarrow is required for the feature store (pip install pyarrow)")
+    if rebuild and os.path.isdir(feature_dir):
+        shutil.rmtree(feature_dir)
+    state = _load_state(feature_dir) if os.path.isdir(feature_dir) else {}
+    if state and state.get('_version') != STORE_VERSION:
+        print(f"Feature store in {feature_dir} was written by another version; rebuilding it")
+        shutil.rmtree(feature_dir)
+        state = {}
+    os.makedirs(feature_dir, exist_ok=True)
+    state['_version'] = STORE_VERSION
+    ingested = {}
+
+    for metric in metrics or METRICS:
+        data_type, extractor, _ = METRICS[metric]
+        if not os.path.isdir(os.path.join(raw_data_dir, data_type)):
+            continue
+        metric_state = state.setdefault(metric, {})
+        changed = {}
+        changed_paths = []
+        # In name order, so that for overlapping range files the later file wins
+        for path, signature in list_data_files_with_signatures(data_type, raw_data_dir):
+            name = os.path.basename(path)
+            if metric_state.get(name) != list(signature):
+                changed[name] = list(signature)
+                changed_paths.append(path)
+
+        rows = extractor([data for _, data in parse_files(changed_paths, data_type, workers)])
+
+        if rows:
+            metric_dir = os.path.join(feature_dir, metric)
+            os.makedirs(metric_dir, exist_ok=True)
+            _write_partitions(metric_dir, metric, rows)
+        metric_state.update(changed)
+        ingested[metric] = len(changed)
+
+    _save_state(feature_dir, state)
+    return ingested
+
+
+# Read a metric as a DataFrame, projecting columns and optionally restricting dates
+def read_metric(metric, columns=None, start_date=None, end_date=None, feature_dir=FEATURE_DIR):
+    metric_dir = os.path.join(feature_dir, metric)
+    schema = _schema(metric)
+    if columns is not None and 'date' not in columns:
+        columns = ['date'] + list(columns)
+    if not os.path.isdir(metric_dir) or not any(f.endswith('.parquet') for f in os.listdir(metric_dir)):
+        return pd.DataFrame(columns=columns or schema.names)
+
+    filters = []
+    if start_date is not None:
+        filters.append(('date', '>=', pd.Timestamp(start_date).date()))
+    if end_date is not None:
+        filters.append(('date', '<=', pd.Timestamp(end_date).date()))
+    table = pq.read_table(metric_dir, columns=columns, filters=filters or None, schema=schema)
+    df = table.to_pandas()
+    df['date'] = pd.to_datetime(df['date'])
+    return df.sort_values('date', ignore_index=True)
+
+
+def main(argv=None):
+    from garmin_cli import add_ingest_arguments
+
+    parser = argparse.ArgumentParser(description="Ingest raw Garmin JSON into the Parquet feature store")
+    add_ingest_arguments(parser)
+    run_from_args(parser.parse_args(argv))
+
+
+def run_from_args(args):
+    started = datetime.datetime.now()
+    counts = ingest(args.data_dir, args.feature_dir, rebuild=args.rebuild)
+    elapsed = (datetime.datetime.now() - started).total_seconds()
+    for metric, count in counts.items():
+        print(f"Ingested {count} new or changed {metric} files")
+    print(f"Ingest complete in {elapsed:.2f} seconds")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import Counter
+
+# Structured instrumentation of the fetcher.
+#
+# One FetchMetrics registry per fetch process collects, across all worker
+# threads:
+#
+#   - request latency histograms per endpoint (the data type, "<type>_range"
+#     for the range endpoints and "first_date_probe" for the first-date search)
+#   - request counts by endpoint and outcome (ok, throttled, error)
+#   - retries by endpoint and errors by endpoint and exception class
+#   - payload bytes written by data type
+#   - seconds spent waiting, by cause:
+#       rate_limit_pacing  waiting for a token of the adaptive rate governor
+#       throttle_hold      the governor on hold after a 429 / Retry-After
+#       shared_budget      waiting on the squad-wide SharedRateBudget
+#       retry_backoff      the fetch idle until a deferred job's backoff ends,
+#                          and the sleep before a failed probe is retried
+#
+# Every request is appended to a JSON-lines log as it completes, together
+# with each wait of a second or more. The log is rotated by size, as
+# logging's RotatingFileHandler does: once it passes METRICS_LOG_MAX_BYTES
+# it is renamed to <log>.1 (older copies shift to .2, .3, ...) and only
+# METRICS_LOG_BACKUPS old copies are kept. write_textfile() writes the totals
+# in the Prometheus text format for node_exporter's textfile collector.
+# Counters are cumulative for the life of the process, so a long-running sync
+# daemon exports proper monotonic counters.
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+OUTCOME_OK = 'ok'
+OUTCOME_THROTTLED = 'throttled'
+OUTCOME_ERROR = 'error'
+
+SLEEP_PACING = 'rate_limit_pacing'
+SLEEP_THROTTLE_HOLD = 'throttle_hold'
+SLEEP_SHARED_BUDGET = 'shared_budget'
+SLEEP_RETRY_BACKOFF = 'retry_backoff'
+
+# Waits shorter than this are only counted, not logged one by one
+LOGGED_SLEEP_SECONDS = 1.0
+
+# Size at which the JSON-lines log is rotated, and the number of rotated copies kept
+METRICS_LOG_MAX_BYTES = 10 * 1024 * 1024
+METRICS_LOG_BACKUPS = 3
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    # Cumulative (upper bound, count) pairs, as Prometheus buckets are
+    def buckets(self):
+        total = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+    # Estimated quantile, interpolated within the bucket as histogram_quantile() does
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower, below = 0.0, 0
+        for bound, total in self.buckets():
+            if total >= rank:
+                if bound == float('inf'):
+                    return lower
+                in_bucket = total - below
+                return lower + (bound - lower) * ((rank - below) / in_bucket if in_bucket else 0.0)
+            lower, below = bound, total
+        return lower
+
+
+class FetchMetrics:
+    def __init__(self, log_path=None, textfile_path=None, labels=None,
+                 max_log_bytes=METRICS_LOG_MAX_BYTES, log_backups=METRICS_LOG_BACKUPS):
+        self.log_path = log_path
+        self.textfile_path = textfile_path
+        self.max_log_bytes = max_log_bytes
+        self.log_backups = log_backups
+        # Constant labels added to every exported series (e.g. the athlete in a squad run)
+        self.labels = dict(labels or {})
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latency = {}
+        self.requests = Counter()
+        self.retries = Counter()
+        self.errors = Counter()
+        self.bytes_written = Counter()
+        self.payloads_written = Counter()
+        self.sleep_seconds = Counter()
+        self.sleep_count = Counter()
+        self.log_file = None
+        if log_path:
+            directory = os.path.dirname(log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.log_file = open(log_path, 'a', buffering=1)
+            self.log_size = self.log_file.tell()
+
+    # Shift <log>.1 .. <log>.N up by one, move the current log to <log>.1 and
+    # start a new one. Called with the lock held.
+    def _rotate_log(self):
+        self.log_file.close()
+        if self.log_backups > 0:
+            for index in range(self.log_backups - 1, 0, -1):
+                source = f"{self.log_path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.log_path}.{index + 1}")
+            os.replace(self.log_path, f"{self.log_path}.1")
+        self.log_file = open(self.log_path, 'w', buffering=1)
+        self.log_size = 0
+
+    def log(self, event, **fields):
+        if self.log_file is None:
+            return
+        line = json.dumps({'ts': round(time.time(), 3), 'event': event, **self.labels, **fields}, default=str) + '\n'
+        with self.lock:
+            if self.log_file is None:
+                return
+            if self.max_log_bytes and self.log_size and self.log_size + len(line) > self.max_log_bytes:
+                self._rotate_log()
+            self.log_file.write(line)
+            self.log_size += len(line)
+
+    # One completed request: its latency, outcome and, for failures, the exception
+    def observe_request(self, endpoint, seconds, outcome, error=None, **fields):
+        error_class = type(error).__name__ if error is not None else None
+        with self.lock:
+            self.latency.setdefault(endpoint, LatencyHistogram()).observe(seconds)
+            self.requests[endpoint, outcome] += 1
+            if error_class:
+                self.errors[endpoint, error_class] += 1
+        self.log('request', endpoint=endpoint, seconds=round(seconds, 4), outcome=outcome, error_class=error_class, **fields)
+
+    def add_bytes(self, data_type, size):
+        with self.lock:
+            self.bytes_written[data_type] += size
+            self.payloads_written[data_type] += 1
+
+    def add_retry(self, endpoint, delay=None, **fields):
+        with self.lock:
+            self.retries[endpoint] += 1
+        self.log('retry', endpoint=endpoint, delay=None if delay is None else round(delay, 3), **fields)
+
+    def add_sleep(self, cause, seconds):
+        if seconds <= 0:
+            return
+        with self.lock:
+            self.sleep_seconds[cause] += seconds
+            self.sleep_count[cause] += 1
+        if seconds >= LOGGED_SLEEP_SECONDS:
+            self.log('sleep', cause=cause, seconds=round(seconds, 3))
+
+    # Totals as plain data, for the run summary log line and the benchmark
+    def snapshot(self):
+        with self.lock:
+            return {
+                'uptime_seconds': round(time.time() - self.started, 3),
+                'requests': {f"{endpoint}:{outcome}": count for (endpoint, outcome), count in sorted(self.requests.items())},
+                'latency': {
+                    endpoint: {
+                        'count': histogram.count,
+                        'sum': round(histogram.sum, 4),
+                        'p50': round(histogram.quantile(0.5), 4),
+                        'p95': round(histogram.quantile(0.95), 4),
+                    }
+                    for endpoint, histogram in sorted(self.latency.items())
+                },
+                'retries': dict(sorted(self.retries.items())),
+                'errors': {f"{endpoint}:{error_class}": count for (endpoint, error_class), count in sorted(self.errors.items())},
+                'bytes_written': dict(sorted(self.bytes_written.items())),
+                'sleep_seconds': {cause: round(seconds, 3) for cause, seconds in sorted(self.sleep_seconds.items())},
+            }
+
+    def prometheus_lines(self, gauges=None):
+        base = self.labels
+        lines = []
+
+        def series(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_labels(**base, **labels)} {_number(value)}")
+
+        with self.lock:
+            histogram_samples = []
+            for endpoint, histogram in sorted(self.latency.items()):
+                for bound, total in histogram.buckets():
+                    le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                    histogram_samples.append(('_bucket', {'endpoint': endpoint, 'le': le}, total))
+                histogram_samples.append(('_sum', {'endpoint': endpoint}, histogram.sum))
+                histogram_samples.append(('_count', {'endpoint': endpoint}, histogram.count))
+            series('garmin_fetch_request_duration_seconds', 'histogram',
+                   'Latency of Garmin Connect requests by endpoint.', histogram_samples)
+            series('garmin_fetch_requests_total', 'counter', 'Garmin Connect requests by endpoint and outcome.',
+                   [('', {'endpoint': endpoint, 'outcome': outcome}, count)
+                    for (endpoint, outcome), count in sorted(self.requests.items())])
+            series('garmin_fetch_retries_total', 'counter', 'Requests retried after a throttle or error, by endpoint.',
+                   [('', {'endpoint': endpoint}, count) for endpoint, count in sorted(self.retries.items())])
+            series('garmin_fetch_errors_total', 'counter', 'Failed requests by endpoint and exception class.',
+                   [('', {'endpoint': endpoint, 'error_class': error_class}, count)
+                    for (endpoint, error_class), count in sorted(self.errors.items())])
+            series('garmin_fetch_written_bytes_total', 'counter', 'Payload bytes written by data type.',
+                   [('', {'data_type': data_type}, size) for data_type, size in sorted(self.bytes_written.items())])
+            series('garmin_fetch_written_payloads_total', 'counter', 'Payloads written by data type.',
+                   [('', {'data_type': data_type}, count) for data_type, count in sorted(self.payloads_written.items())])
+            series('garmin_fetch_sleep_seconds_total', 'counter', 'Seconds spent waiting before requests, by cause, summed over worker threads.',
+                   [('', {'cause': cause}, seconds) for cause, seconds in sorted(self.sleep_seconds.items())])
+            series('garmin_fetch_sleeps_total', 'counter', 'Waits before requests, by cause.',
+                   [('', {'cause': cause}, count) for cause, count in sorted(self.sleep_count.items())])
+        for name, (help_text, value) in (gauges or {}).items():
+            series(name, 'gauge', help_text, [('', {}, value)])
+        return lines
+
+    # Write the Prometheus textfile atomically, so the collector never reads a partial file
+    def write_textfile(self, gauges=None):
+        if not self.textfile_path:
+            return
+        directory = os.path.dirname(self.textfile_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = f"{self.textfile_path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            f.write('\n'.join(self.prometheus_lines(gauges)) + '\n')
+        os.replace(tmp_file, self.textfile_path)
+
+    # Short human-readable summary for the end of a run
+    def summary_lines(self):
+        snapshot = self.snapshot()
+        lines = []
+        for endpoint, latency in snapshot['latency'].items():
+            lines.append(f"{endpoint}: {latency['count']} requests, latency p50 {latency['p50']:.2f} s, p95 {latency['p95']:.2f} s")
+        if snapshot['sleep_seconds']:
+            lines.append("Waiting: " + ", ".join(f"{cause} {seconds:.1f} s" for cause, seconds in snapshot['sleep_seconds'].items()))
+        if snapshot['retries']:
+            lines.append("Retries: " + ", ".join(f"{endpoint} {count}" for endpoint, count in snapshot['retries'].items()))
+        if snapshot['errors']:
+            lines.append("Errors: " + ", ".join(f"{key} {count}" for key, count in snapshot['errors'].items()))
+        return lines
+
+    def close(self):
+        if self.log_file is not None:
+            with self.lock:
+                self.log_file.close()
+                self.log_file = None
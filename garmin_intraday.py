@@ -0,0 +1,389 @@
+import os
+import sys
+import json
+import argparse
+import datetime
+import warnings
+import numpy as np
+
+from garmin_loader import list_data_files_with_signatures, parse_files
+
+# Vectorized processing of the intraday arrays in Garmin payloads.
+#
+# Intraday samples arrive as one [timestamp_ms, value, ...] list per day.
+# They are packed once into padded (days x samples) NumPy arrays with NaN
+# for missing values, and every per-day statistic is then a single
+# reduction along the sample axis instead of a Python loop per element.
+
+BODY_BATTERY_LOW_THRESHOLD = 25
+BODY_BATTERY_PERCENTILES = (10, 50, 90)
+
+
+# Pack ragged per-day [timestamp, value] lists into padded float arrays.
+# Returns (timestamps, values), both shaped (days, longest day), NaN-padded.
+def pack_intraday(day_arrays, value_index=1):
+    lengths = np.fromiter((len(a) for a in day_arrays), dtype=np.int64, count=len(day_arrays))
+    width = int(lengths.max()) if len(lengths) else 0
+    timestamps = np.full((len(day_arrays), width), np.nan)
+    values = np.full((len(day_arrays), width), np.nan)
+    if width == 0:
+        return timestamps, values
+
+    flat = [entry for day in day_arrays for entry in day]
+    try:
+        # Fast path: every entry has a numeric timestamp and value (None becomes NaN)
+        flat_timestamps = np.array([entry[0] for entry in flat], dtype=float)
+        flat_values = np.array([entry[value_index] for entry in flat], dtype=float)
+    except (ValueError, TypeError, IndexError):
+        flat_timestamps = np.array([_as_float(entry, 0) for entry in flat])
+        flat_values = np.array([_as_float(entry, value_index) for entry in flat])
+
+    rows = np.repeat(np.arange(len(day_arrays)), lengths)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    cols = np.arange(len(flat)) - offsets
+    timestamps[rows, cols] = flat_timestamps
+    values[rows, cols] = flat_values
+    return timestamps, values
+
+
+def _as_float(entry, index):
+    try:
+        value = entry[index]
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError, IndexError):
+        return np.nan
+
+
+# Linear-interpolated percentiles of each row, ignoring NaN. Equivalent to
+# np.nanpercentile(values, percentiles, axis=1) but built on one sort.
+def row_percentiles(values, percentiles):
+    sorted_values = np.sort(values, axis=1)
+    counts = np.count_nonzero(~np.isnan(values), axis=1)
+    rows = np.arange(values.shape[0])
+    results = []
+    for p in percentiles:
+        position = np.maximum(counts - 1, 0) * (p / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, np.maximum(counts - 1, 0))
+        low_values = sorted_values[rows, lower]
+        results.append(low_values + (sorted_values[rows, upper] - low_values) * (position - lower))
+    return results
+
+
+# Per-day body battery statistics for a list of get_body_battery day dicts.
+# Returns a dict of equal-length NumPy arrays (plus 'date'), one entry per day
+# that has at least one measured value.
+def body_battery_day_stats(days, low_threshold=BODY_BATTERY_LOW_THRESHOLD, percentiles=BODY_BATTERY_PERCENTILES):
+    days = [d for d in days if isinstance(d, dict) and d.get('date') and isinstance(d.get('bodyBatteryValuesArray'), list)]
+    timestamps, values = pack_intraday([d['bodyBatteryValuesArray'] for d in days])
+    has_values = np.any(~np.isnan(values), axis=1)
+    timestamps, values = timestamps[has_values], values[has_values]
+    dates = np.array([d['date'] for d, keep in zip(days, has_values) if keep], dtype=object)
+    if len(dates) == 0:
+        columns = ['max_body_battery', 'min_body_battery', 'avg_body_battery']
+        columns += [f'p{p}_body_battery' for p in percentiles]
+        columns += [f'minutes_below_{low_threshold}', 'charged', 'drained', 'charge_rate_per_hour', 'drain_rate_per_hour']
+        return {'date': dates, **{column: np.empty(0) for column in columns}}
+
+    # Sample intervals and level changes; NaN wherever either end is missing
+    interval_hours = np.diff(timestamps, axis=1) / 3_600_000.0
+    deltas = np.diff(values, axis=1)
+    valid = ~np.isnan(interval_hours) & ~np.isnan(deltas)
+    charging = valid & (deltas > 0)
+    draining = valid & (deltas < 0)
+    low = ~np.isnan(interval_hours) & (values[:, :-1] < low_threshold)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        stats = {
+            'date': dates,
+            'max_body_battery': np.nanmax(values, axis=1),
+            'min_body_battery': np.nanmin(values, axis=1),
+            'avg_body_battery': np.nanmean(values, axis=1),
+        }
+        for p, column in zip(percentiles, row_percentiles(values, percentiles)):
+            stats[f'p{p}_body_battery'] = column
+
+        charged = np.where(charging, deltas, 0.0).sum(axis=1)
+        drained = np.where(draining, -deltas, 0.0).sum(axis=1)
+        charge_hours = np.where(charging, interval_hours, 0.0).sum(axis=1)
+        drain_hours = np.where(draining, interval_hours, 0.0).sum(axis=1)
+        stats[f'minutes_below_{low_threshold}'] = np.where(low, interval_hours, 0.0).sum(axis=1) * 60.0
+        stats['charged'] = charged
+        stats['drained'] = drained
+        stats['charge_rate_per_hour'] = np.where(charge_hours > 0, charged / np.where(charge_hours > 0, charge_hours, 1.0), np.nan)
+        stats['drain_rate_per_hour'] = np.where(drain_hours > 0, drained / np.where(drain_hours > 0, drain_hours, 1.0), np.nan)
+    return stats
+
+
+# Array-backed store for the intraday heart rate and stress streams.
+#
+# Each stream lives in garmin_intraday/<stream>/ as contiguous .npy arrays
+# that are memory-mapped on open:
+#   timestamps.npy  int32 seconds since INTRADAY_EPOCH (GMT), sorted
+#   values.npy      uint8 heart rate / int16 stress level, valid samples only
+#   days.npy        int64 (n_days, 4): date ordinal, first sample, sample
+#                   count and the local UTC offset in seconds for that day
+#   meta.json       signatures (mtime, size) of the raw files ingested
+# Range queries are binary searches into the timestamp array, and the
+# resampling and rolling statistics are vectorized over the whole range.
+
+INTRADAY_DIR = 'garmin_intraday'
+INTRADAY_EPOCH = 946684800  # 2000-01-01T00:00:00Z; int32 offsets reach 2068
+
+# Stream -> (raw data type, loader slimmer key, sample array field, value dtype)
+INTRADAY_STREAMS = {
+    'heart_rate': ('heart_rate', 'heart_rate_intraday', 'heartRateValues', np.uint8),
+    'stress': ('stress', 'stress_intraday', 'stressValuesArray', np.int16),
+}
+
+
+def _utc_offset_seconds(payload):
+    gmt, local = payload.get('startTimestampGMT'), payload.get('startTimestampLocal')
+    if not gmt or not local:
+        return 0
+    try:
+        delta = datetime.datetime.fromisoformat(local[:19]) - datetime.datetime.fromisoformat(gmt[:19])
+    except ValueError:
+        return 0
+    return int(delta.total_seconds())
+
+
+# Turn one raw payload into (date ordinal, sorted epoch-offset seconds, values, utc offset).
+# Missing samples and negative codes (off-wrist, activity) are dropped.
+def _payload_to_block(payload, samples_field, dtype):
+    if not isinstance(payload, dict) or not payload.get('calendarDate'):
+        return None
+    samples = payload.get(samples_field) or []
+    timestamps, values = pack_intraday([samples])
+    timestamps, values = timestamps[0], values[0]
+    keep = ~np.isnan(timestamps) & ~np.isnan(values) & (values >= 0)
+    info = np.iinfo(dtype)
+    values = np.clip(values[keep], info.min, info.max)
+    seconds = (timestamps[keep] // 1000 - INTRADAY_EPOCH).astype(np.int32)
+    order = np.argsort(seconds, kind='stable')
+    ordinal = datetime.date.fromisoformat(payload['calendarDate']).toordinal()
+    return ordinal, seconds[order], values[order].astype(dtype), _utc_offset_seconds(payload)
+
+
+class IntradayStore:
+    def __init__(self, stream, store_dir=INTRADAY_DIR, mmap=True):
+        self.stream = stream
+        self.path = os.path.join(store_dir, stream)
+        self.dtype = INTRADAY_STREAMS[stream][3]
+        mmap_mode = 'r' if mmap else None
+        if os.path.exists(os.path.join(self.path, 'timestamps.npy')):
+            self.offsets = np.load(os.path.join(self.path, 'timestamps.npy'), mmap_mode=mmap_mode)
+            self.values = np.load(os.path.join(self.path, 'values.npy'), mmap_mode=mmap_mode)
+            self.days = np.load(os.path.join(self.path, 'days.npy'))
+        else:
+            self.offsets = np.empty(0, dtype=np.int32)
+            self.values = np.empty(0, dtype=self.dtype)
+            self.days = np.empty((0, 4), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.values)
+
+    @staticmethod
+    def _to_offset(moment):
+        if isinstance(moment, datetime.date) and not isinstance(moment, datetime.datetime):
+            moment = datetime.datetime(moment.year, moment.month, moment.day, tzinfo=datetime.timezone.utc)
+        if isinstance(moment, datetime.datetime):
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=datetime.timezone.utc)
+            moment = moment.timestamp()
+        return int(moment) - INTRADAY_EPOCH
+
+    # Samples in [start, end) as (epoch seconds int64, values). Accepts dates, datetimes or epoch seconds.
+    def slice(self, start=None, end=None):
+        lo = 0 if start is None else np.searchsorted(self.offsets, self._to_offset(start), side='left')
+        hi = len(self.offsets) if end is None else np.searchsorted(self.offsets, self._to_offset(end), side='left')
+        return self.offsets[lo:hi].astype(np.int64) + INTRADAY_EPOCH, self.values[lo:hi]
+
+    # Fixed-width buckets over [start, end): returns (bucket start epoch seconds, statistic).
+    # stat is one of mean, min, max or count; empty buckets are NaN (0 for count).
+    def resample(self, bucket_seconds, start=None, end=None, stat='mean'):
+        timestamps, values = self.slice(start, end)
+        origin = timestamps[0] if start is None and len(timestamps) else INTRADAY_EPOCH + self._to_offset(start or 0)
+        stop = timestamps[-1] + 1 if end is None and len(timestamps) else INTRADAY_EPOCH + self._to_offset(end or 0)
+        n_buckets = max(0, int(-(-(stop - origin) // bucket_seconds)))
+        bucket_starts = origin + np.arange(n_buckets, dtype=np.int64) * bucket_seconds
+        index = (timestamps - origin) // bucket_seconds
+        counts = np.bincount(index, minlength=n_buckets)
+        if stat == 'count':
+            return bucket_starts, counts
+        if stat == 'mean':
+            sums = np.bincount(index, weights=values.astype(np.float64), minlength=n_buckets)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return bucket_starts, np.where(counts > 0, sums / counts, np.nan)
+
+        # min/max: timestamps are sorted, so each bucket is a contiguous segment
+        result = np.full(n_buckets, np.nan)
+        if len(values):
+            segment_starts = np.flatnonzero(np.r_[True, np.diff(index) != 0])
+            reducer = {'min': np.minimum, 'max': np.maximum}[stat]
+            result[index[segment_starts]] = reducer.reduceat(values.astype(np.float64), segment_starts)
+        return bucket_starts, result
+
+    # Rolling statistic over a resampled grid: window is counted in buckets and
+    # NaN buckets are ignored. Returns (bucket start epoch seconds, statistic).
+    def rolling(self, bucket_seconds, window, start=None, end=None, stat='mean'):
+        bucket_starts, grid = self.resample(bucket_seconds, start, end, 'mean')
+        return bucket_starts, rolling_stat(grid, window, stat)
+
+    # Local time of every sample, using each day's stored UTC offset
+    def local_seconds(self):
+        offsets = np.repeat(self.days[:, 3], self.days[:, 2]) if len(self.days) else np.empty(0, dtype=np.int64)
+        return self.offsets.astype(np.int64) + INTRADAY_EPOCH + offsets
+
+
+# Trailing rolling mean/min/max/std over the last `window` points, ignoring NaN
+def rolling_stat(values, window, stat='mean'):
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if window < 1 or len(values) < window:
+        return result
+    if stat in ('mean', 'std'):
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        counts = np.convolve(valid, np.ones(window), mode='valid')
+        sums = np.convolve(filled, np.ones(window), mode='valid')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts > 0, sums / counts, np.nan)
+            if stat == 'mean':
+                result[window - 1:] = means
+            else:
+                squares = np.convolve(filled * filled, np.ones(window), mode='valid')
+                result[window - 1:] = np.sqrt(np.maximum(squares / counts - means * means, 0.0))
+        return result
+    windows = np.lib.stride_tricks.sliding_window_view(values, window)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        result[window - 1:] = {'min': np.nanmin, 'max': np.nanmax}[stat](windows, axis=1)
+    return result
+
+
+# Add new or changed raw files for a stream to its store. Returns the number of days written.
+def build_intraday_store(stream, data_dir='garmin_data', store_dir=INTRADAY_DIR):
+    data_type, slimmer_key, samples_field, dtype = INTRADAY_STREAMS[stream]
+    stream_dir = os.path.join(store_dir, stream)
+    os.makedirs(stream_dir, exist_ok=True)
+    meta_path = os.path.join(stream_dir, 'meta.json')
+    meta = {'files': {}}
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+
+    changed = {}
+    for path, signature in list_data_files_with_signatures(data_type, data_dir):
+        if meta['files'].get(os.path.basename(path)) != list(signature):
+            changed[path] = list(signature)
+    if not changed:
+        return 0
+
+    new_blocks = {}
+    for _, payload in parse_files(list(changed), slimmer_key):
+        block = _payload_to_block(payload, samples_field, dtype)
+        if block is not None:
+            new_blocks[block[0]] = block
+
+    # Rebuild the contiguous arrays in date order: untouched days are copied
+    # from the existing (memory-mapped) arrays, changed days are replaced.
+    existing = IntradayStore(stream, store_dir)
+    blocks = {}
+    for ordinal, first, count, utc_offset in existing.days:
+        blocks[int(ordinal)] = (int(ordinal), existing.offsets[first:first + count], existing.values[first:first + count], int(utc_offset))
+    blocks.update(new_blocks)
+
+    ordered = [blocks[ordinal] for ordinal in sorted(blocks)]
+    counts = np.array([len(block[1]) for block in ordered], dtype=np.int64)
+    days = np.column_stack([
+        np.array([block[0] for block in ordered], dtype=np.int64),
+        np.cumsum(counts) - counts,
+        counts,
+        np.array([block[3] for block in ordered], dtype=np.int64),
+    ]) if ordered else np.empty((0, 4), dtype=np.int64)
+    offsets = np.concatenate([block[1] for block in ordered]) if ordered else np.empty(0, dtype=np.int32)
+    values = np.concatenate([block[2] for block in ordered]) if ordered else np.empty(0, dtype=dtype)
+    del existing
+
+    for name, array in (('timestamps', offsets.astype(np.int32)), ('values', values.astype(dtype)), ('days', days)):
+        tmp_path = os.path.join(stream_dir, f"{name}.tmp.npy")
+        np.save(tmp_path, array)
+        os.replace(tmp_path, os.path.join(stream_dir, f"{name}.npy"))
+    meta['files'].update({os.path.basename(path): signature for path, signature in changed.items()})
+    with open(f"{meta_path}.tmp", 'w') as f:
+        json.dump(meta, f)
+    os.replace(f"{meta_path}.tmp", meta_path)
+    return len(new_blocks)
+
+
+# Overnight heart rate dip per day, in local time. For each day D this returns
+# the daytime mean (day_hours of D), the mean over the following night
+# (night_hours of D + 1) and the dip as a fraction of the daytime mean,
+# together with minutes spent at or above heavy_bpm on D.
+def overnight_heart_rate_dip(store, day_hours=(8, 20), night_hours=(0, 6), heavy_bpm=120):
+    local = store.local_seconds()
+    if len(local) == 0:
+        return {'date': np.empty(0, dtype=object)}
+    values = store.values.astype(np.float64)
+    local_day = local // 86400
+    hour = (local % 86400) // 3600
+    first_day = local_day.min()
+    day_index = local_day - first_day
+    n_days = int(day_index.max()) + 1
+
+    daytime = (hour >= day_hours[0]) & (hour < day_hours[1])
+    night = (hour >= night_hours[0]) & (hour < night_hours[1])
+    # Night samples count towards the previous day
+    night_index = day_index[night] - 1
+    night_keep = night_index >= 0
+
+    day_counts = np.bincount(day_index[daytime], minlength=n_days)
+    day_sums = np.bincount(day_index[daytime], weights=values[daytime], minlength=n_days)
+    night_counts = np.bincount(night_index[night_keep], minlength=n_days)
+    night_sums = np.bincount(night_index[night_keep], weights=values[night][night_keep], minlength=n_days)
+
+    # Minutes at or above heavy_bpm, from each sample's gap to the next one
+    gaps = np.diff(local, append=local[-1]) / 60.0
+    gaps = np.where((gaps > 0) & (gaps <= 15), gaps, 0.0)
+    heavy = values >= heavy_bpm
+    heavy_minutes = np.bincount(day_index[heavy], weights=gaps[heavy], minlength=n_days)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        day_mean = np.where(day_counts > 0, day_sums / day_counts, np.nan)
+        night_mean = np.where(night_counts > 0, night_sums / night_counts, np.nan)
+    epoch_ordinal = datetime.date(1970, 1, 1).toordinal()
+    return {
+        'date': np.array([datetime.date.fromordinal(int(epoch_ordinal + first_day + i)) for i in range(n_days)], dtype=object),
+        'day_mean_hr': day_mean,
+        'night_mean_hr': night_mean,
+        'overnight_dip': 1.0 - night_mean / day_mean,
+        'heavy_minutes': heavy_minutes,
+    }
+
+
+def run_from_args(args):
+    for stream in INTRADAY_STREAMS:
+        written = build_intraday_store(stream, args.data_dir, args.store_dir)
+        print(f"Updated {written} days of intraday {stream} data")
+
+    dips = overnight_heart_rate_dip(IntradayStore('heart_rate', args.store_dir))
+    if len(dips['date']):
+        heavy_days = dips['heavy_minutes'] >= args.heavy_minutes
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            print(f"Overnight HR dip after heavy exercise days: {np.nanmean(dips['overnight_dip'][heavy_days]):.1%} ({heavy_days.sum()} days)")
+            print(f"Overnight HR dip after other days: {np.nanmean(dips['overnight_dip'][~heavy_days]):.1%} ({(~heavy_days).sum()} days)")
+
+
+def main(argv=None):
+    from garmin_cli import add_intraday_arguments
+
+    parser = argparse.ArgumentParser(description="Build the intraday heart rate / stress store and report overnight HR dips")
+    add_intraday_arguments(parser)
+    run_from_args(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
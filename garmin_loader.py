@@ -0,0 +1,157 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from garmin_archive import is_member_path, list_members, read_member
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Parallel loader for the raw garmin_data/<type>/*.json files.
+#
+# Files are parsed in a process pool (with orjson when it is installed) and
+# each payload is cut down to the fields the analysis and the feature store
+# actually read before it is sent back to the parent process. The large
+# intraday arrays in sleep and stress payloads are never pickled or kept.
+# Results are yielded in filename order, which is date order. Payloads kept in
+# the compressed monthly archives (garmin_archive.py) are listed and read the
+# same way as loose files.
+
+# Below this many files a process pool costs more than it saves
+PARALLEL_MIN_FILES = 64
+
+SLEEP_FIELDS = ('calendarDate', 'sleepTimeSeconds', 'deepSleepSeconds', 'lightSleepSeconds',
+                'remSleepSeconds', 'awakeSleepSeconds')
+STRESS_FIELDS = ('calendarDate', 'avgStressLevel', 'maxStressLevel')
+BODY_BATTERY_FIELDS = ('date', 'bodyBatteryValuesArray')
+HEART_RATE_FIELDS = ('calendarDate', 'restingHeartRate', 'maxHeartRate', 'minHeartRate')
+HRV_FIELDS = ('calendarDate', 'weeklyAvg', 'lastNightAvg', 'lastNight5MinHigh')
+TRAINING_READINESS_FIELDS = ('calendarDate', 'timestamp', 'score', 'sleepScore', 'recoveryTime')
+HEART_RATE_INTRADAY_FIELDS = ('calendarDate', 'startTimestampGMT', 'startTimestampLocal', 'heartRateValues')
+STRESS_INTRADAY_FIELDS = ('calendarDate', 'startTimestampGMT', 'startTimestampLocal', 'stressValuesArray')
+
+
+def _pick(item, fields):
+    return {field: item[field] for field in fields if field in item}
+
+
+def slim_sleep(data):
+    if not isinstance(data, dict):
+        return data
+    daily_sleep = data.get('dailySleepDTO')
+    if not isinstance(daily_sleep, dict):
+        return {}
+    return {'dailySleepDTO': _pick(daily_sleep, SLEEP_FIELDS)}
+
+
+def slim_stress(data):
+    if isinstance(data, dict):
+        return _pick(data, STRESS_FIELDS)
+    if isinstance(data, list):
+        return [slim_stress(item) for item in data]
+    return data
+
+
+def slim_body_battery(data):
+    if not isinstance(data, list):
+        return data
+    return [_pick(day_data, BODY_BATTERY_FIELDS) if isinstance(day_data, dict) else day_data for day_data in data]
+
+
+def slim_hrv(data):
+    if not isinstance(data, dict):
+        return data
+    summary = data.get('hrvSummary')
+    return {'hrvSummary': _pick(summary, HRV_FIELDS)} if isinstance(summary, dict) else {}
+
+
+def slim_training_readiness(data):
+    if not isinstance(data, list):
+        return data
+    return [_pick(item, TRAINING_READINESS_FIELDS) if isinstance(item, dict) else item for item in data]
+
+
+def _slim_dict(fields):
+    return lambda data: _pick(data, fields) if isinstance(data, dict) else data
+
+
+# Data type -> function reducing a payload to the fields that are used downstream.
+# The *_intraday keys keep the sample arrays for the intraday time-series store.
+SLIMMERS = {
+    'sleep': slim_sleep,
+    'stress': slim_stress,
+    'body_battery': slim_body_battery,
+    'heart_rate': _slim_dict(HEART_RATE_FIELDS),
+    'hrv': slim_hrv,
+    'training_readiness': slim_training_readiness,
+    'heart_rate_intraday': _slim_dict(HEART_RATE_INTRADAY_FIELDS),
+    'stress_intraday': _slim_dict(STRESS_INTRADAY_FIELDS),
+}
+
+
+# Raw JSON bytes of a loose or archived file
+def read_raw(path):
+    if is_member_path(path):
+        return read_member(path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def parse_json_file(path):
+    raw = read_raw(path)
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def _parse_and_slim(job):
+    path, data_type = job
+    data = parse_json_file(path)
+    slimmer = SLIMMERS.get(data_type)
+    return slimmer(data) if slimmer else data
+
+
+# Yield (path, payload) for each path, in the order given. An executor passed in
+# is used (and left running) instead of starting a process pool for this call.
+def parse_files(paths, data_type, workers=None, executor=None):
+    paths = list(paths)
+    jobs = [(path, data_type) for path in paths]
+    workers = workers or os.cpu_count() or 1
+    if executor is None and (workers == 1 or len(paths) < PARALLEL_MIN_FILES):
+        for job in jobs:
+            yield job[0], _parse_and_slim(job)
+        return
+
+    chunksize = max(1, len(jobs) // (workers * 8))
+    if executor is not None:
+        yield from zip(paths, executor.map(_parse_and_slim, jobs, chunksize=chunksize))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from zip(paths, executor.map(_parse_and_slim, jobs, chunksize=chunksize))
+
+
+# Paths of every raw file for a data type, in date order. Archived payloads are
+# listed as <type>/<YYYY-MM>.pack/<date>.json; a loose file of the same name wins,
+# since it was fetched after the last migration.
+def list_data_files(data_type, data_dir='garmin_data'):
+    return [path for path, _ in list_data_files_with_signatures(data_type, data_dir)]
+
+
+# (path, signature) for every raw file, where the signature changes whenever the
+# content does: (mtime_ns, size) for a loose file, (offset, length) for an archived one
+def list_data_files_with_signatures(data_type, data_dir='garmin_data'):
+    type_dir = os.path.join(data_dir, data_type)
+    if not os.path.isdir(type_dir):
+        return []
+    files = {os.path.basename(path): (path, signature) for path, signature in list_members(type_dir)}
+    for entry in os.scandir(type_dir):
+        if entry.name.endswith('.json'):
+            stat = entry.stat()
+            files[entry.name] = (entry.path, (stat.st_mtime_ns, stat.st_size))
+    return [files[name] for name in sorted(files)]
+
+
+# Yield the slimmed payloads of every file for a data type, in date order
+def load_records(data_type, data_dir='garmin_data', workers=None):
+    for _, data in parse_files(list_data_files(data_type, data_dir), data_type, workers):
+        yield data
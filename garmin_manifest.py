@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import sqlite3
+import datetime
+import threading
+
+# SQLite index of every (data_type, date) cell the fetcher has attempted.
+#
+# The manifest replaces per-file os.path.exists checks and directory scans:
+# planning a run is a single query that returns the cells which were never
+# attempted, so holes left by an interrupted run are found again instead of
+# being hidden behind a later maximum date. Cells whose last attempt failed
+# are only planned again on request (--repair-gaps), so a day that fails on
+# every attempt does not cost requests on every run.
+
+STATUS_STORED = 'stored'
+STATUS_FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fetch_manifest (
+    data_type TEXT NOT NULL,
+    date TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload_size INTEGER,
+    fetched_at REAL NOT NULL,
+    is_empty INTEGER NOT NULL DEFAULT 0,
+    error_class TEXT,
+    PRIMARY KEY (data_type, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fetch_manifest_status ON fetch_manifest (status, data_type);
+CREATE TABLE IF NOT EXISTS date_probes (
+    date TEXT PRIMARY KEY,
+    has_data INTEGER NOT NULL,
+    probed_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS fetch_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+# True for payloads that carry no data: None, empty containers, or dicts of nulls
+def is_empty_payload(data):
+    if not data:
+        return True
+    if isinstance(data, dict):
+        return all(value in (None, [], {}) for value in data.values())
+    if isinstance(data, list):
+        return all(is_empty_payload(item) for item in data)
+    return False
+
+
+class FetchManifest:
+    def __init__(self, db_path, data_dir=None):
+        is_new = not os.path.exists(db_path)
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if is_new and data_dir:
+            imported = self.import_existing_files(data_dir)
+            if imported:
+                print(f"[MANIFEST] Indexed {imported} existing data cells from {data_dir}")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _upsert(self, rows):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO fetch_manifest "
+                "(data_type, date, status, payload_size, fetched_at, is_empty, error_class) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def record_success(self, data_type, date_strs, payload_size, is_empty):
+        if isinstance(date_strs, str):
+            date_strs = [date_strs]
+        now = time.time()
+        self._upsert([(data_type, d, STATUS_STORED, payload_size, now, int(is_empty), None) for d in date_strs])
+
+    def record_failure(self, data_type, date_strs, error):
+        if isinstance(date_strs, str):
+            date_strs = [date_strs]
+        now = time.time()
+        error_class = type(error).__name__
+        self._upsert([(data_type, d, STATUS_FAILED, None, now, 0, error_class) for d in date_strs])
+
+    # Return (data_type, date_str) cells in [start_date, end_date] without a manifest row,
+    # and with retry_failed also those whose last attempt failed
+    def plan(self, data_types, start_date, end_date, retry_failed=False):
+        placeholders = ", ".join("(?)" for _ in data_types)
+        query = f"""
+            WITH RECURSIVE days(day) AS (
+                SELECT date(?)
+                UNION ALL
+                SELECT date(day, '+1 day') FROM days WHERE day < date(?)
+            ),
+            types(data_type) AS (VALUES {placeholders})
+            SELECT t.data_type, d.day
+            FROM days d CROSS JOIN types t
+            LEFT JOIN fetch_manifest m ON m.data_type = t.data_type AND m.date = d.day
+            WHERE m.status IS NULL OR (? AND m.status != ?)
+            ORDER BY d.day, t.data_type
+        """
+        params = [start_date.isoformat(), end_date.isoformat(), *data_types, int(retry_failed), STATUS_STORED]
+        with self.lock:
+            return self.conn.execute(query, params).fetchall()
+
+    def last_stored_date(self, data_type):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT MAX(date) FROM fetch_manifest WHERE data_type = ? AND status = ?",
+                (data_type, STATUS_STORED),
+            ).fetchone()
+        return datetime.date.fromisoformat(row[0]) if row and row[0] else None
+
+    def first_date(self):
+        with self.lock:
+            row = self.conn.execute("SELECT MIN(date) FROM fetch_manifest").fetchone()
+        return datetime.date.fromisoformat(row[0]) if row and row[0] else None
+
+    # Cached results of the first-data-date search: {date_str: has_data} for the dates given
+    def get_probes(self, date_strs):
+        placeholders = ", ".join("?" for _ in date_strs)
+        with self.lock:
+            rows = self.conn.execute(f"SELECT date, has_data FROM date_probes WHERE date IN ({placeholders})", list(date_strs)).fetchall()
+        return {date_str: bool(has_data) for date_str, has_data in rows}
+
+    def record_probe(self, date_str, has_data):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO date_probes (date, has_data, probed_at) VALUES (?, ?, ?)",
+                              (date_str, int(has_data), time.time()))
+
+    # Small persistent values such as the start of the account's history
+    def get_state(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM fetch_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO fetch_state (key, value) VALUES (?, ?)", (key, str(value)))
+
+    # Summary of failed cells by data type and error class
+    def failure_counts(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT data_type, error_class, COUNT(*) FROM fetch_manifest "
+                "WHERE status = ? GROUP BY data_type, error_class ORDER BY data_type",
+                (STATUS_FAILED,),
+            ).fetchall()
+
+    # Failed cells recorded at or after a time.time() timestamp, by data type and error class
+    def failures_since(self, since):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT data_type, error_class, COUNT(*) FROM fetch_manifest "
+                "WHERE status = ? AND fetched_at >= ? GROUP BY data_type, error_class ORDER BY data_type",
+                (STATUS_FAILED, since),
+            ).fetchall()
+
+    # One-off walk of an existing garmin_data tree, used when the manifest is first created
+    def import_existing_files(self, data_dir):
+        from garmin_loader import list_data_files, read_raw
+
+        rows = []
+        for data_type in sorted(os.listdir(data_dir)):
+            if not os.path.isdir(os.path.join(data_dir, data_type)):
+                continue
+            for file_path in list_data_files(data_type, data_dir):
+                try:
+                    raw = read_raw(file_path)
+                    data = json.loads(raw)
+                except (OSError, ValueError):
+                    continue
+                # An archived payload has no file of its own; use the pack's mtime
+                fetched_at = os.path.getmtime(file_path if os.path.exists(file_path) else os.path.dirname(file_path))
+                # Range files (body battery) are named <start>_<end>.json
+                bounds = os.path.basename(file_path)[:-len('.json')].split('_')
+                try:
+                    first = datetime.date.fromisoformat(bounds[0])
+                    last = datetime.date.fromisoformat(bounds[-1])
+                except ValueError:
+                    continue
+                empty = int(is_empty_payload(data))
+                day = first
+                while day <= last:
+                    rows.append((data_type, day.isoformat(), STATUS_STORED, len(raw), fetched_at, empty, None))
+                    day += datetime.timedelta(days=1)
+        self._upsert(rows)
+        return len(rows)
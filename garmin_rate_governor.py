@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import random
+import threading
+import email.utils
+import multiprocessing
+
+from garmin_fetch_metrics import SLEEP_PACING, SLEEP_SHARED_BUDGET, SLEEP_THROTTLE_HOLD
+
+# Token bucket that paces requests to the Garmin API.
+#
+# The refill rate adapts to what the server tells us: a throttle halves it
+# (multiplicative decrease) and each success nudges it back up towards the
+# configured ceiling (additive increase). Retry-After headers and repeated
+# throttles also put the whole bucket on hold for a while. The rate and any
+# active hold are persisted, so a restarted run resumes at the throttled
+# pace instead of bursting straight back into a ban.
+class RateGovernor:
+    def __init__(self, state_file, max_requests_per_minute=30, min_requests_per_minute=2,
+                 burst=3, backoff_base=5.0, backoff_cap=900.0, shared_budget=None, metrics=None):
+        self.state_file = state_file
+        # Optional SharedRateBudget that caps the rate across processes as well
+        self.shared_budget = shared_budget
+        # Optional FetchMetrics that is told how long each wait was and why
+        self.metrics = metrics
+        self.max_rate = max_requests_per_minute / 60.0
+        self.min_rate = min_requests_per_minute / 60.0
+        self.burst = burst
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.lock = threading.Lock()
+
+        self.rate = self.max_rate
+        self.blocked_until = 0.0
+        self.consecutive_throttles = 0
+        # Start with an empty bucket so a fresh process never opens with a burst
+        self.tokens = 0.0
+        self.last_refill = time.time()
+        self.load_state()
+
+    # Restore the adapted rate and any hold left by a previous run
+    def load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+            self.rate = min(self.max_rate, max(self.min_rate, float(state.get('rate', self.max_rate))))
+            self.blocked_until = float(state.get('blocked_until', 0.0))
+            self.consecutive_throttles = int(state.get('consecutive_throttles', 0))
+        except (OSError, ValueError, TypeError) as e:
+            print(f"[RATE GOVERNOR] Ignoring unreadable state file {self.state_file}: {e}")
+
+    def save_state(self):
+        if not self.state_file:
+            return
+        with self.lock:
+            state = {
+                'rate': self.rate,
+                'blocked_until': self.blocked_until,
+                'consecutive_throttles': self.consecutive_throttles,
+                'saved_at': time.time(),
+            }
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    @property
+    def requests_per_minute(self):
+        return self.rate * 60.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    # Block until a request may be sent. Returns the number of seconds waited.
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                    cause = SLEEP_THROTTLE_HOLD
+                elif self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    break
+                else:
+                    wait = (1.0 - self.tokens) / self.rate
+                    cause = SLEEP_PACING
+            time.sleep(wait)
+            waited += wait
+            if self.metrics is not None:
+                self.metrics.add_sleep(cause, wait)
+        if self.shared_budget is not None:
+            shared_wait = self.shared_budget.acquire()
+            waited += shared_wait
+            if self.metrics is not None:
+                self.metrics.add_sleep(SLEEP_SHARED_BUDGET, shared_wait)
+        return waited
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_throttles = 0
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 60.0)
+
+    # A non-throttle failure (timeouts, 5xx) is a weak signal to slow down
+    def record_error(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * 0.9)
+
+    # Slow down after a throttle and hold the bucket for Retry-After, or for a
+    # backoff that grows with consecutive throttles. Returns the hold in seconds.
+    def record_throttle(self, retry_after=None):
+        with self.lock:
+            now = time.time()
+            self.consecutive_throttles += 1
+            self.rate = max(self.min_rate, self.rate / 2.0)
+            self.tokens = 0.0
+            if retry_after is not None:
+                hold = retry_after
+            else:
+                hold = self.backoff_delay(self.consecutive_throttles - 1)
+            self.blocked_until = max(self.blocked_until, now + hold)
+        self.save_state()
+        if self.shared_budget is not None:
+            self.shared_budget.hold(hold)
+        return hold
+
+    # Exponential backoff with jitter ("equal jitter": half fixed, half random)
+    def backoff_delay(self, attempt):
+        delay = min(self.backoff_cap, self.backoff_base * (2 ** attempt))
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+# Token bucket shared by several processes (e.g. one per athlete in a squad run),
+# so that together they stay within one request budget. A throttle seen by any
+# process holds the bucket for all of them. Create it in the parent and hand it
+# to the workers when they start (pool initializer arguments).
+class SharedRateBudget:
+    def __init__(self, max_requests_per_minute=30, burst=3, context=None):
+        context = context or multiprocessing.get_context()
+        self.rate = max_requests_per_minute / 60.0
+        self.burst = burst
+        self.lock = context.Lock()
+        # tokens, last refill time, blocked until
+        self.state = context.Array('d', [0.0, time.time(), 0.0], lock=False)
+
+    # Block until the squad may send a request. Returns the number of seconds waited.
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                tokens = min(self.burst, self.state[0] + (now - self.state[1]) * self.rate)
+                self.state[1] = now
+                if now < self.state[2]:
+                    wait = self.state[2] - now
+                elif tokens >= 1.0:
+                    self.state[0] = tokens - 1.0
+                    return waited
+                else:
+                    wait = (1.0 - tokens) / self.rate
+                self.state[0] = tokens
+            time.sleep(wait)
+            waited += wait
+
+    def hold(self, seconds):
+        with self.lock:
+            self.state[0] = 0.0
+            self.state[2] = max(self.state[2], time.time() + seconds)
+
+
+# Read a Retry-After value (seconds or HTTP date) from an exception's response, if any
+def get_retry_after(error):
+    while error is not None:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None)
+        if headers and headers.get('Retry-After'):
+            value = headers.get('Retry-After').strip()
+            if value.isdigit():
+                return float(value)
+            try:
+                retry_at = email.utils.parsedate_to_datetime(value)
+                return max(0.0, retry_at.timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+        error = error.__cause__ or error.__context__
+    return None
+
+
+# True if an exception looks like the server asking us to slow down
+def is_rate_limit_error(error):
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        return True
+    error_message = str(error).lower()
+    return "too many request" in error_message or "rate limit" in error_message
+
+
+# True if a failed request is worth retrying: connection errors and timeouts (no
+# response at all) and 5xx responses. Other 4xx responses would fail the same way again.
+def is_transient_error(error):
+    while error is not None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        if status is not None:
+            return status >= 500 or status == 408
+        error = error.__cause__ or error.__context__
+    return True
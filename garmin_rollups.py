@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+
+import pandas as pd
+
+from garmin_constants import DAYS_OF_WEEK
+from garmin_feature_store import METRICS
+from garmin_loader import list_data_files_with_signatures, parse_files
+
+# Materialized rollups of every daily metric.
+#
+# For each series ("<metric>.<field>", e.g. sleep.deepSleepSeconds) the
+# rollup table holds count, sum, sum of squares, min and max per day, per
+# ISO week (keyed by its Monday) and per month (keyed by its first day).
+# Updates are incremental: only raw files that are new or changed since the
+# last update (by signature, as for the feature store) are parsed, their
+# days are rewritten and just the weeks and months containing them are
+# re-aggregated from the day rows.
+#
+# A date-range query is answered by covering the range with whole months,
+# then whole weeks, then single days at the edges and adding up their
+# partial aggregates, so a ten-year range reads a few hundred rows at most.
+# Day-of-week queries group the day rows of the range by weekday.
+
+ROLLUP_DB = 'garmin_rollups.sqlite'
+# Bump when the table layout changes; an older database is rebuilt
+ROLLUP_VERSION = 1
+GRAINS = ('day', 'week', 'month')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    series TEXT NOT NULL,
+    grain TEXT NOT NULL,
+    period TEXT NOT NULL,
+    weekday INTEGER,
+    week TEXT,
+    month TEXT,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    sumsq REAL NOT NULL,
+    min REAL,
+    max REAL,
+    PRIMARY KEY (series, grain, period)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_files (
+    metric TEXT NOT NULL,
+    name TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    PRIMARY KEY (metric, name)
+) WITHOUT ROWID;
+"""
+
+
+def week_start(day):
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def month_end(day):
+    next_month = (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return next_month - datetime.timedelta(days=1)
+
+
+# Cover [start, end] with (grain, first period, last period) segments: whole months,
+# then whole weeks, then single days
+def range_segments(start, end):
+    if start > end:
+        return []
+    first_month = start if start.day == 1 else month_end(start) + datetime.timedelta(days=1)
+    last_month_end = end if end == month_end(end) else month_start(end) - datetime.timedelta(days=1)
+    if first_month > last_month_end:
+        return _week_segments(start, end)
+    return (_week_segments(start, first_month - datetime.timedelta(days=1))
+            + [('month', first_month, month_start(last_month_end))]
+            + _week_segments(last_month_end + datetime.timedelta(days=1), end))
+
+
+def _week_segments(start, end):
+    if start > end:
+        return []
+    first_week = week_start(start) if start.weekday() == 0 else week_start(start) + datetime.timedelta(days=7)
+    last_week = week_start(end) if end.weekday() == 6 else week_start(end) - datetime.timedelta(days=7)
+    if first_week > last_week:
+        return [('day', start, end)]
+    segments = [('week', first_week, last_week)]
+    if start < first_week:
+        segments.insert(0, ('day', start, first_week - datetime.timedelta(days=1)))
+    if last_week + datetime.timedelta(days=6) < end:
+        segments.append(('day', last_week + datetime.timedelta(days=7), end))
+    return segments
+
+
+# Mean and sample standard deviation from count, sum and sum of squares
+def summarize(count, total, total_squares, minimum, maximum):
+    mean = total / count if count else None
+    std = None
+    if count and count > 1:
+        std = max(0.0, (total_squares - total * total / count) / (count - 1)) ** 0.5
+    return {'count': count or 0, 'mean': mean, 'std': std, 'min': minimum, 'max': maximum, 'sum': total}
+
+
+class RollupStore:
+    def __init__(self, db_path=ROLLUP_DB):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != ROLLUP_VERSION:
+            self.conn.executescript("DROP TABLE IF EXISTS rollups; DROP TABLE IF EXISTS rollup_files;")
+            self.conn.execute(f"PRAGMA user_version = {ROLLUP_VERSION}")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM rollups")
+            self.conn.execute("DELETE FROM rollup_files")
+
+    # Fold new or changed raw files into the rollups. Returns the files processed per metric.
+    def update(self, data_dir='garmin_data', metrics=None, rebuild=False):
+        if rebuild:
+            self.clear()
+        updated = {}
+        for metric in metrics or METRICS:
+            data_type, extractor, columns = METRICS[metric]
+            known = dict(self.conn.execute("SELECT name, signature FROM rollup_files WHERE metric = ?", (metric,)).fetchall())
+            changed = [
+                (path, json.dumps(list(signature)))
+                for path, signature in list_data_files_with_signatures(data_type, data_dir)
+                if known.get(os.path.basename(path)) != json.dumps(list(signature))
+            ]
+            if not changed:
+                continue
+            rows = extractor([data for _, data in parse_files([path for path, _ in changed], data_type)])
+            with self.conn:
+                self._write_days(metric, rows, list(columns))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO rollup_files (metric, name, signature) VALUES (?, ?, ?)",
+                    [(metric, os.path.basename(path), signature) for path, signature in changed],
+                )
+            updated[metric] = len(changed)
+        return updated
+
+    # Rewrite the day rows of the extracted days, then re-aggregate their weeks and months
+    def _write_days(self, metric, rows, columns):
+        if not rows:
+            return
+        df = pd.DataFrame(rows).drop_duplicates('date', keep='last')
+        days = [datetime.date.fromisoformat(str(date)[:10]) for date in df['date']]
+        day_strs = [day.isoformat() for day in days]
+        weeks = sorted({week_start(day).isoformat() for day in days})
+        months = sorted({month_start(day).isoformat() for day in days})
+        for column in columns:
+            series = f"{metric}.{column}"
+            values = pd.to_numeric(df[column], errors='coerce') if column in df.columns else pd.Series(float('nan'), index=df.index)
+            self.conn.executemany("DELETE FROM rollups WHERE series = ? AND grain = 'day' AND period = ?",
+                                  [(series, day_str) for day_str in day_strs])
+            self.conn.executemany(
+                "INSERT INTO rollups (series, grain, period, weekday, week, month, count, sum, sumsq, min, max) "
+                "VALUES (?, 'day', ?, ?, ?, ?, 1, ?, ?, ?, ?)",
+                [
+                    (series, day.isoformat(), day.weekday(), week_start(day).isoformat(), month_start(day).isoformat(),
+                     value, value * value, value, value)
+                    for day, value in zip(days, values.astype(float)) if value == value
+                ],
+            )
+            for grain, periods in (('week', weeks), ('month', months)):
+                self._reaggregate(series, grain, periods)
+
+    def _reaggregate(self, series, grain, periods):
+        placeholders = ", ".join("?" for _ in periods)
+        self.conn.execute(f"DELETE FROM rollups WHERE series = ? AND grain = ? AND period IN ({placeholders})",
+                          [series, grain, *periods])
+        self.conn.execute(
+            f"INSERT INTO rollups (series, grain, period, count, sum, sumsq, min, max) "
+            f"SELECT series, ?, {grain}, SUM(count), SUM(sum), SUM(sumsq), MIN(min), MAX(max) FROM rollups "
+            f"WHERE series = ? AND grain = 'day' AND {grain} IN ({placeholders}) GROUP BY {grain}",
+            [grain, series, *periods],
+        )
+
+    # Every series in the store, optionally only those matching metric or series names
+    def series(self, names=None):
+        available = [row[0] for row in self.conn.execute("SELECT DISTINCT series FROM rollups WHERE grain = 'month' ORDER BY series")]
+        if not names:
+            return available
+        selected = [s for s in available if any(s == name or s.split('.')[0] == name or s.split('.', 1)[1] == name for name in names)]
+        unknown = [name for name in names if not any(s == name or s.split('.')[0] == name or s.split('.', 1)[1] == name for s in available)]
+        if unknown:
+            raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+        return selected
+
+    # First and last day with a value for a series
+    def date_bounds(self, series):
+        first, last = self.conn.execute(
+            "SELECT MIN(period), MAX(period) FROM rollups WHERE series = ? AND grain = 'day'", (series,)).fetchone()
+        if first is None:
+            return None, None
+        return datetime.date.fromisoformat(first), datetime.date.fromisoformat(last)
+
+    def _bounds(self, series, start, end):
+        first, last = self.date_bounds(series)
+        start = pd.Timestamp(start).date() if start is not None else first
+        end = pd.Timestamp(end).date() if end is not None else last
+        return start, end
+
+    # count, mean, std, min, max and sum of a series over [start, end] (whole history by default)
+    def query(self, series, start=None, end=None):
+        start, end = self._bounds(series, start, end)
+        if start is None:
+            return summarize(0, 0.0, 0.0, None, None)
+        segments = range_segments(start, end)
+        if not segments:
+            return summarize(0, 0.0, 0.0, None, None)
+        where = " OR ".join("(grain = ? AND period BETWEEN ? AND ?)" for _ in segments)
+        params = [series] + [value for grain, first, last in segments for value in (grain, first.isoformat(), last.isoformat())]
+        row = self.conn.execute(
+            f"SELECT SUM(count), SUM(sum), SUM(sumsq), MIN(min), MAX(max) FROM rollups WHERE series = ? AND ({where})", params
+        ).fetchone()
+        return summarize(*row)
+
+    # Per-weekday statistics of a series over [start, end], indexed Monday..Sunday
+    def query_by_weekday(self, series, start=None, end=None):
+        start, end = self._bounds(series, start, end)
+        stats = {}
+        if start is not None:
+            for weekday, *aggregates in self.conn.execute(
+                "SELECT weekday, SUM(count), SUM(sum), SUM(sumsq), MIN(min), MAX(max) FROM rollups "
+                "WHERE series = ? AND grain = 'day' AND period BETWEEN ? AND ? GROUP BY weekday",
+                (series, start.isoformat(), end.isoformat()),
+            ):
+                stats[DAYS_OF_WEEK[weekday]] = summarize(*aggregates)
+        empty = summarize(0, 0.0, 0.0, None, None)
+        return pd.DataFrame([stats.get(day, empty) for day in DAYS_OF_WEEK], index=pd.Index(DAYS_OF_WEEK, name='day_of_week'))
+
+    # Statistics per day, week or month for the periods starting in [start, end]
+    # (weeks and months overlapping the start are included whole)
+    def query_periods(self, series, grain, start=None, end=None):
+        if grain not in GRAINS:
+            raise ValueError(f"Unknown grain {grain!r}; choose from {', '.join(GRAINS)}")
+        start, end = self._bounds(series, start, end)
+        if start is None:
+            return pd.DataFrame(columns=['count', 'mean', 'std', 'min', 'max', 'sum'])
+        first = {'day': start, 'week': week_start(start), 'month': month_start(start)}[grain]
+        rows = self.conn.execute(
+            "SELECT period, count, sum, sumsq, min, max FROM rollups WHERE series = ? AND grain = ? AND period BETWEEN ? AND ? ORDER BY period",
+            (series, grain, first.isoformat(), end.isoformat()),
+        ).fetchall()
+        return pd.DataFrame([summarize(*aggregates) for _, *aggregates in rows],
+                            index=pd.Index([period for period, *_ in rows], name=grain))
+
+
+def run_from_args(args):
+    store = RollupStore(args.db)
+    try:
+        if not args.no_update:
+            started = time.time()
+            updated = store.update(args.data_dir, rebuild=args.rebuild)
+            if updated:
+                print(f"Updated rollups from {sum(updated.values())} new or changed files in {time.time() - started:.2f} seconds")
+        try:
+            series_names = store.series(args.metrics.split(',') if args.metrics else None)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        if not series_names:
+            raise SystemExit(f"No rollups in {args.db}; check --data-dir")
+
+        started = time.perf_counter()
+        if args.by == 'total':
+            table = pd.DataFrame([store.query(s, args.start, args.end) for s in series_names], index=pd.Index(series_names, name='series'))
+        else:
+            frames = {}
+            for s in series_names:
+                if args.by == 'weekday':
+                    frames[s] = store.query_by_weekday(s, args.start, args.end)
+                else:
+                    frames[s] = store.query_periods(s, args.by, args.start, args.end)
+            table = pd.concat(frames, names=['series'])
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    finally:
+        store.close()
+
+    range_text = f"{args.start or 'first day'} to {args.end or 'last day'}"
+    print(f"\n{len(series_names)} series, {range_text}, by {args.by} (answered in {elapsed_ms:.1f} ms):")
+    print(table.round(2).to_string())
+    if args.output:
+        table.to_csv(args.output)
+        print(f"\nWritten to {args.output}")
+
+
+def main(argv=None):
+    from garmin_cli import add_rollup_arguments
+
+    parser = argparse.ArgumentParser(description="Query daily, weekly and monthly rollups of every daily metric")
+    add_rollup_arguments(parser)
+    run_from_args(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
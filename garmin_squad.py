@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from garmin_rate_governor import SharedRateBudget
+
+# Batch mode for a squad: fetch and analyse every athlete on a roster in
+# parallel, one worker process per athlete, and summarise the best exercise
+# day of each athlete in one table.
+#
+# The roster is either a JSON file listing the athletes, or a directory with
+# one data root per athlete (<dir>/<name>/garmin_data). A JSON roster looks like
+#
+#   [{"name": "alice", "email": "alice@example.com", "password_env": "ALICE_GARMIN_PASSWORD"},
+#    {"name": "bob", "data_dir": "/data/bob/garmin_data"}]
+#
+# Athletes without credentials are analysed from their existing data only.
+# All fetching processes share one SharedRateBudget, so adding athletes does
+# not multiply the request rate sent to Garmin Connect.
+
+SQUAD_DIR = 'squad'
+SQUAD_OUTPUT_DIR = 'squad_output'
+
+# Set in each worker process by init_worker()
+rate_budget = None
+
+
+def load_roster(roster, squad_dir=SQUAD_DIR):
+    if os.path.isdir(roster):
+        athletes = [
+            {'name': name, 'data_dir': os.path.join(roster, name, 'garmin_data')}
+            for name in sorted(os.listdir(roster))
+            if os.path.isdir(os.path.join(roster, name, 'garmin_data'))
+        ]
+    else:
+        with open(roster, 'r') as f:
+            athletes = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(roster))
+        for athlete in athletes:
+            if 'name' not in athlete:
+                raise ValueError(f"Roster entry without a name in {roster}: {athlete}")
+            # Relative data directories in the roster are relative to the roster file
+            if athlete.get('data_dir'):
+                athlete['data_dir'] = os.path.join(base_dir, athlete['data_dir'])
+            else:
+                athlete['data_dir'] = os.path.join(squad_dir, athlete['name'], 'garmin_data')
+
+    names = [athlete['name'] for athlete in athletes]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate athlete names in roster: {', '.join(duplicates)}")
+    return athletes
+
+
+def init_worker(shared_budget):
+    global rate_budget
+    rate_budget = shared_budget
+
+
+def fetch_athlete(athlete, workers):
+    import garmin_data_fetch
+
+    password = os.getenv(athlete['password_env']) if athlete.get('password_env') else athlete.get('password')
+    garmin_client = garmin_data_fetch.create_client(athlete['email'], password)
+    garmin_data_fetch.setup(athlete['data_dir'], garmin_client, rate_budget=rate_budget,
+                            metrics_log=os.path.join(athlete['data_dir'], 'fetch_metrics.jsonl'),
+                            metrics_textfile=os.path.join(athlete['data_dir'], 'garmin_fetch.prom'),
+                            metrics_labels={'athlete': athlete['name']})
+    try:
+        return garmin_data_fetch.run_fetch(workers=workers)
+    finally:
+        garmin_data_fetch.manifest.close()
+        garmin_data_fetch.metrics.close()
+
+
+def write_athlete_outputs(results, output_dir, plot):
+    import garmin_analysis
+
+    table = pd.DataFrame({
+        'stress_avg': results['stress_avg'],
+        'sleep_avg': results['sleep_avg'],
+        'body_battery_avg': results['body_battery_avg'],
+        'sleep_change_avg': results['sleep_change_avg'],
+        'combined_score': results['combined_score'],
+    }).reindex(garmin_analysis.DAYS_OF_WEEK)
+    if results['combined_score_ci'] is not None:
+        table = table.join(results['combined_score_ci'].drop(columns=['score']))
+    table.index.name = 'day_of_week'
+    table.to_csv(os.path.join(output_dir, 'day_of_week.csv'))
+    if plot:
+        # Athletes already run in parallel processes, so render each athlete's figures in-process
+        garmin_analysis.plot_results(results, output_dir, workers=1)
+
+
+# Fetch (if the athlete has credentials) and analyse one athlete. Runs in a
+# worker process; its output goes to <output_dir>/<name>/squad.log.
+def run_athlete(athlete, options):
+    import garmin_analysis
+
+    output_dir = os.path.join(options['output_dir'], athlete['name'])
+    os.makedirs(output_dir, exist_ok=True)
+    root = os.path.dirname(os.path.normpath(athlete['data_dir']))
+    summary = {'athlete': athlete['name'], 'days_fetched': None, 'date_range': None, 'best_day': None, 'prob_best': None, 'error': None}
+    started = time.time()
+    with open(os.path.join(output_dir, 'squad.log'), 'w') as log, redirect_stdout(log):
+        try:
+            if athlete.get('email') and not options['skip_fetch']:
+                summary['days_fetched'] = fetch_athlete(athlete, options['workers'])
+            results = garmin_analysis.analyze(
+                athlete['data_dir'],
+                feature_dir=os.path.join(root, 'garmin_features'),
+                cache_dir=os.path.join(root, 'garmin_cache'),
+                rebuild_cache=options['rebuild_cache'],
+                # Athletes already run in parallel processes, so parse each athlete's files in-process
+                workers=1,
+            )
+            garmin_analysis.print_results(results)
+            write_athlete_outputs(results, output_dir, options['plot'])
+            summary['date_range'] = results['date_range']
+            summary['best_day'] = results['best_day']
+            if results['combined_score_ci'] is not None:
+                summary['prob_best'] = round(float(results['combined_score_ci'].loc[results['best_day'], 'prob_best']), 3)
+            if results['combined_score'] is not None:
+                summary.update(results['combined_score'].astype(float).round(3).to_dict())
+        except Exception as e:
+            traceback.print_exc()
+            summary['error'] = f"{type(e).__name__}: {e}"
+    summary['seconds'] = round(time.time() - started, 1)
+    return summary
+
+
+def run_squad(athletes, output_dir=SQUAD_OUTPUT_DIR, processes=None, workers=2, max_requests_per_minute=30,
+              skip_fetch=False, rebuild_cache=False, plot=True):
+    os.makedirs(output_dir, exist_ok=True)
+    options = {
+        'output_dir': output_dir,
+        'workers': workers,
+        'skip_fetch': skip_fetch,
+        'rebuild_cache': rebuild_cache,
+        'plot': plot,
+    }
+    processes = min(processes or os.cpu_count() or 1, len(athletes))
+    budget = SharedRateBudget(max_requests_per_minute)
+    print(f"Running {len(athletes)} athletes on {processes} processes (shared budget {max_requests_per_minute} requests/minute)")
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=(budget,)) as executor:
+        futures = {executor.submit(run_athlete, athlete, options): athlete['name'] for athlete in athletes}
+        for future in as_completed(futures):
+            summary = future.result()
+            status = f"failed ({summary['error']})" if summary['error'] else f"best day {summary['best_day']}"
+            print(f"[{futures[future]}] {status} in {summary['seconds']:.1f} seconds")
+            summaries.append(summary)
+
+    summary_df = pd.DataFrame(summaries).sort_values('athlete').set_index('athlete')
+    summary_df.to_csv(os.path.join(output_dir, 'squad_summary.csv'))
+    return summary_df
+
+
+def print_squad_summary(summary_df):
+    print("\nSquad summary (combined score, lower is better):")
+    print(summary_df.drop(columns=['seconds']).to_string())
+    best_days = summary_df['best_day'].dropna()
+    if not best_days.empty:
+        print("\nBest day counts across the squad:")
+        print(best_days.value_counts().to_string())
+
+
+def run_from_args(args):
+    if args.workers < 1:
+        raise SystemExit("--workers must be at least 1")
+    athletes = load_roster(args.roster, args.squad_dir)
+    if not athletes:
+        raise SystemExit(f"No athletes found in {args.roster}")
+    started = time.time()
+    summary_df = run_squad(athletes, args.output_dir, args.processes, args.workers, args.max_requests_per_minute,
+                           args.skip_fetch, args.rebuild_cache, not args.no_plot)
+    print_squad_summary(summary_df)
+    print(f"\nSquad run complete in {time.time() - started:.1f} seconds; outputs in {args.output_dir}")
+    return 1 if summary_df['error'].notna().any() else 0
+
+
+def main(argv=None):
+    from garmin_cli import add_squad_arguments
+
+    parser = argparse.ArgumentParser(description="Fetch and analyse Garmin data for a whole squad")
+    add_squad_arguments(parser)
+    return run_from_args(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+import os
+import gc
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from garmin_analysis import combine_scores, print_frame_info
+from garmin_constants import DAYS_OF_WEEK
+from garmin_bootstrap import DEFAULT_RESAMPLES, combined_score_table
+from garmin_feature_store import extract_sleep, extract_stress
+from garmin_intraday import body_battery_day_stats
+from garmin_loader import list_data_files, parse_files
+
+# Memory-bounded streaming version of the day-of-week analysis.
+#
+# The raw files of each data type are parsed in date-ordered chunks of
+# --chunk-files files. Each chunk is reduced straight away to int32 day keys
+# (days since 1970-01-01) and float32 values for the few columns the analysis
+# uses, folded into running per-weekday sums and counts, and dropped. What is
+# kept across chunks is a few bytes per day (for the bootstrap), so peak
+# memory is set by the chunk size rather than by the length of the history.
+#
+# A day is folded once: files are read in date order, the last payload for a
+# day within a chunk wins, and a day already folded by an earlier chunk is
+# skipped. The sleep change of the last night in a chunk is folded with the
+# next chunk, once the following night is known.
+#
+# With --max-memory the resident memory of the analysis process is checked
+# after every chunk. Over the limit the chunk size is halved, and the run
+# stops with an error once chunks cannot get any smaller.
+
+DEFAULT_CHUNK_FILES = 64
+MIN_CHUNK_FILES = 8
+# 1970-01-01 was a Thursday: weekday (Monday = 0) = (day key + 3) % 7
+EPOCH_WEEKDAY = 3
+
+SIZE_UNITS = {'': 2 ** 20, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+
+
+# "512M", "2G", "1.5g" or a bare number of MB -> bytes
+def parse_memory_size(text):
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*', str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid memory size {text!r}; use e.g. 512M or 2G")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+# Current resident set size of this process in bytes. Falls back to the peak
+# (getrusage) where /proc is not available.
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryGuard:
+    def __init__(self, max_bytes=None, chunk_files=DEFAULT_CHUNK_FILES):
+        self.max_bytes = max_bytes
+        self.chunk_files = max(1, chunk_files)
+        self.peak = current_rss()
+        if max_bytes is not None and self.peak > max_bytes:
+            raise MemoryError(f"The analysis process already uses {self.peak / 2 ** 20:.0f} MB before reading any data, "
+                              f"more than the {max_bytes / 2 ** 20:.0f} MB limit")
+
+    # Called after each chunk; shrinks the chunks while memory stays over the limit
+    def check(self):
+        rss = current_rss()
+        self.peak = max(self.peak, rss)
+        if self.max_bytes is None or rss <= self.max_bytes:
+            return
+        gc.collect()
+        rss = current_rss()
+        if rss <= self.max_bytes:
+            return
+        if self.chunk_files <= MIN_CHUNK_FILES:
+            raise MemoryError(f"Resident memory {rss / 2 ** 20:.0f} MB is over the {self.max_bytes / 2 ** 20:.0f} MB limit "
+                              f"even with {self.chunk_files}-file chunks")
+        self.chunk_files = max(MIN_CHUNK_FILES, self.chunk_files // 2)
+        print(f"Resident memory {rss / 2 ** 20:.0f} MB is over the limit; reading {self.chunk_files} files per chunk")
+
+
+# Running per-weekday sum and count of one column
+class WeekdayMeans:
+    def __init__(self, column):
+        self.column = column
+        self.sums = np.zeros(7)
+        self.counts = np.zeros(7, dtype=np.int64)
+
+    def add(self, day_keys, values):
+        valid = ~np.isnan(values)
+        weekdays = (day_keys[valid] + EPOCH_WEEKDAY) % 7
+        self.sums += np.bincount(weekdays, weights=values[valid], minlength=7)
+        self.counts += np.bincount(weekdays, minlength=7)
+
+    # Same shape as groupby('day_of_week')[column].mean().reindex(DAYS_OF_WEEK)
+    def means(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(self.counts > 0, self.sums / self.counts, np.nan)
+        if not self.counts.any():
+            return pd.Series(dtype='float64')
+        return pd.Series(means, index=pd.Index(DAYS_OF_WEEK, name='day_of_week'), name=self.column)
+
+
+# Compact per-day columns kept across chunks: int32 day keys and float32 values
+class DayColumns:
+    def __init__(self, columns):
+        self.parts = {column: [] for column in ['day'] + list(columns)}
+
+    def append(self, day_keys, values):
+        self.parts['day'].append(day_keys)
+        for column, column_values in values.items():
+            self.parts[column].append(column_values.astype(np.float32))
+
+    def frame(self):
+        columns = {column: np.concatenate(parts) if parts else np.empty(0, dtype=np.float32) for column, parts in self.parts.items()}
+        days = columns.pop('day').astype(np.int32) if self.parts['day'] else np.empty(0, dtype=np.int32)
+        weekdays = np.asarray(DAYS_OF_WEEK, dtype=object)[(days + EPOCH_WEEKDAY) % 7]
+        return pd.DataFrame({
+            'date': pd.to_datetime(days.astype('datetime64[D]')),
+            'day_of_week': pd.Categorical(weekdays, categories=DAYS_OF_WEEK),
+            **columns,
+        })
+
+
+def day_keys(dates):
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int32)
+
+
+# Keep the last row of each day, in day order, dropping days up to last_day
+def new_days(keys, values, last_day):
+    if len(keys) == 0:
+        return keys, values
+    unique, first_of_reversed = np.unique(keys[::-1], return_index=True)
+    keep = len(keys) - 1 - first_of_reversed
+    keep = keep[unique > last_day] if last_day is not None else keep
+    return keys[keep], {column: column_values[keep] for column, column_values in values.items()}
+
+
+def rows_to_columns(rows, columns):
+    keys = day_keys([row['date'] for row in rows])
+    return keys, {column: np.array([row[column] for row in rows], dtype=np.float64) for column in columns}
+
+
+# (day keys, {column: values}) of one chunk of payloads, per data type
+def stress_columns(payloads):
+    return rows_to_columns(extract_stress(payloads), ['averageStressLevel'])
+
+
+def sleep_columns(payloads):
+    return rows_to_columns(extract_sleep(payloads), ['deepSleepSeconds'])
+
+
+def body_battery_columns(payloads):
+    stats = body_battery_day_stats([day for data in payloads if isinstance(data, list) for day in data])
+    columns = ['max_body_battery', 'min_body_battery', 'avg_body_battery']
+    return day_keys(stats['date']), {column: stats[column].astype(np.float64) for column in columns}
+
+
+STREAMS = {
+    'stress': (stress_columns, ['averageStressLevel']),
+    'sleep': (sleep_columns, ['deepSleepSeconds']),
+    'body_battery': (body_battery_columns, ['max_body_battery', 'min_body_battery', 'avg_body_battery']),
+}
+
+
+# Yield the parsed payloads of a data type in date-ordered chunks sized by the guard
+def stream_chunks(data_type, data_dir, guard, executor=None):
+    paths = list_data_files(data_type, data_dir)
+    start = 0
+    while start < len(paths):
+        chunk = paths[start:start + guard.chunk_files]
+        start += len(chunk)
+        yield [data for _, data in parse_files(chunk, data_type, executor=executor)]
+        guard.check()
+
+
+# Fold one data type into weekday means and compact day columns. For sleep the
+# next-night change is derived on the way, carrying the last night of each chunk over.
+def stream_data_type(data_type, data_dir, guard, executor=None):
+    extract, columns = STREAMS[data_type]
+    is_sleep = data_type == 'sleep'
+    kept = DayColumns(columns + (['sleep_change'] if is_sleep else []))
+    means = {column: WeekdayMeans(column) for column in kept.parts if column != 'day'}
+    last_day = None
+    pending = None
+    files = 0
+
+    def fold(keys, values):
+        kept.append(keys, values)
+        for column, accumulator in means.items():
+            accumulator.add(keys, values[column])
+
+    for payloads in stream_chunks(data_type, data_dir, guard, executor):
+        files += len(payloads)
+        keys, values = new_days(*extract(payloads), last_day)
+        del payloads
+        if len(keys) == 0:
+            continue
+        last_day = keys[-1]
+        if not is_sleep:
+            fold(keys, values)
+            continue
+        deep = values['deepSleepSeconds']
+        if pending is not None:
+            keys = np.concatenate([[pending[0]], keys])
+            deep = np.concatenate([[pending[1]], deep])
+        consecutive = keys[1:] == keys[:-1] + 1
+        change = np.where(consecutive, deep[1:] - deep[:-1], np.nan)
+        fold(keys[:-1], {'deepSleepSeconds': deep[:-1], 'sleep_change': change})
+        pending = (keys[-1], deep[-1])
+    if pending is not None:
+        fold(np.array([pending[0]], dtype=np.int32), {'deepSleepSeconds': np.array([pending[1]]), 'sleep_change': np.array([np.nan])})
+    return kept.frame(), {column: accumulator.means() for column, accumulator in means.items()}, files
+
+
+# Streaming counterpart of garmin_analysis.analyze(), returning the same results
+def analyze_streaming(data_dir='garmin_data', chunk_files=DEFAULT_CHUNK_FILES, max_memory=None, debug=False,
+                      bootstrap_resamples=DEFAULT_RESAMPLES, workers=None):
+    guard = MemoryGuard(max_memory, chunk_files)
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    frames, averages, files = {}, {}, 0
+    try:
+        for data_type in STREAMS:
+            frames[data_type], averages[data_type], type_files = stream_data_type(data_type, data_dir, guard, executor)
+            files += type_files
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    stress_df, sleep_df, body_battery_df = frames['stress'], frames['sleep'], frames['body_battery']
+    if debug:
+        print_frame_info(stress_df, sleep_df, body_battery_df)
+    print(f"Streamed {files} raw files (final chunk size {guard.chunk_files} files); peak resident memory {guard.peak / 2 ** 20:.0f} MB")
+
+    stress_avg = averages['stress']['averageStressLevel']
+    sleep_avg = averages['sleep']['deepSleepSeconds']
+    sleep_change_avg = averages['sleep']['sleep_change']
+    body_battery_avg = averages['body_battery']['avg_body_battery']
+    combined_score, best_day = combine_scores(stress_avg, sleep_change_avg)
+
+    combined_score_ci = None
+    if combined_score is not None and bootstrap_resamples:
+        combined_score_ci = combined_score_table(stress_df, sleep_df, bootstrap_resamples, seed=0)
+        combined_score_ci.insert(0, 'score', combined_score)
+
+    dates = [df['date'] for df in frames.values() if not df.empty]
+    date_range = None
+    if dates:
+        start_date = min(d.min() for d in dates)
+        end_date = max(d.max() for d in dates)
+        date_range = f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"
+
+    return {
+        'stress_df': stress_df,
+        'sleep_df': sleep_df,
+        'body_battery_df': body_battery_df,
+        'stress_avg': stress_avg,
+        'sleep_avg': sleep_avg,
+        'body_battery_avg': body_battery_avg,
+        'sleep_change_avg': sleep_change_avg,
+        'combined_score': combined_score,
+        'best_day': best_day,
+        'combined_score_ci': combined_score_ci,
+        'date_range': date_range,
+    }
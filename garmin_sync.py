@@ -0,0 +1,248 @@
+import os
+import sys
+import time
+import signal
+import argparse
+import datetime
+import threading
+import traceback
+
+import garmin_data_fetch
+
+# Long-running sync daemon.
+#
+# Logs in once, reusing the session tokens saved in a tokenstore directory
+# (and saving them back after every cycle, so refreshed tokens survive a
+# restart), then every --interval minutes:
+#
+#   1. fetches every day of the history that was never fetched (e.g. days
+#      missed while the daemon was down), as the fetch stage does; failed
+#      days are left to 'fetch --repair-gaps';
+#   2. refetches the last --refresh-days days (today and yesterday by
+#      default), because sleep and other data keep arriving after midnight,
+#      and rewrites only the payloads whose content changed;
+#   3. runs only the downstream stages that read a data type that changed:
+#      the feature store ingest, the day-of-week analysis and plots, the
+#      intraday store, the rollups and the lagged correlations.
+#
+# The first cycle runs every stage, so outputs catch up with data fetched
+# while the daemon was not running; all stages are incremental.
+
+DEFAULT_REFRESH_DAYS = 2
+AUTH_ERROR = 'GarminConnectAuthenticationError'
+
+ANALYSIS_DATA_TYPES = ('sleep', 'stress', 'body_battery')
+INTRADAY_DATA_TYPES = ('heart_rate', 'stress')
+FEATURE_DATA_TYPES = ('sleep', 'stress', 'body_battery', 'heart_rate', 'hrv', 'resting_heart_rate', 'training_readiness')
+
+
+def run_ingest(options, changed):
+    from garmin_feature_store import METRICS, feature_store_available, ingest
+
+    if not feature_store_available():
+        return
+    metrics = [metric for metric, (data_type, _, _) in METRICS.items() if changed is None or data_type in changed]
+    counts = ingest(options['data_dir'], options['feature_dir'], metrics=metrics)
+    print(f"Ingested {sum(counts.values())} new or changed files into {options['feature_dir']}")
+
+
+def run_analysis(options, changed):
+    import garmin_analysis
+
+    results = garmin_analysis.analyze(options['data_dir'], options['feature_dir'], options['cache_dir'])
+    garmin_analysis.print_results(results)
+    if options['plot']:
+        garmin_analysis.plot_results(results, options['output_dir'])
+
+
+def run_intraday(options, changed):
+    from garmin_intraday import INTRADAY_STREAMS, build_intraday_store
+
+    for stream, (data_type, _, _, _) in INTRADAY_STREAMS.items():
+        if changed is None or data_type in changed:
+            days = build_intraday_store(stream, options['data_dir'], options['intraday_dir'])
+            print(f"Updated {days} days of the intraday {stream} store")
+
+
+def run_rollups(options, changed):
+    from garmin_feature_store import METRICS
+    from garmin_rollups import RollupStore
+
+    store = RollupStore(options['rollup_db'])
+    try:
+        updated = store.update(options['data_dir'], metrics=[
+            metric for metric, (data_type, _, _) in METRICS.items() if changed is None or data_type in changed])
+    finally:
+        store.close()
+    print(f"Folded {sum(updated.values())} new or changed files into {options['rollup_db']}")
+
+
+def run_correlations(options, changed):
+    from garmin_correlation import correlation_table, load_daily_metrics
+
+    daily = load_daily_metrics(options['data_dir'], options['feature_dir'])
+    if daily.empty:
+        return
+    output = os.path.join(options['output_dir'], 'correlations.csv')
+    correlation_table(daily).to_csv(output, index=False)
+    print(f"Wrote lagged correlations of {daily.shape[1]} daily series to {output}")
+
+
+# Downstream stages in run order: name -> (raw data types it reads, function)
+STAGES = {
+    'ingest': (FEATURE_DATA_TYPES, run_ingest),
+    'analysis': (ANALYSIS_DATA_TYPES, run_analysis),
+    'intraday': (INTRADAY_DATA_TYPES, run_intraday),
+    'rollups': (FEATURE_DATA_TYPES, run_rollups),
+    'correlations': (FEATURE_DATA_TYPES, run_correlations),
+}
+
+
+# Run the stages that depend on a changed data type (all of them when changed is None).
+# A failing stage is reported and does not stop the others or the daemon.
+def run_stages(options, changed):
+    ran = []
+    for name, (data_types, run) in STAGES.items():
+        if name not in options['stages']:
+            continue
+        if changed is not None and not changed.intersection(data_types):
+            continue
+        started = time.time()
+        try:
+            run(options, changed)
+            ran.append(name)
+            print(f"[SYNC] {name} stage done in {time.time() - started:.1f} seconds")
+        except Exception:
+            print(f"[SYNC] {name} stage failed:")
+            traceback.print_exc()
+    return ran
+
+
+# One sync: catch up on missed days, then refresh the most recent ones.
+# Returns the set of data types with new or changed payloads.
+def sync_once(refresh_days=DEFAULT_REFRESH_DAYS, workers=2):
+    with garmin_data_fetch.api_calls_lock:
+        garmin_data_fetch.api_calls.clear()
+        garmin_data_fetch.payloads_written.clear()
+    today = datetime.date.today()
+    refresh_start = today - datetime.timedelta(days=refresh_days - 1)
+
+    history_start = garmin_data_fetch.known_history_start()
+    if history_start is None:
+        print("[SYNC] No data fetched yet; running a full fetch first")
+        garmin_data_fetch.run_fetch(workers=workers)
+    else:
+        # Every day before the refresh window that was never fetched, from the first such day
+        jobs = []
+        missing_end = refresh_start - datetime.timedelta(days=1)
+        missing_start = garmin_data_fetch.first_planned_date(history_start, missing_end) if history_start <= missing_end else None
+        if missing_start is not None:
+            jobs.extend(garmin_data_fetch.build_fetch_jobs(missing_start, missing_end))
+        jobs.extend(garmin_data_fetch.build_refresh_jobs([refresh_start + datetime.timedelta(days=i) for i in range(refresh_days)]))
+        garmin_data_fetch.run_jobs(jobs, workers)
+
+    with garmin_data_fetch.api_calls_lock:
+        written = dict(garmin_data_fetch.payloads_written)
+        calls = sum(garmin_data_fetch.api_calls.values())
+    changes = ", ".join(f"{data_type} {count}" for data_type, count in sorted(written.items())) or "none"
+    print(f"[SYNC] {calls} API calls; new or changed payloads: {changes}")
+    return set(written)
+
+
+# Log in again when the last cycle failed on authentication (expired or revoked session)
+def renew_session_if_needed(options, cycle_started):
+    failures = garmin_data_fetch.manifest.failures_since(cycle_started)
+    if not any(error_class == AUTH_ERROR for _, error_class, _ in failures) or options['garmin_client'] is not None:
+        return
+    print("[SYNC] Authentication failed during the sync; logging in again")
+    try:
+        garmin_data_fetch.client = garmin_data_fetch.create_client(tokenstore=options['tokenstore'])
+    except Exception as e:
+        print(f"[SYNC] Login failed, retrying next cycle: {e}")
+
+
+def run_daemon(options, once=False, stop=None):
+    stop = stop or threading.Event()
+    garmin_data_fetch.setup(options['data_dir'], options['garmin_client'], archive=options['archive'],
+                            tokenstore=options['tokenstore'], metrics_log=options['metrics_log'],
+                            metrics_textfile=options['metrics_textfile'])
+    print(f"[SYNC] Syncing {options['data_dir']} every {options['interval']:g} minutes "
+          f"(refreshing the last {options['refresh_days']} days)")
+    first_cycle = True
+    try:
+        while not stop.is_set():
+            cycle_started = time.time()
+            print(f"\n[SYNC] Cycle started at {datetime.datetime.now().isoformat(timespec='seconds')}")
+            try:
+                changed = sync_once(options['refresh_days'], options['workers'])
+                synced = time.time()
+                # The first cycle runs every stage
+                ran = run_stages(options, None if first_cycle else changed)
+                first_cycle = False
+                if ran:
+                    print(f"[SYNC] Outputs updated ({', '.join(ran)}) {time.time() - cycle_started:.1f} seconds after the sync started "
+                          f"({synced - cycle_started:.1f} seconds fetching)")
+                else:
+                    print("[SYNC] Nothing changed; no stages to run")
+                renew_session_if_needed(options, cycle_started)
+                if options['tokenstore']:
+                    garmin_data_fetch.save_session(garmin_data_fetch.client, options['tokenstore'])
+            except Exception:
+                print("[SYNC] Sync cycle failed; retrying next cycle:")
+                traceback.print_exc()
+            if once:
+                break
+            stop.wait(max(0.0, cycle_started + options['interval'] * 60 - time.time()))
+    finally:
+        garmin_data_fetch.manifest.close()
+        garmin_data_fetch.metrics.close()
+    print("[SYNC] Stopped")
+
+
+def run_from_args(args, garmin_client=None):
+    if args.refresh_days < 1:
+        raise SystemExit("--refresh-days must be at least 1")
+    if args.workers < 1:
+        raise SystemExit("--workers must be at least 1")
+    stages = set(args.stages.split(',')) if args.stages else set(STAGES)
+    metrics_log, metrics_textfile = garmin_data_fetch.metrics_paths(args)
+    unknown = stages - set(STAGES)
+    if unknown:
+        raise SystemExit(f"Unknown stages: {', '.join(sorted(unknown))} (choose from {', '.join(STAGES)})")
+    options = {
+        'data_dir': args.data_dir,
+        'feature_dir': args.feature_dir,
+        'cache_dir': args.cache_dir,
+        'intraday_dir': args.intraday_dir,
+        'rollup_db': args.rollup_db,
+        'output_dir': args.output_dir,
+        'tokenstore': args.tokenstore,
+        'interval': args.interval,
+        'refresh_days': args.refresh_days,
+        'workers': args.workers,
+        'archive': args.archive,
+        'plot': not args.no_plot,
+        'stages': stages,
+        'garmin_client': garmin_client,
+        'metrics_log': metrics_log,
+        'metrics_textfile': metrics_textfile,
+    }
+    stop = threading.Event()
+    # SIGTERM (e.g. from systemd) finishes the current cycle and exits cleanly
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        run_daemon(options, once=args.once, stop=stop)
+    except KeyboardInterrupt:
+        print("\n[SYNC] Interrupted")
+
+
+def main(argv=None):
+    from garmin_cli import add_sync_arguments
+
+    parser = argparse.ArgumentParser(description="Keep Garmin data and reports up to date in the background")
+    add_sync_arguments(parser)
+    run_from_args(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
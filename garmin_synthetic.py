@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import sys
+import random
+import argparse
+import datetime
+import threading
+from types import SimpleNamespace
+
+# Synthetic Garmin data for benchmarks and offline runs.
+#
+# The payload builders produce the same shapes the Garmin Connect endpoints
+# return and the rest of this project reads (dailySleepDTO, avgStressLevel,
+# stressValuesArray, heartRateValues, bodyBatteryValuesArray, ...), with
+# intraday arrays at the device's usual sampling intervals. Values are drawn
+# from a seeded RNG per (user, date), so a given tree is reproducible.
+
+HEART_RATE_INTERVAL_SECONDS = 120
+STRESS_INTERVAL_SECONDS = 180
+SLEEP_MOVEMENT_INTERVAL_SECONDS = 60
+
+
+def _rng(seed, user, day):
+    return random.Random(f"{seed}:{user}:{day.isoformat()}")
+
+
+def _day_start_ms(day, utc_offset_hours=0):
+    midnight = datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc)
+    return int((midnight.timestamp() - utc_offset_hours * 3600) * 1000)
+
+
+def _timestamps(day, utc_offset_hours):
+    start = datetime.datetime(day.year, day.month, day.day)
+    gmt = start - datetime.timedelta(hours=utc_offset_hours)
+    return gmt.strftime('%Y-%m-%dT%H:%M:%S.0'), start.strftime('%Y-%m-%dT%H:%M:%S.0')
+
+
+# Body battery charges overnight and drains through the day
+def _body_battery_levels(rng, samples):
+    level = rng.randint(5, 40)
+    levels = []
+    for i in range(samples):
+        hour = i * 24 / samples
+        step = rng.choice((0, 1, 1, 2)) if hour < 7 else rng.choice((-1, -1, 0, 0, 1))
+        level = max(5, min(100, level + step))
+        levels.append(level)
+    return levels
+
+
+def sleep_payload(day, rng, utc_offset_hours=0):
+    deep = rng.randint(2400, 7800)
+    light = rng.randint(10000, 16000)
+    rem = rng.randint(3000, 7000)
+    awake = rng.randint(300, 2400)
+    start_ms = _day_start_ms(day, utc_offset_hours) - 2 * 3600 * 1000
+    total = deep + light + rem + awake
+    return {
+        'dailySleepDTO': {
+            'id': int(start_ms / 1000),
+            'calendarDate': day.isoformat(),
+            'sleepTimeSeconds': deep + light + rem,
+            'deepSleepSeconds': deep,
+            'lightSleepSeconds': light,
+            'remSleepSeconds': rem,
+            'awakeSleepSeconds': awake,
+            'sleepStartTimestampGMT': start_ms,
+            'sleepEndTimestampGMT': start_ms + total * 1000,
+            'averageRespirationValue': round(rng.uniform(12, 17), 1),
+            'avgSleepStress': round(rng.uniform(10, 30), 1),
+        },
+        'sleepMovement': [
+            {
+                'startGMT': start_ms + i * SLEEP_MOVEMENT_INTERVAL_SECONDS * 1000,
+                'endGMT': start_ms + (i + 1) * SLEEP_MOVEMENT_INTERVAL_SECONDS * 1000,
+                'activityLevel': round(rng.random() * 3, 3),
+            }
+            for i in range(total // SLEEP_MOVEMENT_INTERVAL_SECONDS)
+        ],
+        'sleepHeartRate': [
+            {'value': rng.randint(45, 65), 'startGMT': start_ms + i * HEART_RATE_INTERVAL_SECONDS * 1000}
+            for i in range(total // HEART_RATE_INTERVAL_SECONDS)
+        ],
+    }
+
+
+def stress_payload(day, rng, utc_offset_hours=0):
+    start_ms = _day_start_ms(day, utc_offset_hours)
+    samples = 86400 // STRESS_INTERVAL_SECONDS
+    stress_values = [[start_ms + i * STRESS_INTERVAL_SECONDS * 1000, rng.choice((-1, -2)) if rng.random() < 0.05 else rng.randint(0, 99)]
+                     for i in range(samples)]
+    levels = [v for _, v in stress_values if v >= 0]
+    body_battery = [[start_ms + i * STRESS_INTERVAL_SECONDS * 1000, 'MEASURED', level, 2.0]
+                    for i, level in enumerate(_body_battery_levels(rng, samples))]
+    gmt, local = _timestamps(day, utc_offset_hours)
+    return {
+        'userProfilePK': 1,
+        'calendarDate': day.isoformat(),
+        'startTimestampGMT': gmt,
+        'startTimestampLocal': local,
+        'maxStressLevel': max(levels),
+        'avgStressLevel': round(sum(levels) / len(levels)),
+        'stressValueDescriptorsDTOList': [{'key': 'timestamp', 'index': 0}, {'key': 'stressLevel', 'index': 1}],
+        'stressValuesArray': stress_values,
+        'bodyBatteryValueDescriptorsDTOList': [{'bodyBatteryValueDescriptorIndex': 0, 'bodyBatteryValueDescriptorKey': 'timestamp'}],
+        'bodyBatteryValuesArray': body_battery,
+    }
+
+
+def heart_rate_payload(day, rng, utc_offset_hours=0):
+    start_ms = _day_start_ms(day, utc_offset_hours)
+    values = []
+    for i in range(86400 // HEART_RATE_INTERVAL_SECONDS):
+        hour = i * HEART_RATE_INTERVAL_SECONDS / 3600
+        base = 55 if hour < 6 else 72
+        if 17 <= hour < 18 and rng.random() < 0.9:
+            base = 135
+        values.append([start_ms + i * HEART_RATE_INTERVAL_SECONDS * 1000, None if rng.random() < 0.02 else base + rng.randint(-5, 5)])
+    measured = [v for _, v in values if v is not None]
+    gmt, local = _timestamps(day, utc_offset_hours)
+    return {
+        'userProfilePK': 1,
+        'calendarDate': day.isoformat(),
+        'startTimestampGMT': gmt,
+        'startTimestampLocal': local,
+        'maxHeartRate': max(measured),
+        'minHeartRate': min(measured),
+        'restingHeartRate': min(measured) + 3,
+        'heartRateValueDescriptors': [{'key': 'timestamp', 'index': 0}, {'key': 'heartrate', 'index': 1}],
+        'heartRateValues': values,
+    }
+
+
+def hrv_payload(day, rng, utc_offset_hours=0):
+    last_night = rng.randint(35, 75)
+    start_ms = _day_start_ms(day, utc_offset_hours) - 2 * 3600 * 1000
+    return {
+        'userProfilePk': 1,
+        'hrvSummary': {
+            'calendarDate': day.isoformat(),
+            'weeklyAvg': last_night + rng.randint(-5, 5),
+            'lastNightAvg': last_night,
+            'lastNight5MinHigh': last_night + rng.randint(5, 25),
+            'status': rng.choice(('BALANCED', 'BALANCED', 'UNBALANCED', 'LOW')),
+        },
+        'hrvReadings': [{'hrvValue': last_night + rng.randint(-15, 15), 'readingTimeGMT': start_ms + i * 300000} for i in range(90)],
+    }
+
+
+def training_readiness_payload(day, rng, utc_offset_hours=0):
+    score = rng.randint(20, 95)
+    return [{
+        'userProfilePK': 1,
+        'calendarDate': day.isoformat(),
+        'score': score,
+        'level': 'HIGH' if score >= 75 else 'MODERATE' if score >= 50 else 'LOW',
+        'sleepScore': rng.randint(40, 95),
+        'recoveryTime': rng.randint(0, 2400),
+        'hrvWeeklyAverage': rng.randint(35, 75),
+    }]
+
+
+def resting_heart_rate_payload(day, rng, utc_offset_hours=0):
+    return resting_heart_rate_range_payload([(day, rng)])
+
+
+def resting_heart_rate_range_payload(days_and_rngs):
+    days = [day for day, _ in days_and_rngs]
+    return {
+        'userProfileId': 1,
+        'statisticsStartDate': min(days).isoformat(),
+        'statisticsEndDate': max(days).isoformat(),
+        'allMetrics': {'metricsMap': {'WELLNESS_RESTING_HEART_RATE': [
+            {'value': float(rng.randint(48, 62)), 'calendarDate': day.isoformat()} for day, rng in days_and_rngs
+        ]}},
+        'groupedMetrics': None,
+    }
+
+
+def body_battery_payload(days_and_rngs, utc_offset_hours=0):
+    result = []
+    for day, rng in days_and_rngs:
+        start_ms = _day_start_ms(day, utc_offset_hours)
+        levels = _body_battery_levels(rng, 86400 // STRESS_INTERVAL_SECONDS)
+        values = [[start_ms + i * STRESS_INTERVAL_SECONDS * 1000, level] for i, level in enumerate(levels)]
+        gmt, local = _timestamps(day, utc_offset_hours)
+        result.append({
+            'date': day.isoformat(),
+            'charged': sum(max(0, b - a) for a, b in zip(levels, levels[1:])),
+            'drained': sum(max(0, a - b) for a, b in zip(levels, levels[1:])),
+            'startTimestampGMT': gmt,
+            'startTimestampLocal': local,
+            'bodyBatteryValuesArray': values,
+            'bodyBatteryValueDescriptorDTOList': [{'bodyBatteryValueDescriptorIndex': 0, 'bodyBatteryValueDescriptorKey': 'timestamp'}],
+        })
+    return result
+
+
+# What the endpoints return for a day without data
+def empty_payload(data_type, day):
+    if data_type == 'heart_rate':
+        return {'userProfilePK': 1, 'calendarDate': day.isoformat(), 'startTimestampGMT': None, 'startTimestampLocal': None,
+                'maxHeartRate': None, 'minHeartRate': None, 'restingHeartRate': None, 'heartRateValues': None}
+    if data_type == 'stress':
+        return {'userProfilePK': 1, 'calendarDate': day.isoformat(), 'maxStressLevel': None, 'avgStressLevel': None,
+                'stressValuesArray': None, 'bodyBatteryValuesArray': None}
+    if data_type == 'training_readiness':
+        return []
+    return {}
+
+
+# Per-day data type -> payload builder
+DAILY_PAYLOADS = {
+    'sleep': sleep_payload,
+    'stress': stress_payload,
+    'heart_rate': heart_rate_payload,
+    'hrv': hrv_payload,
+    'training_readiness': training_readiness_payload,
+    'resting_heart_rate': resting_heart_rate_payload,
+}
+
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+# Write a garmin_data tree per user under root (root/<user>/garmin_data), laid out
+# exactly as the fetcher writes it. Returns the list of data directories.
+def write_synthetic_tree(root, days=365, users=1, end_date=None, seed=0, data_types=None, utc_offset_hours=1):
+    end_date = end_date or datetime.date.today() - datetime.timedelta(days=1)
+    start_date = end_date - datetime.timedelta(days=days - 1)
+    data_types = data_types or list(DAILY_PAYLOADS) + ['body_battery']
+    data_dirs = []
+    for user in range(users):
+        data_dir = os.path.join(root, f"athlete_{user + 1}", 'garmin_data') if users > 1 else os.path.join(root, 'garmin_data')
+        for data_type in data_types:
+            os.makedirs(os.path.join(data_dir, data_type), exist_ok=True)
+        week = []
+        for offset in range(days):
+            day = start_date + datetime.timedelta(days=offset)
+            for data_type in data_types:
+                if data_type in DAILY_PAYLOADS:
+                    payload = DAILY_PAYLOADS[data_type](day, _rng(seed, user, day), utc_offset_hours)
+                    _write_json(os.path.join(data_dir, data_type, f"{day.isoformat()}.json"), payload)
+            week.append(day)
+            if 'body_battery' in data_types and (len(week) == 7 or day == end_date):
+                payload = body_battery_payload([(d, _rng(seed, user, d)) for d in week], utc_offset_hours)
+                _write_json(os.path.join(data_dir, 'body_battery', f"{week[0].isoformat()}_{week[-1].isoformat()}.json"), payload)
+                week = []
+        data_dirs.append(data_dir)
+    return data_dirs
+
+
+# Local stand-in for garminconnect.Garmin, serving synthetic payloads.
+#
+# latency is the mean simulated round trip in seconds. throttle_rate is the
+# probability that a call fails with GarminConnectTooManyRequestsError, and
+# retry_after (if set) is sent back as a Retry-After header on those errors.
+class MockGarminClient:
+    def __init__(self, latency=0.05, throttle_rate=0.0, error_rate=0.0, retry_after=None, seed=0, user=0, first_date=None):
+        self.latency = latency
+        # Days before first_date come back empty, like an account's days before its first sync
+        self.first_date = first_date
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.user = user
+        self.display_name = f"athlete_{user + 1}"
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+
+    def login(self, *args, **kwargs):
+        return None, None
+
+    def _request(self):
+        from garminconnect import GarminConnectConnectionError, GarminConnectTooManyRequestsError
+
+        with self.lock:
+            self.calls += 1
+            roll = self.random.random()
+            jitter = self.random.uniform(0.5, 1.5)
+        if self.latency:
+            time.sleep(self.latency * jitter)
+        if roll < self.throttle_rate:
+            with self.lock:
+                self.throttled += 1
+            error = GarminConnectTooManyRequestsError("Too many requests")
+            headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else {}
+            error.response = SimpleNamespace(status_code=429, headers=headers)
+            raise error
+        if roll < self.throttle_rate + self.error_rate:
+            raise GarminConnectConnectionError("Simulated connection error")
+
+    def _daily(self, data_type, cdate):
+        self._request()
+        day = datetime.date.fromisoformat(cdate)
+        if self.first_date and day < self.first_date:
+            return empty_payload(data_type, day)
+        return DAILY_PAYLOADS[data_type](day, _rng(self.seed, self.user, day))
+
+    def get_sleep_data(self, cdate):
+        return self._daily('sleep', cdate)
+
+    def get_stress_data(self, cdate):
+        return self._daily('stress', cdate)
+
+    def get_heart_rates(self, cdate):
+        return self._daily('heart_rate', cdate)
+
+    def get_hrv_data(self, cdate):
+        return self._daily('hrv', cdate)
+
+    def get_training_readiness(self, cdate):
+        return self._daily('training_readiness', cdate)
+
+    def get_rhr_day(self, cdate):
+        return self._daily('resting_heart_rate', cdate)
+
+    # Only the resting heart rate range endpoint is served here
+    def connectapi(self, path, params=None):
+        if not path.startswith('/userstats-service/wellness/daily/'):
+            raise NotImplementedError(f"MockGarminClient does not serve {path}")
+        self._request()
+        start = datetime.date.fromisoformat(params['fromDate'])
+        end = datetime.date.fromisoformat(params['untilDate'])
+        days = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+        return resting_heart_rate_range_payload([(day, _rng(self.seed, self.user, day)) for day in days])
+
+    def get_body_battery(self, startdate, enddate=None):
+        self._request()
+        start = datetime.date.fromisoformat(startdate)
+        end = datetime.date.fromisoformat(enddate or startdate)
+        days = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+        return body_battery_payload([(day, _rng(self.seed, self.user, day)) for day in days])
+
+
+def run_from_args(args):
+    started = time.time()
+    data_dirs = write_synthetic_tree(args.root, days=int(args.years * 365), users=args.users, seed=args.seed)
+    print(f"Wrote {len(data_dirs)} synthetic data directories under {args.root} in {time.time() - started:.1f} seconds")
+
+
+def main(argv=None):
+    from garmin_cli import add_synthetic_arguments
+
+    parser = argparse.ArgumentParser(description="Write a synthetic garmin_data tree")
+    add_synthetic_arguments(parser)
+    run_from_args(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())